@@ -0,0 +1,428 @@
+"""
+Search backends for Duplicate Finder
+
+Every backend answers the same question: which rows of the TF-IDF matrix
+should be scored for a vectorized item, and what are their cosine
+similarities. The exact backend scores every row (the original brute-force
+scan). The LSH backends only score rows that share at least one band of
+their signature with the item, trading some recall for speed:
+
+    minhash     MinHash over the set of vocabulary terms of each row
+    hyperplane  random-hyperplane (SimHash) bits of the TF-IDF vectors
+
+The inverted backend keeps a posting list of rows per feature and only
+scores rows sharing at least min_overlap of the item's distinct features.
+It suits character n-gram indexes, whose rows have many features but share
+few of them with an unrelated item; with min_overlap=0 it finds every row
+with a nonzero similarity.
+
+Candidates are always rescored exactly, so reported similarities are true
+cosine values; only rows the LSH tables never propose, or the overlap
+prefilter drops, can be missed.
+"""
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+BACKENDS = ('exact', 'minhash', 'hyperplane', 'inverted')
+
+# Mersenne prime used by the MinHash universal hash family
+MINHASH_PRIME = (1 << 31) - 1
+
+# Share of an item's distinct features a row must contain to be scored
+DEFAULT_MIN_OVERLAP = 0.3
+
+INVERTED_DIR = 'inverted'
+
+
+class ExactBackend:
+    """Brute-force cosine similarity against every row"""
+
+    name = 'exact'
+
+    def __init__(self, tfidf_matrix):
+        self.matrix = tfidf_matrix
+
+    def score(self, item_vector):
+        """
+        Returns:
+            (rows, similarities) for every row of the matrix
+        """
+        similarities = np.asarray(self.matrix @ item_vector.toarray()[0]).ravel()
+        return np.arange(len(similarities)), similarities
+
+    def describe(self):
+        return {'backend': self.name}
+
+
+class LSHBackend:
+    """
+    Banded locality-sensitive hashing over per-row signatures
+
+    Each row's signature has bands * rows values; a row becomes a candidate
+    for an item when all `rows` values of at least one band are equal.
+    Bucket tables are kept as sorted key arrays per band, so lookups are
+    binary searches and the tables can be saved as plain .npy files.
+    """
+
+    name = None
+
+    def __init__(self, tfidf_matrix, bands=20, rows=5, seed=0, tables=None):
+        self.matrix = tfidf_matrix
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        self._init_hashes(tfidf_matrix.shape[1])
+        if tables is None:
+            tables = self._build_tables()
+        self.sorted_keys, self.order = tables
+
+    # Subclasses define the signature of a batch of CSR rows
+    def _init_hashes(self, n_features):
+        raise NotImplementedError
+
+    def signatures(self, vectors):
+        raise NotImplementedError
+
+    def _band_keys(self, signatures):
+        """Collapse each band of a signature into one uint64 bucket key"""
+        n = signatures.shape[0]
+        sig = signatures.reshape(n, self.bands, self.rows).astype(np.uint64)
+        multipliers = np.random.RandomState(self.seed + 1).randint(
+            1, 1 << 62, size=self.rows, dtype=np.int64
+        ).astype(np.uint64) | np.uint64(1)
+        with np.errstate(over='ignore'):
+            return (sig * multipliers).sum(axis=2, dtype=np.uint64)
+
+    def _build_tables(self, chunk_rows=10000):
+        n = self.matrix.shape[0]
+        keys = np.empty((self.bands, n), dtype=np.uint64)
+        for start in range(0, n, chunk_rows):
+            block = self.matrix[start:start + chunk_rows]
+            keys[:, start:start + block.shape[0]] = self._band_keys(self.signatures(block)).T
+        order = np.argsort(keys, axis=1, kind='stable')
+        sorted_keys = np.take_along_axis(keys, order, axis=1)
+        return sorted_keys, order.astype(np.int32 if n < 2**31 else np.int64)
+
+    def candidates(self, item_vector):
+        """Rows sharing at least one band bucket with the item"""
+        if item_vector.nnz == 0:
+            return np.array([], dtype=np.int64)
+        keys = self._band_keys(self.signatures(item_vector))[0]
+        found = []
+        for band, key in enumerate(keys):
+            lo = np.searchsorted(self.sorted_keys[band], key, side='left')
+            hi = np.searchsorted(self.sorted_keys[band], key, side='right')
+            if hi > lo:
+                found.append(self.order[band, lo:hi])
+        if not found:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(found)).astype(np.int64)
+
+    def score(self, item_vector):
+        """
+        Returns:
+            (rows, similarities) for the candidate rows only
+        """
+        rows = self.candidates(item_vector)
+        if len(rows) == 0:
+            return rows, np.array([], dtype=np.float64)
+        similarities = np.asarray(self.matrix[rows] @ item_vector.toarray()[0]).ravel()
+        return rows, similarities
+
+    def candidate_probability(self, similarity):
+        """Chance that a row with this similarity becomes a candidate"""
+        p = self.collision_probability(similarity)
+        return 1 - (1 - p ** self.rows) ** self.bands
+
+    def collision_probability(self, similarity):
+        raise NotImplementedError
+
+    def describe(self):
+        return {'backend': self.name, 'bands': self.bands, 'rows': self.rows, 'seed': self.seed}
+
+    def save(self, directory, updates=0):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'sorted_keys.npy'), self.sorted_keys)
+        np.save(os.path.join(directory, 'order.npy'), self.order)
+        with open(os.path.join(directory, 'params.json'), 'w') as f:
+            json.dump(dict(self.describe(), **_matrix_params(self.matrix, updates)), f)
+
+    @classmethod
+    def load(cls, directory, tfidf_matrix, updates=0):
+        with open(os.path.join(directory, 'params.json')) as f:
+            params = json.load(f)
+        expected = _matrix_params(tfidf_matrix, updates)
+        if {key: params.get(key) for key in expected} != expected:
+            raise ValueError("LSH tables do not match the index")
+        tables = (
+            np.load(os.path.join(directory, 'sorted_keys.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'order.npy'), mmap_mode='r'),
+        )
+        return cls(tfidf_matrix, params['bands'], params['rows'], params['seed'], tables)
+
+
+class MinHashBackend(LSHBackend):
+    """MinHash over the vocabulary terms (word shingles) present in each row"""
+
+    name = 'minhash'
+
+    def _init_hashes(self, n_features):
+        rng = np.random.RandomState(self.seed)
+        n_hashes = self.bands * self.rows
+        self.hash_a = rng.randint(1, MINHASH_PRIME, size=n_hashes).astype(np.int64)
+        self.hash_b = rng.randint(0, MINHASH_PRIME, size=n_hashes).astype(np.int64)
+
+    def signatures(self, vectors):
+        n = vectors.shape[0]
+        sig = np.full((n, len(self.hash_a)), MINHASH_PRIME, dtype=np.int64)
+        nonempty = np.diff(vectors.indptr) > 0
+        if vectors.nnz:
+            hashes = (np.outer(vectors.indices.astype(np.int64), self.hash_a)
+                      + self.hash_b) % MINHASH_PRIME
+            sig[nonempty] = np.minimum.reduceat(hashes, vectors.indptr[:-1][nonempty], axis=0)
+        return sig
+
+    def collision_probability(self, similarity):
+        # MinHash collides with the Jaccard similarity of the term sets; for
+        # TF-IDF cosine this is only an approximation of it
+        return similarity
+
+
+class HyperplaneBackend(LSHBackend):
+    """Random-hyperplane signs of the TF-IDF vectors (cosine LSH)"""
+
+    name = 'hyperplane'
+
+    def _init_hashes(self, n_features):
+        if self.rows > 64:
+            raise ValueError("hyperplane backend supports at most 64 rows per band")
+        rng = np.random.RandomState(self.seed)
+        self.planes = rng.standard_normal((n_features, self.bands * self.rows)).astype(np.float32)
+
+    def signatures(self, vectors):
+        return (np.asarray(vectors @ self.planes) > 0).astype(np.uint8)
+
+    def _band_keys(self, signatures):
+        n = signatures.shape[0]
+        bits = signatures.reshape(n, self.bands, self.rows).astype(np.uint64)
+        weights = np.left_shift(np.uint64(1), np.arange(self.rows, dtype=np.uint64))
+        return (bits * weights).sum(axis=2, dtype=np.uint64)
+
+    def collision_probability(self, similarity):
+        return 1 - np.arccos(np.clip(similarity, -1, 1)) / np.pi
+
+
+LSH_BACKENDS = {'minhash': MinHashBackend, 'hyperplane': HyperplaneBackend}
+
+
+class InvertedBackend:
+    """
+    Posting lists of rows per feature with a minimum-overlap prefilter
+
+    The postings of all features are one array of rows sorted by feature,
+    plus a pointer array with the start of each feature's list (the CSC
+    layout of the matrix pattern), so they can be saved as .npy files. The
+    postings of the item's features are merged into a shared-feature count
+    per row, and only rows reaching the overlap are rescored.
+    """
+
+    name = 'inverted'
+
+    def __init__(self, tfidf_matrix, min_overlap=DEFAULT_MIN_OVERLAP, postings=None):
+        if not 0 <= min_overlap <= 1:
+            raise ValueError("min_overlap must be between 0 and 1")
+        self.matrix = tfidf_matrix
+        self.min_overlap = min_overlap
+        if postings is None:
+            postings = self._build_postings()
+        self.pointers, self.rows = postings
+
+    def _build_postings(self):
+        n_rows, n_features = self.matrix.shape
+        columns = np.asarray(self.matrix.indices)
+        row_ids = np.repeat(np.arange(n_rows, dtype=np.int32 if n_rows < 2**31 else np.int64),
+                            np.diff(self.matrix.indptr))
+        pointers = np.zeros(n_features + 1, dtype=np.int64)
+        np.cumsum(np.bincount(columns, minlength=n_features), out=pointers[1:])
+        return pointers, row_ids[np.argsort(columns, kind='stable')]
+
+    def candidates(self, item_vector):
+        """Rows containing at least min_overlap of the item's distinct features"""
+        features = np.unique(item_vector.indices)
+        if len(features) == 0:
+            return np.array([], dtype=np.int64)
+        needed = max(1, math.ceil(self.min_overlap * len(features)))
+        found = np.concatenate([self.rows[self.pointers[f]:self.pointers[f + 1]] for f in features])
+        n_rows = self.matrix.shape[0]
+        if len(found) * 8 < n_rows:
+            # Few postings: sort them rather than touch one counter per row
+            rows, shared = np.unique(found, return_counts=True)
+            return rows[shared >= needed].astype(np.int64)
+        return np.nonzero(np.bincount(found, minlength=n_rows) >= needed)[0]
+
+    def score(self, item_vector):
+        """
+        Returns:
+            (rows, similarities) for the candidate rows only
+        """
+        rows = self.candidates(item_vector)
+        if len(rows) == 0:
+            return rows, np.array([], dtype=np.float64)
+        similarities = np.asarray(self.matrix[rows] @ item_vector.toarray()[0]).ravel()
+        return rows, similarities
+
+    def describe(self):
+        return {'backend': self.name, 'min_overlap': self.min_overlap}
+
+    def save(self, directory, updates=0):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'pointers.npy'), self.pointers)
+        np.save(os.path.join(directory, 'rows.npy'), self.rows)
+        with open(os.path.join(directory, 'params.json'), 'w') as f:
+            json.dump(_matrix_params(self.matrix, updates), f)
+
+    @classmethod
+    def load(cls, directory, tfidf_matrix, min_overlap=DEFAULT_MIN_OVERLAP, updates=0):
+        with open(os.path.join(directory, 'params.json')) as f:
+            params = json.load(f)
+        if params != _matrix_params(tfidf_matrix, updates):
+            raise ValueError("posting lists do not match the index")
+        postings = (
+            np.load(os.path.join(directory, 'pointers.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r'),
+        )
+        return cls(tfidf_matrix, min_overlap, postings)
+
+
+def _matrix_params(tfidf_matrix, updates=0):
+    """
+    What saved tables and posting lists are checked against before reuse
+
+    A compaction after as many appends as deletes keeps the shape and
+    can keep nnz, so the weights, the row lengths and the update count are
+    checked too.
+    """
+    n_rows, n_features = tfidf_matrix.shape
+    row_lengths = np.diff(np.asarray(tfidf_matrix.indptr, dtype=np.int64))
+    return {'n_rows': n_rows, 'n_features': n_features, 'nnz': int(tfidf_matrix.indptr[-1]),
+            'weight_sum': round(float(np.sum(tfidf_matrix.data, dtype=np.float64)), 6),
+            # Row lengths weighted by position, so reordered rows do not match
+            'row_lengths': int(row_lengths @ np.arange(1, n_rows + 1, dtype=np.int64)),
+            'updates': updates}
+
+
+def _index_updates(index_dir):
+    """Incremental update count in the meta.json of an index directory (0 if none)"""
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            return json.load(f).get('updates', 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def lsh_table_name(kind, bands, rows, seed):
+    """Directory name of saved LSH tables inside an index directory"""
+    return f"lsh-{kind}-{bands}x{rows}-s{seed}"
+
+
+def make_backend(tfidf_matrix, kind='exact', bands=20, rows=5, seed=0, cache_dir=None,
+                 min_overlap=DEFAULT_MIN_OVERLAP):
+    """
+    Create a search backend over a TF-IDF matrix
+
+    Args:
+        tfidf_matrix: CSR matrix of L2-normalised rows
+        kind: 'exact' (default), 'minhash', 'hyperplane' or 'inverted'
+        bands: Number of LSH bands
+        rows: Signature values per band
+        seed: Random seed of the hash functions
+        cache_dir: Directory (usually a saved index) where LSH tables and
+            posting lists are stored and reused between runs
+        min_overlap: Share of an item's distinct features a row must
+            contain to be scored by the inverted backend
+    """
+    if kind == 'exact':
+        return ExactBackend(tfidf_matrix)
+    updates = _index_updates(cache_dir) if cache_dir is not None else 0
+    if kind == 'inverted':
+        if cache_dir is None:
+            return InvertedBackend(tfidf_matrix, min_overlap)
+        backend_dir = os.path.join(cache_dir, INVERTED_DIR)
+        if os.path.exists(os.path.join(backend_dir, 'params.json')):
+            try:
+                return InvertedBackend.load(backend_dir, tfidf_matrix, min_overlap, updates)
+            except (OSError, ValueError, KeyError):
+                pass
+        backend = InvertedBackend(tfidf_matrix, min_overlap)
+        backend.save(backend_dir, updates)
+        return backend
+    if kind not in LSH_BACKENDS:
+        raise ValueError(f"Unknown backend '{kind}'. Choose from: {', '.join(BACKENDS)}")
+
+    cls = LSH_BACKENDS[kind]
+    if cache_dir is None:
+        return cls(tfidf_matrix, bands, rows, seed)
+
+    backend_dir = os.path.join(cache_dir, lsh_table_name(kind, bands, rows, seed))
+    if os.path.exists(os.path.join(backend_dir, 'params.json')):
+        try:
+            return cls.load(backend_dir, tfidf_matrix, updates)
+        except (OSError, ValueError, KeyError):
+            pass
+    backend = cls(tfidf_matrix, bands, rows, seed)
+    backend.save(backend_dir, updates)
+    return backend
+
+
+def recall_report(tfidf_matrix, backend, sample_rows, threshold=0.7):
+    """
+    Compare a backend against exact search using rows of the matrix as queries
+
+    Each sampled row is queried and its own row is ignored, so recall is
+    measured on the other rows that exact search puts above the threshold.
+
+    Returns:
+        Dict with recall, mean candidates scored and per-query latencies
+    """
+    exact = ExactBackend(tfidf_matrix)
+    found = expected = 0
+    scored = []
+    exact_time = backend_time = 0.0
+
+    for row in sample_rows:
+        item_vector = tfidf_matrix[row]
+
+        start = time.perf_counter()
+        rows, sims = exact.score(item_vector)
+        exact_time += time.perf_counter() - start
+        truth = set(rows[sims >= threshold].tolist()) - {row}
+
+        start = time.perf_counter()
+        rows, sims = backend.score(item_vector)
+        backend_time += time.perf_counter() - start
+        hits = set(rows[sims >= threshold].tolist()) - {row}
+
+        found += len(truth & hits)
+        expected += len(truth)
+        scored.append(len(rows))
+
+    n_queries = max(1, len(sample_rows))
+    report = dict(backend.describe())
+    report.update({
+        'threshold': threshold,
+        'queries': len(sample_rows),
+        'exact_pairs': expected,
+        'recall': found / expected if expected else 1.0,
+        'mean_candidates': float(np.mean(scored)) if scored else 0.0,
+        'candidate_fraction': float(np.mean(scored)) / max(1, tfidf_matrix.shape[0]) if scored else 0.0,
+        'exact_ms': 1000 * exact_time / n_queries,
+        'backend_ms': 1000 * backend_time / n_queries,
+    })
+    if isinstance(backend, LSHBackend):
+        report['expected_recall_at_threshold'] = float(backend.candidate_probability(threshold))
+    return report
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for Duplicate Finder
+Usage: python benchmark.py [--sizes 10k,100k,1m] [--output results.json]
+       python benchmark.py --sizes 100k --baseline old.json --max-regression 0.2
+
+Generates synthetic product-title corpora and measures the pipeline of
+check_duplicates / build-index on each size:
+
+    fit         reading the CSV column, fitting TF-IDF, saving and loading the index
+    input       reading the text column from CSV, Parquet and Arrow (Feather)
+                copies of the corpus, and decoding every text once
+    memory      in-memory size of the index arrays and size on disk
+    query       single-query p50/p95/p99 latency (vectorize + score + top-k)
+                for every search backend, with LSH recall against exact search
+    batch       batch-mode throughput in items/second
+    dedupe      all-pairs dedupe time (skipped above --dedupe-max-rows)
+    startup     wall and import time of fresh `cli_app.py --help` and
+                `cli_app.py query` processes, and any of scipy, pandas or
+                scikit-learn they imported
+
+Results are written as JSON. With --baseline, every metric is compared with
+the same metric of an earlier run and the exit status is 1 when any of them
+is worse by more than --max-regression. The exit status is also 1 when a
+startup imports one of those heavy packages or takes longer than
+--import-budget-ms to import its modules.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from backends import BACKENDS, DEFAULT_MIN_OVERLAP, make_backend
+from search import batch_matches, dedupe_pairs, top_matches
+from tfidf_index import PRECISIONS, TfidfIndex, file_fingerprint, parse_char_ngrams, read_text_column
+
+SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'zi', 'be', 'do', 'fa', 'gu', 'hi',
+             'ja', 'ko', 'li', 'mo', 'nu', 'pa', 're', 'si', 'to', 'un', 'va', 'we', 'xo',
+             'ya', 'zu', 'bra', 'cle', 'dri', 'fro', 'gla', 'pli', 'sto', 'tre', 'qua',
+             'ster', 'lin', 'mar')
+
+SIZE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+# Direction of every reported metric, used by the regression check
+LOWER_IS_BETTER = ('_s', '_ms', '_mb')
+HIGHER_IS_BETTER = ('_per_s', 'recall')
+
+# Packages the CLI must not import to print its help or answer a query
+HEAVY_PACKAGES = ('scipy', 'pandas', 'sklearn')
+
+# Milliseconds a CLI startup may spend importing modules (--import-budget-ms)
+DEFAULT_IMPORT_BUDGET_MS = 300
+
+# Extensions of the corpus copies read by the input benchmark
+INPUT_EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet', 'arrow': 'feather'}
+
+CLI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli_app.py')
+
+
+def parse_size(value):
+    """Parse '10k', '1.5m' or '20000' into a row count"""
+    value = value.strip().lower()
+    if value[-1:] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def synthetic_vocabulary(vocab_size, seed=0):
+    """vocab_size distinct pronounceable pseudo-words"""
+    rng = np.random.RandomState(seed)
+    n_syllables = 2
+    while len(SYLLABLES) ** n_syllables < 2 * vocab_size:
+        n_syllables += 1
+    codes = rng.choice(len(SYLLABLES) ** n_syllables, size=vocab_size, replace=False)
+    words = []
+    for code in codes:
+        parts = []
+        for _ in range(n_syllables):
+            code, syllable = divmod(code, len(SYLLABLES))
+            parts.append(SYLLABLES[syllable])
+        words.append(''.join(parts))
+    return words
+
+
+def perturb(tokens, rng, vocab_size=None):
+    """
+    One near-duplicate edit of a title: drop, swap, add or replace a token
+
+    Tokens are word ids; without vocab_size only drops and swaps are made, so
+    any token list (e.g. words of a title) can be perturbed.
+    """
+    tokens = list(tokens)
+    edit = rng.randint(4 if vocab_size else 2)
+    if edit == 0 and len(tokens) > 2:
+        del tokens[rng.randint(len(tokens))]
+    elif edit == 1 and len(tokens) > 1:
+        i, j = rng.choice(len(tokens), 2, replace=False)
+        tokens[i], tokens[j] = tokens[j], tokens[i]
+    elif edit == 2:
+        tokens.insert(rng.randint(len(tokens) + 1), rng.randint(vocab_size))
+    else:
+        tokens[rng.randint(len(tokens))] = rng.randint(vocab_size)
+    return tokens
+
+
+def synthetic_titles(n_rows, vocab_size=20000, near_duplicate_rate=0.1, min_words=3, max_words=8,
+                     zipf=1.1, seed=0):
+    """
+    Synthetic product titles with a controlled share of near-duplicates
+
+    Words follow a Zipf distribution over the vocabulary, and each title ends
+    with a model number. A near_duplicate_rate share of the rows are copies
+    of an earlier row with one edit (see perturb).
+
+    Returns:
+        List of n_rows strings
+    """
+    rng = np.random.RandomState(seed)
+    words = synthetic_vocabulary(vocab_size, seed)
+    probabilities = 1.0 / np.arange(1, vocab_size + 1) ** zipf
+    probabilities /= probabilities.sum()
+
+    lengths = rng.randint(min_words, max_words + 1, size=n_rows)
+    word_ids = rng.choice(vocab_size, size=int(lengths.sum()), p=probabilities)
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    models = rng.randint(100, 100000, size=n_rows)
+    is_duplicate = rng.random_sample(n_rows) < near_duplicate_rate
+    is_duplicate[0] = False
+
+    token_rows = []
+    titles = []
+    for i in range(n_rows):
+        if is_duplicate[i]:
+            source = rng.randint(i)
+            tokens = perturb(token_rows[source][0], rng, vocab_size)
+            model = token_rows[source][1]
+        else:
+            tokens = word_ids[bounds[i]:bounds[i + 1]].tolist()
+            model = models[i]
+        token_rows.append((tokens, model))
+        titles.append(' '.join(words[t] for t in tokens) + f' m{model}')
+    return titles
+
+
+def write_corpus(path, titles, column='title'):
+    import pandas as pd
+
+    pd.DataFrame({column: titles}).to_csv(path, index=False)
+
+
+def write_columnar(path, titles, fmt, column='title'):
+    """Write the corpus as Parquet, or as an uncompressed (memory-mappable) Arrow file"""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    table = pa.table({column: pa.array(titles, type=pa.string())})
+    if fmt == 'parquet':
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path, compression='uncompressed')
+
+
+def bench_input_formats(csv_file, titles, formats, work_dir):
+    """
+    Time reading the text column from every input format
+
+    read_s is read_text_column alone; read_iter_s also decodes every text
+    once, as the vectorizer does, since Parquet and Arrow columns are
+    handed over as UTF-8 buffers rather than lists of strings.
+    """
+    results = {}
+    for fmt in formats:
+        path = csv_file
+        if fmt != 'csv':
+            path = os.path.splitext(csv_file)[0] + '.' + INPUT_EXTENSIONS[fmt]
+            try:
+                write_columnar(path, titles, fmt)
+            except ImportError:
+                print(f"⚠️  pyarrow is not installed; skipping the {fmt} input benchmark")
+                continue
+        start = time.perf_counter()
+        texts = read_text_column(path, 'title')
+        read_s = time.perf_counter() - start
+        n_chars = sum(len(text) for text in texts)
+        results[fmt] = {
+            'read_s': read_s,
+            'read_iter_s': time.perf_counter() - start,
+            'file_mb': os.path.getsize(path) / 2**20,
+        }
+        del texts
+        if path != csv_file:
+            os.remove(path)
+    return results
+
+
+def percentiles(samples_s):
+    """p50/p95/p99 and mean of latencies given in seconds, in milliseconds"""
+    samples = np.asarray(samples_s) * 1000
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+    }
+
+
+def index_memory(index):
+    """Bytes held by the matrix and text arrays of an index"""
+    matrix = index.matrix
+    matrix_bytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    text_bytes = np.asarray(index.texts.buffer).nbytes + index.texts.offsets.nbytes
+    return matrix_bytes, text_bytes
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_queries(index, backend, queries, threshold, top_k):
+    """Per-query latency and the matches found for every query"""
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        item_vector = index.transform([query])
+        rows, similarities = backend.score(item_vector)
+        matches, _ = top_matches(rows, similarities, threshold, top_k)
+        latencies.append(time.perf_counter() - start)
+        found.append(set(matches.tolist()))
+    return latencies, found
+
+
+def cli_startup(cli_args, repeats=5):
+    """
+    Cold start of one CLI invocation in fresh interpreters
+
+    Returns:
+        Dict with the best wall time over repeats, the import time of all
+        modules (python -X importtime, top-level cumulative times summed)
+        and the heavy packages that were imported
+    """
+    wall_s = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', CLI_SCRIPT, *cli_args],
+                              capture_output=True, text=True)
+        wall_s = min(wall_s, time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(f"cli_app.py {' '.join(cli_args)} failed:\n{proc.stderr[-2000:]}")
+
+    import_us = 0
+    heavy = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Nested imports are indented below the module importing them
+        if not name[1:].startswith(' '):
+            import_us += int(cumulative)
+        package = name.strip().split('.')[0]
+        if package in HEAVY_PACKAGES:
+            heavy.add(package)
+    return {'wall_s': wall_s, 'import_ms': import_us / 1000, 'heavy_imports': sorted(heavy)}
+
+
+def startup_violations(results, import_budget_ms):
+    """Startups of the runs that imported a heavy package or exceeded the import budget"""
+    violations = []
+    for result in results:
+        for command, stats in result.get('startup', {}).items():
+            if stats['heavy_imports']:
+                violations.append((result['rows'], command,
+                                   f"imported {', '.join(stats['heavy_imports'])}"))
+            if stats['import_ms'] > import_budget_ms:
+                violations.append((result['rows'], command,
+                                   f"imports took {stats['import_ms']:.0f} ms "
+                                   f"(budget {import_budget_ms:g} ms)"))
+    return violations
+
+
+def run_size(n_rows, args, work_dir):
+    """Benchmark one corpus size; returns a flat-ish dict of metrics"""
+    result = {'rows': n_rows}
+    csv_file = os.path.join(work_dir, f'corpus-{n_rows}.csv')
+    index_dir = os.path.join(work_dir, f'index-{n_rows}')
+
+    start = time.perf_counter()
+    titles = synthetic_titles(n_rows, args.vocab_size, args.near_duplicate_rate, seed=args.seed)
+    write_corpus(csv_file, titles)
+    result['generate_s'] = time.perf_counter() - start
+    result['csv_mb'] = os.path.getsize(csv_file) / 2**20
+
+    rng = np.random.RandomState(args.seed + 1)
+    sample = rng.randint(n_rows, size=max(args.queries, args.batch_size))
+    queries = [
+        ' '.join(perturb(titles[row].split(), rng) if rng.random_sample() < 0.5
+                 else titles[row].split())
+        for row in sample
+    ]
+    result['inputs'] = bench_input_formats(csv_file, titles, args.input_formats, work_dir)
+    del titles
+
+    # Fit: the check_duplicates pipeline, stage by stage
+    start = time.perf_counter()
+    text_data = read_text_column(csv_file, 'title')
+    result['read_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = TfidfIndex.from_texts(
+        text_data, max_features=args.max_features,
+        meta={'source': file_fingerprint(csv_file), 'column': 'title'},
+        precision=args.precision,
+        char_ngrams=args.char_ngrams
+    )
+    result['fit_s'] = time.perf_counter() - start
+    del text_data
+
+    start = time.perf_counter()
+    index.save(index_dir)
+    result['save_s'] = time.perf_counter() - start
+    del index
+
+    start = time.perf_counter()
+    index = TfidfIndex.load(index_dir)
+    result['load_s'] = time.perf_counter() - start
+
+    matrix_bytes, text_bytes = index_memory(index)
+    result['matrix_mb'] = matrix_bytes / 2**20
+    result['texts_mb'] = text_bytes / 2**20
+    result['disk_mb'] = directory_size(index_dir) / 2**20
+    result['nnz'] = int(index.matrix.nnz)
+    result['features'] = int(index.matrix.shape[1])
+
+    # Single-query latency per backend
+    query_sample = queries[:args.queries]
+    result['backends'] = {}
+    exact_found = None
+    for kind in args.backends:
+        start = time.perf_counter()
+        backend = make_backend(index.matrix, kind, args.bands, args.rows, cache_dir=index_dir,
+                               min_overlap=args.min_overlap)
+        setup_s = time.perf_counter() - start
+        bench_queries(index, backend, query_sample[:5], args.threshold, args.top_k)  # warm up
+        latencies, found = bench_queries(index, backend, query_sample, args.threshold, args.top_k)
+        stats = dict(percentiles(latencies), setup_s=setup_s)
+        if kind == 'exact':
+            exact_found = found
+        elif exact_found is not None:
+            expected = sum(len(f) for f in exact_found)
+            hits = sum(len(f & e) for f, e in zip(found, exact_found))
+            stats['recall'] = hits / expected if expected else 1.0
+        result['backends'][kind] = stats
+
+    # Batch throughput
+    batch = queries[:args.batch_size]
+    start = time.perf_counter()
+    item_vectors = index.transform(batch)
+    n_matches = sum(1 for _ in batch_matches(item_vectors, index.matrix, args.threshold,
+                                             top_k=args.top_k))
+    elapsed = time.perf_counter() - start
+    result['batch_items_per_s'] = len(batch) / elapsed if elapsed > 0 else float('inf')
+    result['batch_matches'] = n_matches
+
+    # Cold start of the CLI against the saved index
+    if args.import_budget_ms > 0:
+        result['startup'] = {
+            'help': cli_startup(['--help']),
+            'query': cli_startup(['query', index_dir, queries[0], '--top-k', str(args.top_k)]),
+        }
+
+    # All-pairs dedupe
+    if n_rows <= args.dedupe_max_rows:
+        start = time.perf_counter()
+        rows, _, _ = dedupe_pairs(index.matrix, args.threshold, n_jobs=args.workers,
+                                  index_dir=index_dir)
+        result['dedupe_s'] = time.perf_counter() - start
+        result['dedupe_pairs'] = int(len(rows))
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    del index
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.remove(csv_file)
+    return result
+
+
+def flatten(result, prefix=''):
+    """{'backends': {'exact': {'p50_ms': 1}}} -> {'backends.exact.p50_ms': 1}"""
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def metric_direction(name):
+    """+1 if higher is better, -1 if lower is better, 0 if not compared"""
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER) and not name.startswith(('generate_s', 'csv_mb')):
+        return -1
+    return 0
+
+
+def compare_runs(results, baseline, max_regression):
+    """
+    Compare two runs metric by metric, matching corpus sizes
+
+    Returns:
+        List of (rows, metric, baseline_value, value, change) for every metric
+        worse than the baseline by more than max_regression (a fraction)
+    """
+    baseline_by_rows = {run['rows']: flatten(run) for run in baseline['results']}
+    regressions = []
+    for run in results:
+        before = baseline_by_rows.get(run['rows'])
+        if before is None:
+            continue
+        for name, value in flatten(run).items():
+            direction = metric_direction(name)
+            old = before.get(name)
+            if direction == 0 or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            change = (value - old) / old
+            if -direction * change > max_regression:
+                regressions.append((run['rows'], name, old, value, change))
+    return regressions
+
+
+def print_summary(result):
+    print(f"\n📊 {result['rows']:,} rows "
+          f"(fit {result['fit_s']:.2f}s, index {result['matrix_mb'] + result['texts_mb']:.1f} MB "
+          f"in memory / {result['disk_mb']:.1f} MB on disk)")
+    for kind, stats in result['backends'].items():
+        recall = f", recall {stats['recall']:.3f}" if 'recall' in stats else ""
+        print(f"   {kind:<11} p50 {stats['p50_ms']:.2f} ms  p95 {stats['p95_ms']:.2f} ms  "
+              f"p99 {stats['p99_ms']:.2f} ms{recall}")
+    print(f"   batch       {result['batch_items_per_s']:,.0f} items/s")
+    inputs = result.get('inputs', {})
+    if inputs:
+        csv_s = inputs.get('csv', {}).get('read_iter_s')
+        print("   input       " + "  ".join(
+            f"{fmt} {stats['read_s']:.2f}s (+decode {stats['read_iter_s']:.2f}s"
+            + (f", {csv_s / stats['read_iter_s']:.1f}x csv)" if csv_s and fmt != 'csv' else ")")
+            for fmt, stats in inputs.items()
+        ))
+    if 'dedupe_s' in result:
+        print(f"   dedupe      {result['dedupe_s']:.2f}s ({result['dedupe_pairs']} pairs)")
+    for command, stats in result.get('startup', {}).items():
+        heavy = f", imported {', '.join(stats['heavy_imports'])}" if stats['heavy_imports'] else ""
+        print(f"   cli {command:<7} {stats['wall_s'] * 1000:.0f} ms "
+              f"({stats['import_ms']:.0f} ms importing{heavy})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Duplicate Finder - benchmark harness",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark.py --sizes 10k,100k --output bench.json
+  python benchmark.py --sizes 1m,5m --backends exact,minhash --dedupe-max-rows 0
+  python benchmark.py --sizes 100k --baseline bench.json --max-regression 0.2
+  python benchmark.py --sizes 100k --char-ngrams 3-4 --backends exact,inverted
+  python benchmark.py --sizes 10k --backends exact --import-budget-ms 200
+  python benchmark.py --sizes 1m --input-formats csv,parquet,arrow --backends exact
+        """
+    )
+    parser.add_argument('--sizes', default='10k,100k',
+                        help='Comma-separated corpus sizes, e.g. 10k,100k,1m,5m (default: 10k,100k)')
+    parser.add_argument('--vocab-size', type=int, default=20000,
+                        help='Distinct words in the synthetic corpus (default: 20000)')
+    parser.add_argument('--near-duplicate-rate', type=float, default=0.1,
+                        help='Share of rows that are edited copies of earlier rows (default: 0.1)')
+    parser.add_argument('--max-features', type=int, default=5000,
+                        help='Max TF-IDF features (default: 5000)')
+    parser.add_argument('--precision', choices=PRECISIONS, default='float64',
+                        help='Storage of the matrix values (default: float64)')
+    parser.add_argument('--char-ngrams', type=parse_char_ngrams, default=None, metavar='MIN-MAX',
+                        help='Index character n-grams of words instead of words')
+    parser.add_argument('--threshold', type=float, default=0.7,
+                        help='Similarity threshold (default: 0.7)')
+    parser.add_argument('--top-k', type=int, default=10,
+                        help='Matches kept per query (default: 10)')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='Single queries timed per backend (default: 200)')
+    parser.add_argument('--batch-size', type=int, default=2000,
+                        help='Items in the batch throughput run (default: 2000)')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help=f"Comma-separated backends (default: {','.join(BACKENDS)})")
+    parser.add_argument('--bands', type=int, default=20, help='LSH bands (default: 20)')
+    parser.add_argument('--rows', type=int, default=5, help='LSH rows per band (default: 5)')
+    parser.add_argument('--min-overlap', type=float, default=DEFAULT_MIN_OVERLAP,
+                        help=f'Feature overlap of the inverted backend (default: {DEFAULT_MIN_OVERLAP:g})')
+    parser.add_argument('--dedupe-max-rows', type=parse_size, default=parse_size('200k'),
+                        help='Skip all-pairs dedupe above this many rows (default: 200k)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Dedupe worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    parser.add_argument('--work-dir', default=None,
+                        help='Directory for corpora and indexes (default: a temporary one)')
+    parser.add_argument('--output', default=None, help='Write results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='Earlier results JSON to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed relative slowdown per metric vs the baseline (default: 0.2)')
+    parser.add_argument('--import-budget-ms', type=float, default=DEFAULT_IMPORT_BUDGET_MS,
+                        help='Import time allowed for `cli_app.py --help` and a query against a '
+                             f'saved index (default: {DEFAULT_IMPORT_BUDGET_MS}, 0 skips the startup check)')
+    parser.add_argument('--input-formats', default=','.join(INPUT_EXTENSIONS),
+                        help='Input formats whose column load time is measured '
+                             f'(default: {",".join(INPUT_EXTENSIONS)}; Parquet and Arrow need pyarrow)')
+    args = parser.parse_args(argv)
+    args.backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    args.input_formats = [f.strip() for f in args.input_formats.split(',') if f.strip()]
+    unknown = set(args.input_formats) - set(INPUT_EXTENSIONS)
+    if unknown:
+        parser.error(f"unknown input format(s): {', '.join(sorted(unknown))}")
+    sizes = [parse_size(s) for s in args.sizes.split(',') if s.strip()]
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='duplicate-finder-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    try:
+        for n_rows in sizes:
+            print(f"⏱️  Benchmarking {n_rows:,} rows...")
+            result = run_size(n_rows, args, work_dir)
+            print_summary(result)
+            results.append(result)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'baseline', 'work_dir')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results written to {args.output}")
+
+    violations = startup_violations(results, args.import_budget_ms)
+    if violations:
+        print(f"\n❌ {len(violations)} CLI startup(s) over budget:")
+        for rows, command, problem in violations:
+            print(f"   {rows:>10,} rows  {command:<7} {problem}")
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        compared = {run['rows'] for run in baseline['results']} & {run['rows'] for run in results}
+        if not compared:
+            print("\n⚠️  The baseline has none of the benchmarked sizes; nothing compared")
+            sys.exit(1)
+        regressions = compare_runs(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n❌ {len(regressions)} metric(s) regressed by more than "
+                  f"{args.max_regression:.0%}:")
+            for rows, name, old, value, change in regressions:
+                print(f"   {rows:>10,} rows  {name:<28} {old:.4g} -> {value:.4g} ({change:+.1%})")
+            sys.exit(1)
+        print(f"\n✅ No metric regressed by more than {args.max_regression:.0%}")
+
+
+if __name__ == '__main__':
+    main()
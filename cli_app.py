@@ -2,16 +2,59 @@
 """
 CLI version of Duplicate Finder with Interpretability
 Usage: python cli_app.py <csv_file> <column_name> <item_to_check> [--threshold THRESHOLD]
+       python cli_app.py build-index <csv_file> <column_name> <index_dir> [--max-features N]
+                                     [--column NAME[:WEIGHT] ...] [--char-ngrams [MIN-MAX]]
+       python cli_app.py query <index_dir> <item_to_check> [--threshold THRESHOLD]
+                               [--profile text|json] [--profile-dump DIR]
+       python cli_app.py batch <index_dir> [--input FILE] [--output FILE] [--format csv|jsonl]
+       python cli_app.py dedupe <index_dir> [--pairs-output FILE] [--clusters-output FILE]
+       python cli_app.py lsh-report <index_dir> [--backend minhash|hyperplane] [--config BxR]
+       python cli_app.py precision-report <index_dir> [--precision float32|uint8]
+       python cli_app.py update <index_dir> [--append FILE] [--delete ROW [ROW ...]]
+       python cli_app.py compact <index_dir>
+       python cli_app.py shard <index_dir> <sharded_dir> --shards N
+       python cli_app.py cache <index_dir> [--clear]
 """
 
 import argparse
-import pandas as pd
+import csv
+import json
+import heapq
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
 from collections import Counter
 import re
 import sys
+import time
+
+# Only numpy and these numpy-only modules load at startup; scipy, pandas
+# and scikit-learn are imported by the code paths that need them
+from backends import BACKENDS, DEFAULT_MIN_OVERLAP, make_backend, recall_report
+from explain import explain_dense, explain_matches, format_terms, with_explanations
+from fingerprints import open_fingerprints, split_fast_path
+from profiling import StageProfiler, profile_stage
+from result_cache import (
+    CACHE_FILE,
+    ResultCache,
+    cache_log_path,
+    format_cache_stats,
+    index_version,
+    result_key,
+)
+from search import batch_matches, dedupe_pairs, duplicate_clusters, top_matches
+from shards import ShardedIndex, is_sharded, split_index
+from tfidf_index import (
+    PRECISIONS,
+    TfidfIndex,
+    build_index,
+    load_or_build_index,
+    format_fields,
+    parse_field,
+    parse_char_ngrams,
+    precision_report,
+    read_text_column,
+    read_text_columns,
+)
 
 def extract_words(text):
     """Extract words from text"""
@@ -28,157 +71,1232 @@ def print_header(text):
     print(f"  {text}")
     print_separator()
 
-def check_duplicates(csv_file, column_name, item_to_check, threshold=0.7, max_features=5000):
+def check_duplicates(csv_file, column_name, item_to_check, threshold=0.7, max_features=5000,
+                     index_dir=None, backend='exact', bands=20, rows=5, top_k=None,
+                     explain_all=False, fast_path=False, min_overlap=DEFAULT_MIN_OVERLAP,
+                     char_ngrams=None, profiler=None):
     """
     Check for duplicates in a CSV file
     
     Args:
         csv_file: Path to CSV file
-        column_name: Name of the column to analyze
+        column_name: Name of the column to analyze, or a list of
+            (column, weight) pairs to match on several columns
         item_to_check: Item to check for duplicates
         threshold: Similarity threshold (default: 0.7)
         max_features: Max TF-IDF features (default: 5000)
+        index_dir: Optional index directory; reused when it matches the CSV,
+            rebuilt and saved there otherwise
+        backend: Search backend, 'exact' (default), 'minhash', 'hyperplane'
+            or 'inverted'
+        bands: LSH bands (default: 20)
+        rows: LSH rows per band (default: 5)
+        top_k: Show at most this many matches (default: all above threshold)
+        explain_all: Show the shared features of every match, not only the best
+        fast_path: Answer exact and normalized duplicates from the fingerprint
+            table before scoring the corpus
+        min_overlap: Share of the item's features a row needs to be scored
+            by the inverted backend (default: 0.3)
+        char_ngrams: (min_n, max_n) to match on character n-grams of words
+            instead of words (typo-tolerant)
+        profiler: StageProfiler timing every stage (default: off)
     """
     try:
-        # Load dataset
-        print(f"📂 Loading dataset from {csv_file}...")
-        dataset = pd.read_csv(csv_file)
-        print(f"✅ Loaded {len(dataset)} rows")
-        
-        if column_name not in dataset.columns:
-            print(f"❌ Error: Column '{column_name}' not found in dataset")
-            print(f"Available columns: {', '.join(dataset.columns)}")
-            return
+        if index_dir:
+            with profile_stage(profiler, 'load_index'):
+                index = open_index(index_dir, csv_file, column_name, max_features, char_ngrams)
+        elif not isinstance(column_name, str):
+            # Load the columns and fit one weighted model per column
+            print(f"📂 Loading dataset from {csv_file}...")
+            with profile_stage(profiler, 'read_csv'):
+                columns = read_text_columns(csv_file, [column for column, _ in column_name])
+            print(f"✅ Loaded {len(next(iter(columns.values())))} rows")
+            
+            print("🚀 Training TF-IDF models...")
+            with profile_stage(profiler, 'fit'):
+                index = TfidfIndex.from_fields(column_name, columns, max_features=max_features,
+                                               char_ngrams=char_ngrams)
+            print(f"✅ Models trained! Vocabulary size: {len(index.vocabulary)}")
+        else:
+            # Load dataset
+            print(f"📂 Loading dataset from {csv_file}...")
+            with profile_stage(profiler, 'read_csv'):
+                text_data = read_text_column(csv_file, column_name)
+            print(f"✅ Loaded {len(text_data)} rows")
+            
+            # Train TF-IDF model
+            print("🚀 Training TF-IDF model...")
+            with profile_stage(profiler, 'fit'):
+                index = TfidfIndex.from_texts(text_data, max_features=max_features,
+                                              char_ngrams=char_ngrams)
+            print(f"✅ Model trained! Vocabulary size: {len(index.vocabulary)}")
         
-        # Prepare text data
-        print(f"\n🔧 Preparing text data from column '{column_name}'...")
-        text_data = dataset[column_name].fillna('').astype(str).tolist()
+        with profile_stage(profiler, 'backend'):
+            search_backend = open_backend(index, backend, bands, rows, index_dir, min_overlap)
+            fingerprints = open_fingerprints(index, index_dir) if fast_path else None
+        report_duplicates(index, item_to_check, threshold, search_backend, top_k, explain_all,
+                          fingerprints, profiler)
         
-        # Train TF-IDF model
+    except FileNotFoundError:
+        print(f"❌ Error: File '{csv_file}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def open_index(index_dir, csv_file=None, column_name=None, max_features=None, char_ngrams=None):
+    """Load a saved index, rebuilding it when its source CSV changed"""
+    print(f"📂 Loading index from {index_dir}...")
+    index, rebuilt_reason = load_or_build_index(index_dir, csv_file, column_name, max_features,
+                                                char_ngrams=char_ngrams)
+    if rebuilt_reason:
+        print(f"♻️  Index rebuilt: {rebuilt_reason}")
+    print(f"✅ Loaded {len(index)} rows (column '{format_fields(index.meta.get('column', ''))}', "
+          f"vocabulary size: {len(index.vocabulary)})")
+    return index
+
+def open_sharded_index(index_dir, shard_ids=None, n_threads=None):
+    """Load all shards of a sharded index, or only shard_ids"""
+    print(f"📂 Loading sharded index from {index_dir}...")
+    index = ShardedIndex.load(index_dir, shard_ids, n_jobs=n_threads)
+    print(f"✅ Loaded {len(index)} of {index.n_rows} rows from {len(index.shards)} of "
+          f"{index.meta['n_shards']} shard(s) (column '{format_fields(index.meta.get('column') or '')}', "
+          f"vocabulary size: {len(index.vocabulary)}, {index.n_jobs} thread(s))")
+    return index
+
+def open_result_cache(index, index_dir, cache_mb, cache_ttl=None):
+    """
+    Result cache saved in the index directory, without the entries of other versions
+
+    Returns:
+        (cache, version) where version identifies the index as loaded
+    """
+    version = index_version(index)
+    cache = ResultCache.load(os.path.join(index_dir, CACHE_FILE), version, cache_mb * 2**20, cache_ttl)
+    return cache, version
+
+def open_backend(index, backend='exact', bands=20, rows=5, index_dir=None,
+                 min_overlap=DEFAULT_MIN_OVERLAP):
+    """
+    Create the search backend, reusing LSH tables or posting lists saved in index_dir
+
+    Returns None for exact search, which report_duplicates answers with
+    numpy only from the index arrays.
+    """
+    if backend == 'exact':
+        return None
+    if backend == 'inverted':
+        print(f"📇 Preparing inverted index (min overlap {min_overlap:g})...")
+    elif backend != 'exact':
+        print(f"🪣 Preparing {backend} LSH tables ({bands} bands x {rows} rows)...")
+    return make_backend(index.matrix, backend, bands, rows, cache_dir=index_dir,
+                        min_overlap=min_overlap)
+
+def build_index_command(csv_file, column_name, index_dir, max_features=5000, memory_budget_mb=None,
+                        hash_features=None, n_jobs=1, precision='float64', char_ngrams=None):
+    """Fit the TF-IDF model once and save it as an index directory"""
+    try:
+        if memory_budget_mb:
+            print(f"📂 Streaming column '{format_fields(column_name)}' from {csv_file} "
+                  f"(memory budget: {memory_budget_mb:g} MB)...")
+        else:
+            print(f"📂 Loading dataset from {csv_file}...")
         print("🚀 Training TF-IDF model...")
-        tfidf_vectorizer = TfidfVectorizer(
-            max_features=max_features,
-            stop_words='english'
-        )
-        tfidf_matrix = tfidf_vectorizer.fit_transform(text_data)
-        print(f"✅ Model trained! Vocabulary size: {len(tfidf_vectorizer.vocabulary_)}")
+        index = build_index(csv_file, column_name, max_features, index_dir, memory_budget_mb,
+                            hash_features, n_jobs, precision, char_ngrams)
+        if hash_features:
+            print(f"✅ Model trained! Hashed feature space: {hash_features} columns")
+        else:
+            features = f"{char_ngrams[0]}-{char_ngrams[1]} character n-grams" if char_ngrams else "words"
+            print(f"✅ Model trained! Vocabulary size: {len(index.vocabulary)} ({features})")
+        print(f"💾 Index with {len(index)} rows saved to {index_dir} ({precision} values)")
+    except FileNotFoundError:
+        print(f"❌ Error: File '{csv_file}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def query_command(index_dir, item_to_check, threshold=0.7, max_features=None,
+                  backend='exact', bands=20, rows=5, top_k=None, explain_all=False,
+                  fast_path=False, field_values=None, min_overlap=DEFAULT_MIN_OVERLAP,
+                  profiler=None, shard_ids=None, n_threads=None, cache_mb=None, cache_ttl=None):
+    """
+    Check one item against a saved index
+    
+    With field_values ({column: text}) the item of a multi-column index
+    takes those texts for their columns and item_to_check for the others.
+    A sharded index (see shards.py) is searched exactly on n_threads
+    threads, over all of its shards or only shard_ids. With cache_mb, the
+    result is looked up in (and added to) the result cache kept in the
+    index directory, bounded to cache_mb MB with entries expiring after
+    cache_ttl seconds.
+    """
+    try:
+        sharded = is_sharded(index_dir)
+        if sharded and (backend != 'exact' or fast_path):
+            raise ValueError("A sharded index is searched exactly; --backend and --fast-path "
+                             "need an unsharded index")
+        with profile_stage(profiler, 'load_index'):
+            if sharded:
+                index = open_sharded_index(index_dir, shard_ids, n_threads)
+            else:
+                index = open_index(index_dir, max_features=max_features)
+        if field_values:
+            if not index.fields:
+                raise ValueError("--field needs an index built on several columns")
+            unknown = set(field_values) - {field[0] for field in index.fields}
+            if unknown:
+                raise ValueError(f"Column(s) not in the index: {', '.join(sorted(unknown))}")
+            item_to_check = dict({field[0]: item_to_check for field in index.fields}, **field_values)
+        cache, cache_key = None, None
+        if cache_mb:
+            with profile_stage(profiler, 'cache'):
+                cache, version = open_result_cache(index, index_dir, cache_mb, cache_ttl)
+                options = ['query', threshold, top_k, explain_all, backend, bands, rows,
+                           min_overlap, fast_path]
+                cache_key = (version, result_key(index, item_to_check, *options,
+                                                 all_tokens=fast_path))
+        if sharded:
+            report_sharded(index, item_to_check, threshold, top_k, explain_all, profiler,
+                           cache, cache_key)
+        else:
+            # A cached result needs neither LSH tables nor fingerprints
+            cached = cache is not None and cache.contains(*cache_key)
+            with profile_stage(profiler, 'backend'):
+                search_backend, fingerprints = None, None
+                if not cached:
+                    search_backend = open_backend(index, backend, bands, rows, index_dir, min_overlap)
+                    fingerprints = open_fingerprints(index, index_dir) if fast_path else None
+            report_duplicates(index, item_to_check, threshold, search_backend, top_k, explain_all,
+                              fingerprints, profiler, cache, cache_key)
+        if cache is not None:
+            # One item: append the lookup (and new entry) instead of rewriting the cache
+            cache.save_changes(os.path.join(index_dir, CACHE_FILE))
+            print(f"🗃️  Result cache: {format_cache_stats(cache.stats())}")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def read_candidates(input_file, input_column=None, fields=None):
+    """
+    Read candidate items from a file, or stdin when input_file is '-'
+    
+    Plain text input holds one item per line; with input_column the input
+    is read as CSV and that column is used. With fields (a list of columns)
+    the input is read as CSV and every row becomes a dict of those columns.
+    """
+    stream = sys.stdin if input_file == '-' else open(input_file, newline='', encoding='utf-8')
+    try:
+        if fields:
+            reader = csv.DictReader(stream)
+            missing = [column for column in fields if column not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"Column(s) {', '.join(missing)} not found in candidate input")
+            return [{column: row[column] or '' for column in fields} for row in reader]
+        if input_column:
+            reader = csv.DictReader(stream)
+            if input_column not in (reader.fieldnames or []):
+                raise ValueError(f"Column '{input_column}' not found in candidate input")
+            return [row[input_column] or '' for row in reader]
+        return [line.rstrip('\r\n') for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def batch_command(index_dir, input_file='-', output_file='-', output_format=None,
+                  input_column=None, threshold=0.7, memory_budget_mb=256, top_k=None,
+                  explain=None, fast_path=False, input_fields=False, shard_ids=None, n_threads=None,
+                  cache_mb=None, cache_ttl=None):
+    """
+    Check many candidate items against a saved index in one pass
+    
+    Args:
+        index_dir: Directory written by build-index
+        input_file: Candidate file, '-' for stdin
+        output_file: Result file, '-' for stdout
+        output_format: 'csv' or 'jsonl' (default: from output extension, else csv)
+        input_column: Read candidates from this CSV column instead of lines
+        threshold: Similarity threshold (default: 0.7)
+        memory_budget_mb: Memory bound for one chunk of scores (default: 256)
+        top_k: Keep at most this many matches per candidate (default: all)
+        explain: Add the top `explain` shared terms of every match (default: off)
+        fast_path: Answer exact and normalized duplicates from the fingerprint
+            table and only scan the corpus for the other candidates
+        input_fields: Read the input as CSV with one column per field of a
+            multi-column index
+        shard_ids: Shards of a sharded index to search (default: all)
+        n_threads: Threads scoring the shards of a sharded index
+        cache_mb: Answer candidates from the result cache in the index
+            directory, bounded to this many MB, and add the others to it
+            (default: off)
+        cache_ttl: Seconds after which cached results expire (default: never)
+    """
+    if output_format is None:
+        output_format = 'jsonl' if output_file.endswith(('.jsonl', '.json')) else 'csv'
+    # Progress goes to stderr so stdout stays machine-readable
+    log = sys.stderr
+    
+    try:
+        sharded = is_sharded(index_dir)
+        if sharded and fast_path:
+            raise ValueError("--fast-path needs an unsharded index")
+        if sharded:
+            index = ShardedIndex.load(index_dir, shard_ids, n_jobs=n_threads)
+        else:
+            index = load_or_build_index(index_dir)[0]
+        if input_fields and not index.fields:
+            raise ValueError("--input-fields needs an index built on several columns")
+        fields = [field[0] for field in index.fields] if input_fields else None
+        candidates = read_candidates(input_file, input_column, fields)
+        print(f"📥 Checking {len(candidates)} candidate(s) against {len(index)} rows...", file=log)
         
-        # Check for duplicates
-        print(f"\n🔍 Checking for duplicates of: '{item_to_check}'")
-        print(f"   Threshold: {threshold}")
+        start = time.perf_counter()
+        # Only candidates missing from the result cache are vectorized and scanned
+        pending, cached_matches, cache = list(range(len(candidates))), iter(()), None
+        if cache_mb:
+            cache, version = open_result_cache(index, index_dir, cache_mb, cache_ttl)
+            options = ['batch', threshold, top_k, explain, fast_path]
+            keys = [(version, result_key(index, candidate, *options, all_tokens=fast_path))
+                    for candidate in candidates]
+            cached = [cache.get(*key) for key in keys]
+            pending = [cand_idx for cand_idx, found in enumerate(cached) if found is None]
+            cached_matches = (
+                (cand_idx, *match)
+                for cand_idx, found in enumerate(cached) if found is not None for match in found
+            )
+        items = [candidates[cand_idx] for cand_idx in pending]
+        item_vectors = index.transform(items) if items else None
         
-        # Vectorize input
-        item_vector = tfidf_vectorizer.transform([item_to_check])
+        out = sys.stdout if output_file == '-' else open(output_file, 'w', newline='', encoding='utf-8')
+        n_matches = 0
+        try:
+            header = ['candidate_id', 'candidate', 'match_index', 'score']
+            if output_format == 'csv':
+                writer = csv.writer(out)
+                writer.writerow(header + ['shared_terms'] if explain else header)
+            if not items:
+                matches = iter(())
+            elif fast_path:
+                fingerprints = open_fingerprints(index, index_dir)
+                fast_matches, remaining = split_fast_path(fingerprints, items, item_vectors,
+                                                          threshold, top_k)
+                scanned = (
+                    (remaining[item], row, score)
+                    for item, row, score in batch_matches(item_vectors[remaining], index.matrix,
+                                                          threshold, memory_budget_mb, top_k)
+                )
+                matches = heapq.merge(fast_matches, scanned, key=lambda match: match[0])
+            elif sharded:
+                matches = index.search(item_vectors, threshold, memory_budget_mb, top_k)
+            else:
+                matches = batch_matches(item_vectors, index.matrix, threshold, memory_budget_mb, top_k)
+            if explain and items and sharded:
+                matches = index.with_explanations(matches, item_vectors, top_n=explain)
+            elif explain and items:
+                matches = with_explanations(matches, item_vectors, index.matrix,
+                                            index.feature_names, top_n=explain)
+            # Back to candidate ids, in order with the cached candidates
+            matches = ((pending[item], *match) for item, *match in matches)
+            if cache is not None:
+                matches = cache_batch_results(matches, cache, [keys[i] for i in pending], pending)
+            matches = heapq.merge(cached_matches, matches, key=lambda match: match[0])
+            for cand_idx, match_idx, score, *terms in matches:
+                n_matches += 1
+                if output_format == 'csv':
+                    row = [cand_idx, index.item_text(candidates[cand_idx]), match_idx, f"{score:.6f}"]
+                    writer.writerow(row + [format_terms(terms[0])] if explain else row)
+                else:
+                    record = {
+                        'candidate_id': cand_idx,
+                        'candidate': index.item_text(candidates[cand_idx]),
+                        'match_index': match_idx,
+                        'score': round(score, 6)
+                    }
+                    if explain:
+                        record['shared_terms'] = [
+                            {'term': feature, 'contribution': round(contrib, 6)}
+                            for feature, _, _, contrib in terms[0]
+                        ]
+                    out.write(json.dumps(record) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
         
-        # Calculate similarity
-        similarities = cosine_similarity(item_vector, tfidf_matrix)[0]
+        elapsed = time.perf_counter() - start
+        rate = len(candidates) / elapsed if elapsed > 0 else float('inf')
+        if fast_path and items:
+            served = len(items) - len(remaining)
+            print(f"⚡ Fast path served {served} of {len(items)} candidate(s) "
+                  f"({fingerprints.stats()['served_fraction']:.1%})", file=log)
+        if cache is not None:
+            cache.save(os.path.join(index_dir, CACHE_FILE))
+            print(f"🗃️  Result cache answered {len(candidates) - len(pending)} of "
+                  f"{len(candidates)} candidate(s): {format_cache_stats(cache.stats())}", file=log)
+        print(f"✅ {n_matches} match(es) for {len(candidates)} candidate(s) "
+              f"in {elapsed:.2f}s ({rate:,.0f} items/s)", file=log)
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found", file=log)
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}", file=log)
+        sys.exit(1)
+
+def cache_batch_results(matches, cache, keys, pending):
+    """
+    Pass batch matches through, caching the matches of every pending candidate
+
+    matches must come grouped by candidate in the order of pending, the
+    candidate ids whose result keys are keys; candidates without a match
+    are cached as having none.
+    """
+    position, found = 0, []
+    for cand_idx, match_idx, score, *terms in matches:
+        while pending[position] != cand_idx:
+            cache.put(*keys[position], found)
+            position, found = position + 1, []
+        # JSON-ready copy of the match (explanation tuples become lists)
+        match = [int(match_idx), float(score)]
+        if terms:
+            match.append([[str(feature), float(input_weight), float(match_weight), float(shared)]
+                          for feature, input_weight, match_weight, shared in terms[0]])
+        found.append(match)
+        yield cand_idx, match_idx, score, *terms
+    for position in range(position, len(pending)):
+        cache.put(*keys[position], found)
+        found = []
+
+def dedupe_command(index_dir, threshold=0.7, pairs_output=None, clusters_output=None,
+                   n_jobs=None, memory_budget_mb=256, show=10):
+    """
+    Find duplicate pairs and clusters among the rows of a saved index
+    
+    Args:
+        index_dir: Directory written by build-index
+        threshold: Similarity threshold (default: 0.7)
+        pairs_output: Optional CSV file for (row_a, row_b, score) pairs
+        clusters_output: Optional JSONL file with one cluster per line
+        n_jobs: Worker processes (default: all cores)
+        memory_budget_mb: Memory bound for one block of scores per worker
+        show: Number of largest clusters to print
+    """
+    try:
+        index = open_index(index_dir)
         
-        # Find duplicates
-        duplicate_indices = np.where(similarities >= threshold)[0]
+        print(f"\n🧩 Finding all pairs with similarity >= {threshold}...")
+        start = time.perf_counter()
+        rows, cols, scores = dedupe_pairs(
+            index.matrix, threshold, n_jobs=n_jobs,
+            memory_budget_mb=memory_budget_mb, index_dir=index_dir
+        )
+        clusters = duplicate_clusters(len(index), rows, cols)
+        elapsed = time.perf_counter() - start
         
-        # OUTPUT SECTION
         print_header("📤 OUTPUT")
+        print(f"Duplicate Pairs: {len(rows)}")
+        print(f"Duplicate Clusters: {len(clusters)}")
+        print(f"Rows in Clusters: {sum(len(c) for c in clusters)} of {len(index)}")
+        print(f"Time: {elapsed:.2f}s")
         
-        if len(duplicate_indices) > 0:
-            print(f"⚠️  DUPLICATE DETECTED! Found {len(duplicate_indices)} similar item(s)\n")
-            
-            # Sort by similarity
-            duplicate_data = []
-            for idx in duplicate_indices:
-                duplicate_data.append({
-                    'index': idx,
-                    'item': dataset.iloc[idx][column_name],
-                    'similarity': similarities[idx]
-                })
-            duplicate_data.sort(key=lambda x: x['similarity'], reverse=True)
-            
-            # Display results
-            print("Similar Items Found:")
-            print_separator("-")
-            for i, dup in enumerate(duplicate_data, 1):
-                print(f"\nMatch #{i}:")
-                print(f"  Item: {dup['item']}")
-                print(f"  Similarity: {dup['similarity']:.3f} ({dup['similarity']*100:.1f}%)")
-                print(f"  Index: {dup['index']}")
-        else:
-            print("✅ No duplicates found! This item is unique.")
-            duplicate_data = []
+        for i, cluster in enumerate(clusters[:show], 1):
+            print(f"\nCluster #{i} ({len(cluster)} rows):")
+            for idx in cluster[:5]:
+                print(f"  [{idx}] {index.texts[idx]}")
+            if len(cluster) > 5:
+                print(f"  ... and {len(cluster) - 5} more")
         
-        # INTERPRETABILITY SECTION
-        if len(duplicate_indices) > 0:
-            print_header("🔬 INTERPRETABILITY")
-            
-            top_match = duplicate_data[0]
-            top_idx = top_match['index']
-            
-            # Feature Importance
-            print("\n📊 Feature Importance Analysis")
-            print_separator("-")
-            
-            feature_names = tfidf_vectorizer.get_feature_names_out()
-            input_vector = tfidf_vectorizer.transform([item_to_check])
-            match_vector = tfidf_matrix[top_idx]
-            
-            input_array = input_vector.toarray()[0]
-            match_array = match_vector.toarray()[0]
-            
-            # Get top contributing features
-            shared_features = input_array * match_array
-            top_feature_indices = np.argsort(shared_features)[-20:][::-1]
-            
-            print("\nTop 10 Most Important Shared Features:")
-            print(f"{'Feature':<20} {'Input TF-IDF':<15} {'Match TF-IDF':<15} {'Shared':<15}")
-            print_separator("-")
-            for idx in top_feature_indices[:10]:
-                if shared_features[idx] > 0:
-                    print(f"{feature_names[idx]:<20} {input_array[idx]:<15.4f} {match_array[idx]:<15.4f} {shared_features[idx]:<15.4f}")
-            
-            # Word Comparison
-            print("\n💬 Word-Level Comparison")
-            print_separator("-")
-            
-            input_words = Counter(extract_words(item_to_check))
-            match_words = Counter(extract_words(top_match['item']))
-            common_words = set(input_words.keys()) & set(match_words.keys())
-            
-            print(f"\nInput Item: '{item_to_check}'")
-            print(f"  Unique words: {len(input_words)}")
-            print(f"  Words: {', '.join(list(input_words.keys())[:15])}")
-            
-            print(f"\nMatched Item: '{top_match['item']}'")
-            print(f"  Unique words: {len(match_words)}")
-            print(f"  Words: {', '.join(list(match_words.keys())[:15])}")
-            
-            print(f"\nCommon Words ({len(common_words)}):")
-            if common_words:
-                print(f"  {', '.join(list(common_words)[:20])}")
-                
-                print("\nCommon Word Frequencies:")
-                print(f"{'Word':<20} {'Input Count':<15} {'Match Count':<15}")
-                print_separator("-")
-                for word in sorted(common_words, key=lambda w: input_words[w] + match_words[w], reverse=True)[:15]:
-                    print(f"{word:<20} {input_words[word]:<15} {match_words[word]:<15}")
-            
-            # Similarity Statistics
-            print("\n📈 Similarity Statistics")
-            print_separator("-")
-            print(f"Mean Similarity: {np.mean(similarities):.3f}")
-            print(f"Max Similarity: {np.max(similarities):.3f}")
-            print(f"Min Similarity: {np.min(similarities):.3f}")
-            print(f"Items Above Threshold: {len(duplicate_indices)}")
-            print(f"Total Items: {len(similarities)}")
+        if pairs_output:
+            with open(pairs_output, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['row_a', 'row_b', 'score'])
+                for a, b, score in zip(rows.tolist(), cols.tolist(), scores.tolist()):
+                    writer.writerow([a, b, f"{score:.6f}"])
+            print(f"\n💾 Pairs written to {pairs_output}")
+        if clusters_output:
+            with open(clusters_output, 'w', encoding='utf-8') as f:
+                for cluster_id, cluster in enumerate(clusters):
+                    f.write(json.dumps({'cluster_id': cluster_id, 'rows': cluster}) + '\n')
+            print(f"💾 Clusters written to {clusters_output}")
         
         print_separator()
         print("✅ Analysis complete!")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def update_command(index_dir, append_file=None, append_column=None, delete=None):
+    """
+    Append and/or delete rows of a saved index without refitting it
+    
+    Args:
+        index_dir: Directory written by build-index
+        append_file: File with rows to append, one per line ('-' for stdin)
+        append_column: Read append_file as CSV and take rows from this column
+        delete: List of row ids to delete
+    """
+    from incremental import append_rows, delete_rows
+
+    try:
+        if delete:
+            n_deleted = delete_rows(index_dir, delete)
+            print(f"🗑️  Deleted {n_deleted} row(s)")
+        if append_file:
+            texts = read_candidates(append_file, append_column)
+            first_row, n_unknown = append_rows(index_dir, texts)
+            print(f"➕ Appended {len(texts)} row(s) as rows {first_row}-{first_row + len(texts) - 1}")
+            if n_unknown:
+                print(f"⚠️  {n_unknown} token(s) are not in the fitted vocabulary and were ignored; "
+                      f"run 'compact' to refit")
         
-    except FileNotFoundError:
-        print(f"❌ Error: File '{csv_file}' not found")
+        index = TfidfIndex.load(index_dir, reweight=False)
+        deleted = int(np.count_nonzero(index.deleted)) if index.deleted is not None else 0
+        print(f"✅ Index now holds {len(index)} rows ({deleted} deleted), "
+              f"{index.meta.get('updates', 0)} update(s) since the last full build")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def compact_command(index_dir):
+    """Refit an updated index on its live rows"""
+    from incremental import compact_index
+
+    try:
+        print(f"🧹 Compacting {index_dir}...")
+        index, drift = compact_index(index_dir)
+        print(f"✅ Refit {len(index)} live rows; old row ids saved to previous_rows.npy")
+        print(f"📏 Max score difference between updated and refit index: {drift:.2e}")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def shard_command(index_dir, output_dir, n_shards):
+    """Split a saved index into shards that load and search independently"""
+    try:
+        print(f"✂️  Splitting {index_dir} into {n_shards} shard(s)...")
+        meta = split_index(index_dir, output_dir, n_shards)
+        for shard in meta['shards']:
+            last_row = shard['first_row'] + shard['n_rows'] - 1
+            print(f"  [{shard['id']}] {shard['dir']}: rows {shard['first_row']}-{last_row} "
+                  f"({shard['nnz']} stored values)")
+        print(f"💾 Sharded index with {meta['n_rows']} rows saved to {output_dir}")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def cache_command(index_dir, clear=False):
+    """Print the statistics of the result cache of an index, or delete it"""
+    path = os.path.join(index_dir, CACHE_FILE)
+    try:
+        files = [name for name in (path, cache_log_path(path)) if os.path.exists(name)]
+        if not files:
+            print(f"🗃️  No result cache in {index_dir} (query and batch create it with --cache)")
+            return
+        if clear:
+            for name in files:
+                os.remove(name)
+            print(f"🗑️  Result cache of {index_dir} cleared")
+            return
+        cache = ResultCache.load(path, max_bytes=float('inf'))
+        stats = cache.stats()
+        versions = {version for version, _ in cache.entries}
+        print(f"🗃️  Result cache of {index_dir}: {stats['entries']} entries "
+              f"({stats['bytes'] / 2**20:.1f} MB) for {len(versions)} index version(s)")
+        lookups = stats['hits'] + stats['misses']
+        print(f"   Lookups: {lookups}, hits: {stats['hits']}, misses: {stats['misses']}"
+              + (f" ({stats['hit_rate']:.1%} hit rate)" if lookups else ""))
+        print(f"   Evicted: {stats['evictions']}, expired: {stats['expirations']}, "
+              f"invalidated by index changes: {stats['invalidations']}")
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def lsh_report_command(index_dir, configs, backend='minhash', threshold=0.7, sample=200, seed=0):
+    """
+    Print recall and latency of LSH parameter choices against exact search
+    
+    Args:
+        index_dir: Directory written by build-index
+        configs: List of (bands, rows) pairs to evaluate
+        backend: 'minhash' or 'hyperplane'
+        threshold: Similarity threshold (default: 0.7)
+        sample: Number of indexed rows used as queries (default: 200)
+        seed: Random seed for the sample and the hash functions
+    """
+    try:
+        index = open_index(index_dir)
+        rng = np.random.RandomState(seed)
+        sample_rows = rng.choice(len(index), size=min(sample, len(index)), replace=False)
+        
+        print_header(f"📈 RECALL VS EXACT ({backend}, threshold {threshold}, {len(sample_rows)} queries)")
+        print(f"{'Bands x Rows':<14} {'Recall':<9} {'Expected':<10} {'Candidates':<12} "
+              f"{'Exact ms':<10} {'LSH ms':<10} {'Build s':<8}")
+        print_separator("-")
+        for bands, rows in configs:
+            start = time.perf_counter()
+            search_backend = make_backend(index.matrix, backend, bands, rows, seed, cache_dir=index_dir)
+            build_time = time.perf_counter() - start
+            report = recall_report(index.matrix, search_backend, sample_rows, threshold)
+            candidates = f"{report['candidate_fraction'] * 100:.2f}%"
+            print(f"{f'{bands} x {rows}':<14} {report['recall']:<9.3f} "
+                  f"{report['expected_recall_at_threshold']:<10.3f} "
+                  f"{candidates:<12} "
+                  f"{report['exact_ms']:<10.3f} {report['backend_ms']:<10.3f} {build_time:<8.2f}")
+        print_separator()
+        print("Recall: share of exact matches (excluding the query row) the backend also finds")
+        print("Expected: theoretical chance a row at the threshold becomes a candidate")
+        print("Candidates: share of the index rescored per query")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        sys.exit(1)
+
+def precision_report_command(index_dir, precisions, threshold=0.7, top_k=10, sample=200, seed=0):
+    """
+    Print memory and ranking change of compact precisions against float64
+    
+    Args:
+        index_dir: Directory written by build-index with float64 values
+        precisions: List of precisions to evaluate ('float32', 'uint8')
+        threshold: Similarity threshold (default: 0.7)
+        top_k: Ranking depth compared (default: 10)
+        sample: Number of indexed rows used as queries (default: 200)
+        seed: Random seed for the sample
+    """
+    try:
+        index = open_index(index_dir)
+        if index.precision != 'float64':
+            raise ValueError(f"The index stores {index.precision} values; "
+                             "build it with --precision float64 to compare against")
+        rng = np.random.RandomState(seed)
+        sample_rows = rng.choice(len(index), size=min(sample, len(index)), replace=False)
+        
+        print_header(f"📉 RANKING CHANGE VS FLOAT64 (top {top_k}, threshold {threshold}, "
+                     f"{len(sample_rows)} queries)")
+        print(f"{'Precision':<11} {'Disk MB':<9} {'RAM MB':<9} {'Mmap':<6} {'Max error':<11} "
+              f"{'Top-k overlap':<15} {'Same order':<12} {'Recall':<8}")
+        print_separator("-")
+        reference_mb = None
+        for precision in precisions:
+            report = precision_report(index.matrix, precision, sample_rows, threshold, top_k)
+            reference_mb = report['float64_bytes'] / 1024**2
+            print(f"{precision:<11} {report['stored_bytes'] / 1024**2:<9.2f} "
+                  f"{report['resident_bytes'] / 1024**2:<9.2f} "
+                  f"{'yes' if report['memory_mapped'] else 'no':<6} {report['max_score_error']:<11.2e} "
+                  f"{report['topk_overlap']:<15.4f} {report['same_order_fraction']:<12.4f} "
+                  f"{report['threshold_recall']:<8.4f}")
+        print_separator()
+        if reference_mb is not None:
+            print(f"float64 matrix: {reference_mb:.2f} MB")
+        if 'uint8' in precisions:
+            print("uint8 is a disk format: loading it builds a float32 copy in RAM (not memory-mapped)")
+        print("Top-k overlap: share of the float64 top-k rows still in the top-k")
+        print("Same order: share of queries whose top-k ranking is unchanged")
+        print("Recall: share of rows above the threshold with float64 that stay above it")
+    except FileNotFoundError as e:
+        print(f"❌ Error: File '{e.filename or e}' not found")
         sys.exit(1)
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         sys.exit(1)
 
-def main():
+def report_duplicates(index, item_to_check, threshold, backend=None, top_k=None, explain_all=False,
+                      fast_path=None, profiler=None, cache=None, cache_key=None):
+    """
+    Print the output and interpretability sections for one item
+    
+    Args:
+        index: TfidfIndex to search
+        item_to_check: Item to check for duplicates
+        threshold: Similarity threshold
+        backend: Search backend (default: exact brute force with numpy only)
+        top_k: Show at most this many matches (default: all above threshold)
+        explain_all: Show the shared features of every match, not only the best
+        fast_path: FingerprintIndex answering exact and normalized duplicates
+            without scoring the corpus (default: always score)
+        profiler: StageProfiler timing every stage (default: off)
+        cache: ResultCache answering repeated checks (default: off)
+        cache_key: (index version, result key) of the item in cache
+    """
+    # Check for duplicates
+    print(f"\n🔍 Checking for duplicates of: '{index.item_text(item_to_check)}'")
+    print(f"   Threshold: {threshold}")
+    
+    result = cache.get(*cache_key) if cache is not None else None
+    if result is not None:
+        print("   🗃️  Result cache hit: transform and scoring skipped")
+    else:
+        result = score_item(index, item_to_check, threshold, backend, top_k, explain_all,
+                            fast_path, profiler)
+        if cache is not None:
+            cache.put(*cache_key, result)
+    if result['fast_kind']:
+        print(f"   ⚡ Fast path: {result['fast_kind']} duplicate, corpus scan skipped")
+    
+    with profile_stage(profiler, 'output'):
+        duplicate_items = index.texts.take(result['rows'])
+        print_matches(result['rows'], duplicate_items, result['scores'], result['n_above'])
+    
+    # INTERPRETABILITY SECTION
+    if result['n_above'] > 0:
+        explained_indices = result['rows'] if explain_all else result['rows'][:1]
+        print_interpretability(index.item_text(item_to_check), duplicate_items[0],
+                               explained_indices, result['explanations'], result['n_above'],
+                               result['stats'], len(index), result['scored'], explain_all)
+    
+    print_separator()
+    print("✅ Analysis complete!")
+
+def score_item(index, item_to_check, threshold, backend=None, top_k=None, explain_all=False,
+               fast_path=None, profiler=None):
+    """
+    Matches, similarity statistics and explanations of one item
+    
+    Returns:
+        Dict of plain lists and numbers (so it can be cached as JSON) with
+        n_above, the ranked rows and scores, the stats of the scored rows,
+        the shared features of the explained rows, the line telling which
+        rows were scored when not all of them, and the fast path kind
+    """
+    # Vectorize input
+    with profile_stage(profiler, 'transform'):
+        if backend is None:
+            # Exact search: a dense vector against the CSR arrays, no scipy needed
+            item_vector = index.dense_vector(item_to_check)
+        else:
+            item_vector = index.transform([item_to_check])
+    
+    # Calculate similarity: only the identical rows when the fast path knows
+    # the item, every row for exact search, LSH candidates otherwise
+    with profile_stage(profiler, 'score'):
+        fast = fast_path.score(item_to_check, item_vector) if fast_path is not None else None
+        if fast is None and backend is None:
+            similarities = index.dense_similarities(item_vector)
+            scored_rows = np.arange(len(similarities))
+        elif fast is None:
+            scored_rows, similarities = backend.score(item_vector)
+    fast_kind = None
+    if fast is not None:
+        scored_rows, similarities, fast_kind = fast
+    
+    # Find duplicates
+    with profile_stage(profiler, 'select'):
+        n_above = int(np.count_nonzero(similarities >= threshold))
+        duplicate_indices, duplicate_scores = top_matches(scored_rows, similarities, threshold, top_k)
+    
+    result = {'n_above': n_above, 'rows': [int(row) for row in duplicate_indices],
+              'scores': [float(score) for score in duplicate_scores], 'explanations': [],
+              'stats': None, 'scored': None, 'fast_kind': fast_kind}
+    if n_above > 0:
+        with profile_stage(profiler, 'interpretability'):
+            # Feature Importance: shared terms of the explained matches in one sparse product
+            explained_indices = duplicate_indices if explain_all else duplicate_indices[:1]
+            if backend is None:
+                explanations = explain_dense(item_vector, index.csr_arrays, explained_indices,
+                                             index.feature_names, top_n=10)
+            else:
+                explanations = explain_matches(item_vector, index.matrix, explained_indices,
+                                               index.feature_names, top_n=10)
+            result['explanations'] = [
+                [[str(feature), float(input_weight), float(match_weight), float(shared)]
+                 for feature, input_weight, match_weight, shared in terms]
+                for terms in explanations
+            ]
+            if fast is not None:
+                result['scored'] = f"Rows Scored (fast path): {len(similarities)}"
+            elif backend is not None:
+                result['scored'] = f"Rows Scored ({backend.name}): {len(similarities)}"
+            result['stats'] = {'mean': float(np.mean(similarities)),
+                               'max': float(np.max(similarities)),
+                               'min': float(np.min(similarities))}
+    return result
+
+def report_sharded(index, item_to_check, threshold, top_k=None, explain_all=False, profiler=None,
+                   cache=None, cache_key=None):
+    """
+    Print the output and interpretability sections for one item of a sharded index
+    
+    The item is scored by every loaded shard in parallel and their top-k
+    are merged, which gives the matches of the unsharded index.
+    """
+    print(f"\n🔍 Checking for duplicates of: '{index.item_text(item_to_check)}'")
+    print(f"   Threshold: {threshold}")
+    
+    result = cache.get(*cache_key) if cache is not None else None
+    if result is not None:
+        print("   🗃️  Result cache hit: transform and scoring skipped")
+    else:
+        result = score_sharded(index, item_to_check, threshold, top_k, explain_all, profiler)
+        if cache is not None:
+            cache.put(*cache_key, result)
+    
+    with profile_stage(profiler, 'output'):
+        duplicate_items = index.take_texts(result['rows'])
+        print_matches(result['rows'], duplicate_items, result['scores'], result['n_above'])
+    
+    if result['n_above'] > 0:
+        explained_indices = result['rows'] if explain_all else result['rows'][:1]
+        scored = f"Shards Searched: {len(index.shards)} of {index.meta['n_shards']}"
+        print_interpretability(index.item_text(item_to_check), duplicate_items[0],
+                               explained_indices, result['explanations'], result['n_above'],
+                               result['stats'], len(index), scored, explain_all)
+    
+    print_separator()
+    print("✅ Analysis complete!")
+
+def score_sharded(index, item_to_check, threshold, top_k=None, explain_all=False, profiler=None):
+    """score_item() for a sharded index"""
+    with profile_stage(profiler, 'transform'):
+        item_vector = index.dense_vector(item_to_check)
+    
+    # Scatter the item to the shards and gather their best rows
+    with profile_stage(profiler, 'score'):
+        duplicate_indices, duplicate_scores, stats = index.query(item_vector, threshold, top_k)
+    
+    result = {'n_above': int(stats['n_above']), 'rows': [int(row) for row in duplicate_indices],
+              'scores': [float(score) for score in duplicate_scores], 'explanations': [],
+              'stats': {name: float(stats[name]) for name in ('mean', 'max', 'min')}}
+    if result['n_above'] > 0:
+        with profile_stage(profiler, 'interpretability'):
+            explained_indices = duplicate_indices if explain_all else duplicate_indices[:1]
+            result['explanations'] = [
+                [[str(feature), float(input_weight), float(match_weight), float(shared)]
+                 for feature, input_weight, match_weight, shared in terms]
+                for terms in index.explain(item_vector, explained_indices, top_n=10)
+            ]
+    return result
+
+def print_matches(duplicate_indices, duplicate_items, duplicate_scores, n_above):
+    """Print the output section: the ranked matches of one item"""
+    # OUTPUT SECTION
+    print_header("📤 OUTPUT")
+    
+    if n_above > 0:
+        shown = f", showing top {len(duplicate_indices)}" if len(duplicate_indices) < n_above else ""
+        print(f"⚠️  DUPLICATE DETECTED! Found {n_above} similar item(s){shown}\n")
+        
+        # Display results
+        print("Similar Items Found:")
+        print_separator("-")
+        for i, (idx, item, similarity) in enumerate(
+                zip(duplicate_indices, duplicate_items, duplicate_scores), 1):
+            print(f"\nMatch #{i}:")
+            print(f"  Item: {item}")
+            print(f"  Similarity: {similarity:.3f} ({similarity*100:.1f}%)")
+            print(f"  Index: {idx}")
+    else:
+        print("✅ No duplicates found! This item is unique.")
+
+def print_interpretability(item_text, top_item, explained_indices, explanations, n_above,
+                           stats, n_rows, scored=None, explain_all=False):
+    """
+    Print the interpretability section: why the best matches matched
+    
+    Args:
+        item_text: Display text of the checked item
+        top_item: Text of the best match
+        explained_indices: Rows whose shared features are shown
+        explanations: Shared features of every explained row (explain_matches)
+        n_above: Number of rows above the threshold
+        stats: Mean, max and min similarity of the scored rows
+        n_rows: Number of rows searched
+        scored: Extra line telling which rows were scored, if not all of them
+        explain_all: Number the explained matches (more than the best one)
+    """
+    if n_above > 0:
+        print_header("🔬 INTERPRETABILITY")
+        
+        print("\n📊 Feature Importance Analysis")
+        print_separator("-")
+        
+        for i, (idx, terms) in enumerate(zip(explained_indices, explanations), 1):
+            if explain_all:
+                print(f"\nMatch #{i} (Index: {idx}) - Top 10 Most Important Shared Features:")
+            else:
+                print("\nTop 10 Most Important Shared Features:")
+            print(f"{'Feature':<20} {'Input TF-IDF':<15} {'Match TF-IDF':<15} {'Shared':<15}")
+            print_separator("-")
+            for feature, input_weight, match_weight, shared in terms:
+                print(f"{feature:<20} {input_weight:<15.4f} {match_weight:<15.4f} {shared:<15.4f}")
+        
+        # Word Comparison
+        print("\n💬 Word-Level Comparison")
+        print_separator("-")
+        
+        input_words = Counter(extract_words(item_text))
+        match_words = Counter(extract_words(top_item))
+        common_words = set(input_words.keys()) & set(match_words.keys())
+        
+        print(f"\nInput Item: '{item_text}'")
+        print(f"  Unique words: {len(input_words)}")
+        print(f"  Words: {', '.join(list(input_words.keys())[:15])}")
+        
+        print(f"\nMatched Item: '{top_item}'")
+        print(f"  Unique words: {len(match_words)}")
+        print(f"  Words: {', '.join(list(match_words.keys())[:15])}")
+        
+        print(f"\nCommon Words ({len(common_words)}):")
+        if common_words:
+            print(f"  {', '.join(list(common_words)[:20])}")
+            
+            print("\nCommon Word Frequencies:")
+            print(f"{'Word':<20} {'Input Count':<15} {'Match Count':<15}")
+            print_separator("-")
+            for word in sorted(common_words, key=lambda w: input_words[w] + match_words[w], reverse=True)[:15]:
+                print(f"{word:<20} {input_words[word]:<15} {match_words[word]:<15}")
+        
+        # Similarity Statistics
+        print("\n📈 Similarity Statistics")
+        print_separator("-")
+        print(f"Mean Similarity: {stats['mean']:.3f}")
+        print(f"Max Similarity: {stats['max']:.3f}")
+        print(f"Min Similarity: {stats['min']:.3f}")
+        print(f"Items Above Threshold: {n_above}")
+        print(f"Total Items: {n_rows}")
+        if scored:
+            print(scored)
+
+COMMANDS = ('build-index', 'query', 'batch', 'dedupe', 'lsh-report', 'precision-report', 'update',
+            'compact', 'shard', 'cache')
+
+def build_command_parser():
+    """Parser for the index subcommands"""
+    parser = argparse.ArgumentParser(
+        prog='cli_app.py',
+        description="Duplicate Finder with Interpretability - index commands",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python cli_app.py build-index data.csv product_name ./product_index
+  python cli_app.py build-index data.csv title:2 ./product_index --column brand --column description:0.5
+  python cli_app.py build-index data.csv product_name ./sku_index --char-ngrams 3-4
+  python cli_app.py query ./sku_index "iphn 13pro" --backend inverted --min-overlap 0.3
+  python cli_app.py query ./product_index "iPhone 13 Pro" --threshold 0.8
+  python cli_app.py query ./product_index "iPhone 13 Pro" --profile --profile-dump ./profile
+  python cli_app.py batch ./product_index --input new_items.txt --output matches.jsonl
+  cat new_items.txt | python cli_app.py batch ./product_index > matches.csv
+  python cli_app.py dedupe ./product_index --threshold 0.9 --clusters-output clusters.jsonl
+  python cli_app.py query ./product_index "iPhone 13 Pro" --backend minhash --bands 20 --rows 5
+  python cli_app.py lsh-report ./product_index --backend minhash --config 20x5 --config 10x3
+  python cli_app.py precision-report ./product_index --precision float32 --precision uint8
+  python cli_app.py update ./product_index --append new_items.txt --delete 17 42
+  python cli_app.py compact ./product_index
+  python cli_app.py query ./product_index "iPhone 13 Pro" --cache --cache-ttl 3600
+  python cli_app.py cache ./product_index
+        """
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    build = subparsers.add_parser('build-index', help='Fit the TF-IDF model once and save it')
+    build.add_argument('csv_file', help='Path to CSV file')
+    build.add_argument('column_name', help='Name of the column to analyze')
+    build.add_argument('index_dir', help='Directory to write the index to')
+    build.add_argument('--max-features', type=int, default=5000,
+                       help='Max TF-IDF features (default: 5000)')
+    build.add_argument('--memory-mb', type=float, default=None,
+                       help='Stream the CSV in chunks to keep peak memory near this budget')
+    build.add_argument('--hash-features', type=int, default=None,
+                       help='Hash tokens into this many columns instead of fitting a vocabulary')
+    build.add_argument('--workers', type=int, default=1,
+                       help='Processes tokenizing the corpus in parallel (default: 1, 0 for all cores)')
+    add_column_argument(build)
+    build.add_argument('--precision', choices=PRECISIONS, default='float64',
+                       help='Storage of the matrix values: float64, float32 or uint8 with a '
+                            'per-row scale (on disk only, loaded as float32) (default: float64)')
+    add_char_ngrams_argument(build)
+    
+    query = subparsers.add_parser('query', help='Check an item against a saved index')
+    query.add_argument('index_dir', help='Directory written by build-index')
+    query.add_argument('item_to_check', help='Item to check for duplicates')
+    query.add_argument('--threshold', type=float, default=0.7,
+                       help='Similarity threshold (default: 0.7)')
+    query.add_argument('--max-features', type=int, default=None,
+                       help='Rebuild the index if it was built with a different value')
+    add_backend_arguments(query)
+    add_top_k_argument(query)
+    add_explain_all_argument(query)
+    add_fast_path_argument(query)
+    add_shard_arguments(query)
+    add_cache_arguments(query)
+    add_profile_arguments(query)
+    query.add_argument('--field', action='append', type=parse_field_value, default=None,
+                       metavar='COLUMN=TEXT',
+                       help='Text for one column of a multi-column index (repeatable); '
+                            'the other columns get item_to_check')
+    
+    batch = subparsers.add_parser('batch', help='Check many items against a saved index')
+    batch.add_argument('index_dir', help='Directory written by build-index')
+    batch.add_argument('--input', default='-',
+                       help="Candidate items, one per line ('-' for stdin, default)")
+    batch.add_argument('--input-column', default=None,
+                       help='Read the input as CSV and take candidates from this column')
+    batch.add_argument('--output', default='-',
+                       help="Result file ('-' for stdout, default)")
+    batch.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                       help='Output format (default: from --output extension, else csv)')
+    batch.add_argument('--threshold', type=float, default=0.7,
+                       help='Similarity threshold (default: 0.7)')
+    batch.add_argument('--memory-mb', type=float, default=256,
+                       help='Memory budget for one chunk of scores in MB (default: 256)')
+    add_top_k_argument(batch)
+    batch.add_argument('--explain', type=int, default=None, metavar='N',
+                       help='Add the N top shared terms of every match to the output')
+    add_fast_path_argument(batch)
+    add_shard_arguments(batch)
+    add_cache_arguments(batch)
+    batch.add_argument('--input-fields', action='store_true',
+                       help='Read the input as CSV with one column per column of a multi-column index')
+    
+    dedupe = subparsers.add_parser('dedupe', help='Find duplicates among the indexed rows')
+    dedupe.add_argument('index_dir', help='Directory written by build-index')
+    dedupe.add_argument('--threshold', type=float, default=0.7,
+                        help='Similarity threshold (default: 0.7)')
+    dedupe.add_argument('--pairs-output', default=None,
+                        help='Write duplicate pairs to this CSV file')
+    dedupe.add_argument('--clusters-output', default=None,
+                        help='Write duplicate clusters to this JSONL file')
+    dedupe.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: all cores)')
+    dedupe.add_argument('--memory-mb', type=float, default=256,
+                        help='Memory budget for one block of scores per worker in MB (default: 256)')
+    
+    lsh = subparsers.add_parser('lsh-report', help='Measure LSH recall against exact search')
+    lsh.add_argument('index_dir', help='Directory written by build-index')
+    lsh.add_argument('--backend', choices=['minhash', 'hyperplane'], default='minhash',
+                     help='LSH backend to evaluate (default: minhash)')
+    lsh.add_argument('--config', action='append', default=None, metavar='BANDSxROWS',
+                     help='Bands x rows to evaluate, repeatable (default: 10x3 20x5 32x8)')
+    lsh.add_argument('--threshold', type=float, default=0.7,
+                     help='Similarity threshold (default: 0.7)')
+    lsh.add_argument('--sample', type=int, default=200,
+                     help='Number of indexed rows used as queries (default: 200)')
+    
+    precision = subparsers.add_parser('precision-report',
+                                      help='Measure the ranking change of compact storage against float64')
+    precision.add_argument('index_dir', help='Directory written by build-index (float64)')
+    precision.add_argument('--precision', action='append', choices=PRECISIONS[1:], default=None,
+                           help='Precision to evaluate, repeatable (default: float32 uint8)')
+    precision.add_argument('--threshold', type=float, default=0.7,
+                           help='Similarity threshold (default: 0.7)')
+    precision.add_argument('--top-k', type=int, default=10,
+                           help='Ranking depth compared (default: 10)')
+    precision.add_argument('--sample', type=int, default=200,
+                           help='Number of indexed rows used as queries (default: 200)')
+    
+    update = subparsers.add_parser('update', help='Append or delete rows without refitting')
+    update.add_argument('index_dir', help='Directory written by build-index')
+    update.add_argument('--append', default=None,
+                        help="Rows to append, one per line ('-' for stdin)")
+    update.add_argument('--append-column', default=None,
+                        help='Read --append as CSV and take rows from this column')
+    update.add_argument('--delete', type=int, nargs='+', default=None, metavar='ROW',
+                        help='Row ids to delete')
+    
+    compact = subparsers.add_parser('compact', help='Refit an updated index on its live rows')
+    compact.add_argument('index_dir', help='Directory written by build-index')
+    
+    shard = subparsers.add_parser('shard', help='Split an index into independently loadable shards')
+    shard.add_argument('index_dir', help='Directory written by build-index (compacted)')
+    shard.add_argument('sharded_dir', help='Directory of the sharded index (replaced if it exists)')
+    shard.add_argument('--shards', type=int, required=True,
+                       help='Number of shards (contiguous row ranges of near-equal size)')
+    
+    cache = subparsers.add_parser('cache', help='Show (or clear) the result cache of an index')
+    cache.add_argument('index_dir', help='Directory written by build-index or shard')
+    cache.add_argument('--clear', action='store_true', help='Delete the cached results')
+    
+    return parser
+
+def add_backend_arguments(parser):
+    """Search backend options shared by the query commands"""
+    parser.add_argument('--backend', choices=BACKENDS, default='exact',
+                        help='Search backend (default: exact brute force)')
+    parser.add_argument('--bands', type=int, default=20,
+                        help='LSH bands (default: 20)')
+    parser.add_argument('--rows', type=int, default=5,
+                        help='LSH signature rows per band (default: 5)')
+    parser.add_argument('--min-overlap', type=float, default=DEFAULT_MIN_OVERLAP,
+                        help='Share of the item\'s features a row must contain to be scored by '
+                             f'the inverted backend (default: {DEFAULT_MIN_OVERLAP:g})')
+
+def add_top_k_argument(parser):
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='Keep only the k best matches (default: all above threshold)')
+
+def add_explain_all_argument(parser):
+    parser.add_argument('--explain-all', action='store_true',
+                        help='Show the shared features of every match, not only the best')
+
+def add_fast_path_argument(parser):
+    parser.add_argument('--fast-path', action='store_true',
+                        help='Answer exact and normalized duplicates from fingerprints before scoring')
+
+def add_shard_arguments(parser):
+    parser.add_argument('--shard', type=int, action='append', default=None, metavar='ID',
+                        help='Only search this shard of a sharded index (repeatable; default: all)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Threads scoring the shards of a sharded index '
+                             '(default: one per shard, up to the number of cores)')
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache', action='store_true',
+                        help='Answer repeated checks from a result cache kept in the index directory')
+    parser.add_argument('--cache-mb', type=float, default=16,
+                        help='Size bound of the result cache in MB (default: 16)')
+    parser.add_argument('--cache-ttl', type=float, default=None, metavar='SECONDS',
+                        help='Expire cached results after this many seconds (default: never)')
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', nargs='?', const='text', choices=['text', 'json'], default=None,
+                        help='Time every stage; print a table (text, default) or a JSON report '
+                             'to --profile-output (default: stderr)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Also record the peak traced memory of every stage (tracemalloc; '
+                             'slows down pure-Python stages such as the fit)')
+    parser.add_argument('--profile-output', default=None, metavar='FILE',
+                        help='Write the --profile report to this file')
+    parser.add_argument('--profile-dump', default=None, metavar='DIR',
+                        help='Also save a cProfile dump and a tracemalloc snapshot of the run to DIR '
+                             '(implies --profile-memory)')
+
+def open_profiler(args):
+    """Started StageProfiler for the --profile options, or None"""
+    if not (args.profile or args.profile_memory or args.profile_dump):
+        return None
+    return StageProfiler(memory=args.profile_memory, dump_dir=args.profile_dump).start()
+
+def write_profile(profiler, profile_format='text', output=None):
+    """Stop the profiler and write its report to output (default: stderr)"""
+    profiler.stop()
+    stream = open(output, 'w', encoding='utf-8') if output else sys.stderr
+    try:
+        if profile_format == 'json':
+            json.dump(profiler.report(), stream, indent=2)
+            stream.write('\n')
+        else:
+            print("\n⏱️  Stage profile", file=stream)
+            for line in profiler.format_table():
+                print(line, file=stream)
+            for kind, path in profiler.report().get('dumps', {}).items():
+                print(f"💾 {kind} dump: {path}", file=stream)
+    finally:
+        if stream is not sys.stderr:
+            stream.close()
+
+def add_char_ngrams_argument(parser):
+    parser.add_argument('--char-ngrams', nargs='?', const='3-4', default=None,
+                        type=parse_char_ngrams_value, metavar='MIN-MAX',
+                        help='Match on character n-grams of words instead of words, '
+                             'tolerating typos and run-together tokens (default range: 3-4)')
+
+def parse_char_ngrams_value(value):
+    try:
+        return parse_char_ngrams(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected N or MIN-MAX, got '{value}'")
+
+def add_column_argument(parser):
+    parser.add_argument('--column', action='append', default=None, metavar='NAME[:WEIGHT]',
+                        help='Another column to match on, with an optional weight (repeatable); '
+                             'the positional column can also take a :WEIGHT')
+
+def column_spec(column_name, extra_columns=None):
+    """Column name, or (column, weight) pairs when several columns are given"""
+    if not extra_columns:
+        return parse_field(column_name)[0]
+    return [parse_field(column_name)] + [parse_field(column) for column in extra_columns]
+
+def parse_field_value(value):
+    """Parse 'COLUMN=TEXT' into (column, text)"""
+    column, sep, text = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected COLUMN=TEXT, got '{value}'")
+    return column, text
+
+def parse_lsh_config(value):
+    """Parse 'BANDSxROWS' into (bands, rows)"""
+    bands, _, rows = value.lower().partition('x')
+    return int(bands), int(rows)
+
+def run_command(argv):
+    """Run one of the index subcommands"""
+    args = build_command_parser().parse_args(argv)
+    
+    if args.command == 'build-index':
+        print_header("🔍 DUPLICATE FINDER - BUILD INDEX")
+        print(f"CSV File: {args.csv_file}")
+        columns = column_spec(args.column_name, args.column)
+        print(f"Column: {format_fields(columns)}")
+        print(f"Index Directory: {args.index_dir}")
+        print()
+        build_index_command(args.csv_file, columns, args.index_dir, args.max_features,
+                            args.memory_mb, args.hash_features, args.workers or None, args.precision,
+                            args.char_ngrams)
+    elif args.command == 'query':
+        print_header("🔍 DUPLICATE FINDER WITH INTERPRETABILITY")
+        print(f"Index Directory: {args.index_dir}")
+        print(f"Item to Check: {args.item_to_check}")
+        print(f"Threshold: {args.threshold}")
+        print()
+        profiler = open_profiler(args)
+        try:
+            query_command(args.index_dir, args.item_to_check, args.threshold, args.max_features,
+                          args.backend, args.bands, args.rows, args.top_k, args.explain_all,
+                          args.fast_path, dict(args.field or []), args.min_overlap, profiler,
+                          args.shard, args.threads, args.cache_mb if args.cache else None,
+                          args.cache_ttl)
+        finally:
+            if profiler is not None:
+                write_profile(profiler, args.profile, args.profile_output)
+    elif args.command == 'batch':
+        batch_command(args.index_dir, args.input, args.output, args.format,
+                      args.input_column, args.threshold, args.memory_mb, args.top_k, args.explain,
+                      args.fast_path, args.input_fields, args.shard, args.threads,
+                      args.cache_mb if args.cache else None, args.cache_ttl)
+    elif args.command == 'dedupe':
+        print_header("🔍 DUPLICATE FINDER - DEDUPE DATASET")
+        print(f"Index Directory: {args.index_dir}")
+        print(f"Threshold: {args.threshold}")
+        print()
+        dedupe_command(args.index_dir, args.threshold, args.pairs_output,
+                       args.clusters_output, args.workers, args.memory_mb)
+    elif args.command == 'lsh-report':
+        configs = [parse_lsh_config(c) for c in (args.config or ['10x3', '20x5', '32x8'])]
+        lsh_report_command(args.index_dir, configs, args.backend, args.threshold, args.sample)
+    elif args.command == 'precision-report':
+        precision_report_command(args.index_dir, args.precision or ['float32', 'uint8'],
+                                 args.threshold, args.top_k, args.sample)
+    elif args.command == 'update':
+        update_command(args.index_dir, args.append, args.append_column, args.delete)
+    elif args.command == 'compact':
+        compact_command(args.index_dir)
+    elif args.command == 'shard':
+        shard_command(args.index_dir, args.sharded_dir, args.shards)
+    elif args.command == 'cache':
+        cache_command(args.index_dir, args.clear)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        run_command(argv)
+        return
+    
     parser = argparse.ArgumentParser(
         description="Duplicate Finder with Interpretability - CLI Version",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -186,6 +1304,14 @@ def main():
 Examples:
   python cli_app.py data.csv product_name "iPhone 13 Pro"
   python cli_app.py data.csv description "laptop computer" --threshold 0.8
+  python cli_app.py data.csv product_name "iPhone 13 Pro" --index-dir ./product_index
+  python cli_app.py data.csv product_name "iphn 13pro" --char-ngrams --backend inverted
+  python cli_app.py data.csv product_name "iPhone 13 Pro" --profile json --profile-output profile.json
+
+Index commands (fit once, query many times):
+  python cli_app.py build-index data.csv product_name ./product_index
+  python cli_app.py query ./product_index "iPhone 13 Pro"
+  python cli_app.py batch ./product_index --input new_items.txt --output matches.csv
         """
     )
     
@@ -196,26 +1322,50 @@ Examples:
                        help='Similarity threshold (default: 0.7)')
     parser.add_argument('--max-features', type=int, default=5000,
                        help='Max TF-IDF features (default: 5000)')
+    parser.add_argument('--index-dir', default=None,
+                       help='Reuse (or build) a saved index in this directory')
+    add_backend_arguments(parser)
+    add_top_k_argument(parser)
+    add_explain_all_argument(parser)
+    add_fast_path_argument(parser)
+    add_column_argument(parser)
+    add_char_ngrams_argument(parser)
+    add_profile_arguments(parser)
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # Print header
     print_header("🔍 DUPLICATE FINDER WITH INTERPRETABILITY")
     print(f"CSV File: {args.csv_file}")
-    print(f"Column: {args.column_name}")
+    columns = column_spec(args.column_name, args.column)
+    print(f"Column: {format_fields(columns)}")
     print(f"Item to Check: {args.item_to_check}")
     print(f"Threshold: {args.threshold}")
     print()
     
     # Run analysis
-    check_duplicates(
-        args.csv_file,
-        args.column_name,
-        args.item_to_check,
-        args.threshold,
-        args.max_features
-    )
+    profiler = open_profiler(args)
+    try:
+        check_duplicates(
+            args.csv_file,
+            columns,
+            args.item_to_check,
+            args.threshold,
+            args.max_features,
+            args.index_dir,
+            args.backend,
+            args.bands,
+            args.rows,
+            args.top_k,
+            args.explain_all,
+            args.fast_path,
+            args.min_overlap,
+            args.char_ngrams,
+            profiler
+        )
+    finally:
+        if profiler is not None:
+            write_profile(profiler, args.profile, args.profile_output)
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,141 @@
+"""
+Term-level explanations of TF-IDF matches
+
+The cosine similarity of two L2-normalised TF-IDF rows is the sum of
+item_weight * match_weight over the terms both rows contain, so the terms
+that explain a match are exactly the nonzeros of the elementwise product of
+the two sparse rows. Explanations for many (item, match) pairs are computed
+from one such sparse product; no vocabulary-length dense vector is built and
+nothing is sorted beyond the shared terms themselves. A single query
+vectorized densely with numpy only (TfidfIndex.dense_vector) is explained
+by explain_dense straight from the CSR arrays of the index.
+"""
+
+import numpy as np
+
+
+def shared_terms(item_vectors, tfidf_matrix, rows, item_ids=None, top_n=10):
+    """
+    Top shared terms of many (item, match) pairs in one sparse product
+
+    Args:
+        item_vectors: CSR matrix of vectorized items
+        tfidf_matrix: CSR matrix of the index
+        rows: Matched index row of every pair
+        item_ids: Row of item_vectors for every pair (default: all 0, i.e.
+            every pair explains the single item in item_vectors)
+        top_n: Terms kept per pair, by contribution (None keeps all)
+
+    Returns:
+        (pair, column, item_weight, match_weight, contribution) arrays, ordered
+        by pair and then by decreasing contribution (ties by column); the
+        contributions of one pair sum to its cosine similarity when top_n is None
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    item_ids = np.zeros(len(rows), dtype=np.int64) if item_ids is None else np.asarray(item_ids, dtype=np.int64)
+    if len(rows) == 0:
+        empty = np.array([], dtype=np.float64)
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), empty, empty, empty
+
+    items = item_vectors[item_ids]
+    matches = tfidf_matrix[rows]
+    products = items.multiply(matches).tocsr()
+    products.eliminate_zeros()
+
+    pair = np.repeat(np.arange(len(rows)), np.diff(products.indptr))
+    order = np.lexsort((products.indices, -products.data, pair))
+    if top_n is not None:
+        rank = np.arange(len(order)) - products.indptr[pair[order]]
+        order = order[rank < top_n]
+
+    pair = pair[order]
+    column = products.indices[order].astype(np.int64)
+    item_weight = np.asarray(items[pair, column]).ravel()
+    match_weight = np.asarray(matches[pair, column]).ravel()
+    return pair, column, item_weight, match_weight, products.data[order]
+
+
+def explain_dense(item_vector, csr_arrays, rows, feature_names, top_n=10):
+    """
+    explain_matches for one item given as a dense vector, with numpy only
+
+    Args:
+        item_vector: Dense vector of the item (TfidfIndex.dense_vector)
+        csr_arrays: (data, indices, indptr) of the index (TfidfIndex.csr_arrays)
+        Other arguments as for explain_matches
+
+    Returns:
+        The same lists as explain_matches
+    """
+    data, indices, indptr = csr_arrays
+    explanations = []
+    for row in rows:
+        lo, hi = int(indptr[row]), int(indptr[row + 1])
+        column = np.asarray(indices[lo:hi], dtype=np.int64)
+        match_weight = np.asarray(data[lo:hi], dtype=np.float64)
+        item_weight = item_vector[column]
+        contribution = item_weight * match_weight
+        shared = np.nonzero(contribution)[0]
+        order = shared[np.lexsort((column[shared], -contribution[shared]))][:top_n]
+        explanations.append([
+            (feature_names[c], iw, mw, contrib) for c, iw, mw, contrib in zip(
+                column[order].tolist(), item_weight[order].tolist(),
+                match_weight[order].tolist(), contribution[order].tolist())
+        ])
+    return explanations
+
+
+def explain_matches(item_vectors, tfidf_matrix, rows, feature_names, item_ids=None, top_n=10):
+    """
+    Shared-term explanation of every (item, match) pair
+
+    Args:
+        feature_names: Column names of the index (cached once per index)
+        Other arguments as for shared_terms
+
+    Returns:
+        One list per pair of (feature, item_weight, match_weight, contribution)
+        tuples, largest contribution first
+    """
+    pair, column, item_weight, match_weight, contribution = shared_terms(
+        item_vectors, tfidf_matrix, rows, item_ids, top_n
+    )
+    explanations = [[] for _ in range(len(rows))]
+    for p, c, iw, mw, contrib in zip(pair.tolist(), column.tolist(), item_weight.tolist(),
+                                     match_weight.tolist(), contribution.tolist()):
+        explanations[p].append((feature_names[c], iw, mw, contrib))
+    return explanations
+
+
+def with_explanations(matches, item_vectors, tfidf_matrix, feature_names, top_n=10,
+                      group_size=4096):
+    """
+    Attach shared-term explanations to a stream of batch matches
+
+    Matches are explained group_size pairs at a time, one sparse product per
+    group, so the stream is never held in memory at once.
+
+    Yields:
+        (item_index, row, score, terms) for every (item_index, row, score)
+    """
+    group = []
+    for match in matches:
+        group.append(match)
+        if len(group) == group_size:
+            yield from _explain_group(group, item_vectors, tfidf_matrix, feature_names, top_n)
+            group = []
+    yield from _explain_group(group, item_vectors, tfidf_matrix, feature_names, top_n)
+
+
+def _explain_group(group, item_vectors, tfidf_matrix, feature_names, top_n):
+    if not group:
+        return
+    item_ids, rows, _ = zip(*group)
+    explanations = explain_matches(item_vectors, tfidf_matrix, rows, feature_names, item_ids, top_n)
+    for (item_idx, row, score), terms in zip(group, explanations):
+        yield item_idx, row, score, terms
+
+
+def format_terms(terms):
+    """Compact 'term:contribution;...' form of one explanation"""
+    return ';'.join(f"{feature}:{contrib:.4f}" for feature, _, _, contrib in terms)
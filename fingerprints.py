@@ -0,0 +1,194 @@
+"""
+Exact and normalized-duplicate fast path
+
+Every indexed row gets a 64-bit fingerprint of its sorted analyzed tokens
+(lowercased, tokenised and stop-word filtered exactly like the TF-IDF
+vectorizer, or its character n-grams for a char_ngrams index). Two texts
+with the same fingerprint have the same token multiset and therefore the
+same TF-IDF vector, so a query whose fingerprint is in the table is a
+duplicate with cosine similarity 1.0 of those rows and the corpus scan can
+be skipped. Reordered, re-cased, re-spaced or re-punctuated copies are
+caught this way; anything else falls through to the vector path.
+
+Fingerprints are kept as a sorted key array plus the row of every key, like
+the LSH tables, so a lookup is one binary search and the table is saved as
+.npy files inside the index directory.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from search import top_matches
+
+FINGERPRINT_DIR = 'fingerprints'
+
+
+def text_fingerprint(text, analyzer):
+    """
+    64-bit fingerprint of the sorted analyzed tokens of text
+
+    Args:
+        text: String to fingerprint
+        analyzer: Tokeniser of the index (TfidfIndex.analyze)
+
+    Returns:
+        Unsigned integer, or None when text has no tokens (its TF-IDF vector
+        is empty and matches nothing)
+    """
+    tokens = analyzer(text)
+    if not tokens:
+        return None
+    digest = hashlib.blake2b(' '.join(sorted(tokens)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class FingerprintIndex:
+    """Sorted fingerprint table of an index with fast-path counters"""
+
+    def __init__(self, index, sorted_keys, rows):
+        self.index = index
+        self.sorted_keys = sorted_keys
+        self.rows = rows
+        self.counts = {'queries': 0, 'exact': 0, 'normalized': 0}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, index):
+        if index.fields:
+            # Token multisets of the joined fields do not identify stacked field vectors
+            raise ValueError("The fast path needs a single-column index")
+        keys = np.zeros(len(index), dtype=np.uint64)
+        has_tokens = np.zeros(len(index), dtype=bool)
+        for row, text in enumerate(index.texts):
+            key = text_fingerprint(text, index.analyze)
+            if key is not None:
+                keys[row] = key
+                has_tokens[row] = True
+        rows = np.nonzero(has_tokens)[0]
+        order = np.argsort(keys[rows], kind='stable')
+        return cls(index, keys[rows][order], rows[order])
+
+    def lookup(self, text):
+        """
+        Live rows whose analyzed tokens equal those of text
+
+        Returns:
+            (rows, kind) where kind is 'exact' when one of the rows is
+            byte-identical to text, 'normalized' for other hits and None
+            (with no rows) when the vector path is needed
+        """
+        key = text_fingerprint(text, self.index.analyze)
+        rows = np.array([], dtype=np.int64)
+        if key is not None:
+            lo = np.searchsorted(self.sorted_keys, np.uint64(key), side='left')
+            hi = np.searchsorted(self.sorted_keys, np.uint64(key), side='right')
+            rows = np.asarray(self.rows[lo:hi], dtype=np.int64)
+            if self.index.deleted is not None:
+                rows = rows[~self.index.deleted[rows]]
+
+        kind = None
+        if len(rows):
+            exact = any(self.index.texts[row] == text for row in rows)
+            kind = 'exact' if exact else 'normalized'
+        with self.lock:
+            self.counts['queries'] += 1
+            if kind:
+                self.counts[kind] += 1
+        return rows, kind
+
+    def score(self, text, item_vector):
+        """
+        Fast-path answer in the shape of a search backend's score()
+
+        item_vector is a sparse row of TfidfIndex.transform, or a dense
+        vector of TfidfIndex.dense_vector (then only numpy is needed).
+
+        Returns:
+            (rows, similarities, kind), or None when the fast path missed
+        """
+        rows, kind = self.lookup(text)
+        if kind is None:
+            return None
+        if isinstance(item_vector, np.ndarray):
+            similarities = self.index.dense_similarities(item_vector, rows)
+        else:
+            similarities = np.asarray(self.index.matrix[rows] @ item_vector.toarray()[0]).ravel()
+        return rows, similarities, kind
+
+    def stats(self):
+        """Counters with the share of queries served by the fast path"""
+        with self.lock:
+            counts = dict(self.counts)
+        served = counts['exact'] + counts['normalized']
+        counts['served_fraction'] = served / counts['queries'] if counts['queries'] else 0.0
+        return counts
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'sorted_keys.npy'), self.sorted_keys)
+        np.save(os.path.join(directory, 'rows.npy'), self.rows)
+        with open(os.path.join(directory, 'params.json'), 'w') as f:
+            json.dump(_table_params(self.index), f)
+
+    @classmethod
+    def load(cls, directory, index):
+        with open(os.path.join(directory, 'params.json')) as f:
+            params = json.load(f)
+        if params != _table_params(index):
+            raise ValueError("fingerprint table does not match the index")
+        return cls(
+            index,
+            np.load(os.path.join(directory, 'sorted_keys.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r'),
+        )
+
+
+def split_fast_path(fingerprints, items, item_vectors, threshold=0.7, top_k=None):
+    """
+    Answer the items the fast path knows and leave the rest for scoring
+
+    Returns:
+        (matches, remaining) where matches is a list of (item_index, row,
+        score) for the fast-path items, in item order, and remaining is the
+        array of item indices that still need the vector path
+    """
+    matches = []
+    remaining = []
+    for item_idx, item in enumerate(items):
+        found = fingerprints.score(item, item_vectors[item_idx])
+        if found is None:
+            remaining.append(item_idx)
+            continue
+        rows, similarities, _ = found
+        rows, scores = top_matches(rows, similarities, threshold, top_k)
+        matches.extend((item_idx, int(row), float(score)) for row, score in zip(rows, scores))
+    return matches, np.asarray(remaining, dtype=np.int64)
+
+
+def _table_params(index):
+    # Appends and rebuilds change n_rows or the update count; deletions are
+    # filtered at lookup time
+    return {'n_rows': len(index), 'updates': index.meta.get('updates', 0),
+            'source': index.meta.get('source', {}).get('sha256')}
+
+
+def open_fingerprints(index, cache_dir=None):
+    """
+    Fingerprint table of an index, reusing the one saved in cache_dir
+    (usually the index directory) when it still matches the index
+    """
+    if cache_dir is None:
+        return FingerprintIndex.build(index)
+    directory = os.path.join(cache_dir, FINGERPRINT_DIR)
+    if os.path.exists(os.path.join(directory, 'params.json')):
+        try:
+            return FingerprintIndex.load(directory, index)
+        except (OSError, ValueError, KeyError):
+            pass
+    fingerprints = FingerprintIndex.build(index)
+    fingerprints.save(directory)
+    return fingerprints
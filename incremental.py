@@ -0,0 +1,208 @@
+"""
+Incremental updates of a saved TF-IDF index
+
+Rows can be appended and deleted without refitting the corpus:
+
+    append   new rows are vectorized with the idf the stored matrix uses and
+             appended to the index files; document frequencies are updated
+    delete   rows are tombstoned and their terms removed from the document
+             frequencies; nothing else is rewritten
+    compact  live rows are refit from scratch, dropping tombstones
+
+After append/delete the index is marked as updated and TfidfIndex.load()
+reweights every row from the stored idf to the idf of the current document
+frequencies. With a hashed feature space this is exactly what a full refit
+produces. With a fitted vocabulary the vocabulary itself stays frozen until
+compaction: terms first seen in appended rows are ignored and the
+max_features selection is not redone, so scores can differ from a refit
+only through those terms (see compact_index for a measured drift).
+
+Multi-column indexes are rebuilt instead: their rows are weighted per
+field, which the row-level reweighting on load would not preserve.
+
+An updated (or compacted) index no longer matches its source CSV, so
+load_or_build_index refuses to rebuild it automatically when the CSV
+changes; only an explicit build-index starts over from the CSV.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import scipy.sparse as sp
+
+from tfidf_index import (
+    TfidfIndex,
+    TextStore,
+    document_frequency,
+    offset_dtype,
+    replace_index_dir,
+    tfidf_vectors,
+    write_matrix_files,
+    write_meta,
+    write_model_files,
+)
+
+
+def _check_single_column(index):
+    if index.fields:
+        raise ValueError("Incremental updates need a single-column index; "
+                         "rebuild multi-column indexes with build-index")
+
+
+def _save_array(index_dir, name, array):
+    """Replace one .npy file of an index directory atomically"""
+    path = os.path.join(index_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _live_docs(index):
+    return len(index) - (int(np.count_nonzero(index.deleted)) if index.deleted is not None else 0)
+
+
+def append_rows(index_dir, texts):
+    """
+    Append rows to a saved index without refitting it
+
+    Args:
+        index_dir: Directory written by build-index
+        texts: List of strings to append
+
+    Returns:
+        (first_new_row, n_unknown_tokens) where n_unknown_tokens counts tokens
+        outside a fitted vocabulary (always 0 for a hashed feature space)
+    """
+    index = TfidfIndex.load(index_dir, reweight=False)
+    _check_single_column(index)
+    first_row = len(index)
+
+    vectors = tfidf_vectors(texts, index.vocabulary, index.idf, index.stop_words, index.analyze)
+    n_unknown = 0
+    if not index.meta.get('hash_features'):
+        n_unknown = sum(
+            1 for text in texts for token in index.analyze(text)
+            if token not in index.vocabulary
+        )
+
+    matrix = index.matrix
+    nnz = matrix.indptr[-1]
+    data = np.concatenate([matrix.data, vectors.data])
+    indices = np.concatenate([matrix.indices, vectors.indices.astype(matrix.indices.dtype)])
+    indptr = np.concatenate([matrix.indptr, vectors.indptr[1:] + nnz]).astype(np.int64)
+
+    new_texts = TextStore.from_list(texts)
+    buffer = np.concatenate([np.asarray(index.texts.buffer), new_texts.buffer])
+    offsets = np.concatenate([
+        np.asarray(index.texts.offsets, dtype=np.int64),
+        new_texts.offsets[1:].astype(np.int64) + int(index.texts.offsets[-1])
+    ])
+
+    deleted = index.deleted
+    if deleted is not None:
+        deleted = np.concatenate([deleted, np.zeros(len(texts), dtype=bool)])
+
+    meta = dict(index.meta)
+    meta['n_rows'] = first_row + len(texts)
+    meta['n_docs'] = meta.get('n_docs', _live_docs(index)) + len(texts)
+    meta['updates'] = meta.get('updates', 0) + 1
+    meta['revision'] = meta.get('revision', 0) + 1
+
+    tmp_dir = index_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    appended = sp.csr_matrix((data, indices, indptr), shape=(meta['n_rows'], matrix.shape[1]))
+    write_matrix_files(tmp_dir, appended, index.precision)
+    np.save(os.path.join(tmp_dir, 'text_offsets.npy'), offsets.astype(offset_dtype(offsets[-1])))
+    with open(os.path.join(tmp_dir, 'texts.bin'), 'wb') as f:
+        f.write(buffer.tobytes())
+    np.save(os.path.join(tmp_dir, 'doc_freq.npy'), index.doc_freq + document_frequency(vectors))
+    if deleted is not None:
+        np.save(os.path.join(tmp_dir, 'deleted.npy'), deleted)
+    write_model_files(tmp_dir, index.feature_names, index.idf, index.stop_words, meta)
+    del index, matrix
+    replace_index_dir(tmp_dir, index_dir)
+    return first_row, n_unknown
+
+
+def delete_rows(index_dir, rows):
+    """
+    Tombstone rows of a saved index
+
+    Returns:
+        Number of rows newly deleted
+    """
+    index = TfidfIndex.load(index_dir, reweight=False)
+    _check_single_column(index)
+    rows = np.unique(np.asarray(rows, dtype=np.int64))
+    if len(rows) and (rows[0] < 0 or rows[-1] >= len(index)):
+        raise ValueError(f"Row ids must be between 0 and {len(index) - 1}")
+
+    deleted = np.zeros(len(index), dtype=bool) if index.deleted is None else index.deleted.copy()
+    rows = rows[~deleted[rows]]
+    if len(rows) == 0:
+        return 0
+    deleted[rows] = True
+
+    doc_freq = index.doc_freq - document_frequency(index.matrix[rows])
+    meta = dict(index.meta)
+    meta['n_docs'] = meta.get('n_docs', _live_docs(index)) - len(rows)
+    meta['updates'] = meta.get('updates', 0) + 1
+    meta['revision'] = meta.get('revision', 0) + 1
+
+    del index
+    # meta.json goes last: until it is replaced, the index loads as before
+    _save_array(index_dir, 'deleted.npy', deleted)
+    _save_array(index_dir, 'doc_freq.npy', doc_freq)
+    write_meta(index_dir, meta)
+    return len(rows)
+
+
+def compact_index(index_dir, sample=100, seed=0):
+    """
+    Refit an updated index on its live rows, dropping tombstones
+
+    Before replacing the index, the scores of up to `sample` live rows used
+    as queries are compared between the incrementally updated index and the
+    refit one.
+
+    Returns:
+        (new_index, max_score_drift) where max_score_drift is the largest
+        absolute similarity difference seen in the comparison
+    """
+    updated = TfidfIndex.load(index_dir, mmap=False)
+    _check_single_column(updated)
+    live_rows = np.arange(len(updated))
+    if updated.deleted is not None:
+        live_rows = live_rows[~updated.deleted]
+    live_texts = updated.texts.take(live_rows)
+
+    meta = {key: value for key, value in updated.meta.items()
+            if key not in ('updates', 'n_docs', 'n_rows', 'n_features', 'format_version')}
+    if updated.meta.get('updates'):
+        # The refit rows still differ from the source CSV
+        meta['compacted'] = True
+    compacted = TfidfIndex.from_texts(
+        live_texts,
+        max_features=updated.meta.get('max_features') or 5000,
+        meta=meta,
+        hash_features=updated.meta.get('hash_features'),
+        precision=updated.precision,
+        char_ngrams=updated.meta.get('char_ngrams')
+    )
+
+    rng = np.random.RandomState(seed)
+    probe = rng.choice(len(live_texts), size=min(sample, len(live_texts)), replace=False)
+    live_matrix = updated.matrix[live_rows]
+    drift = 0.0
+    for pos in probe:
+        before = np.asarray(live_matrix @ updated.transform([live_texts[pos]]).toarray()[0])
+        after = compacted.similarities(compacted.transform([live_texts[pos]]))
+        drift = max(drift, float(np.abs(before.ravel() - after).max()))
+
+    compacted.save(index_dir)
+    # Compaction renumbers rows; keep the old row id of every new row
+    np.save(os.path.join(index_dir, 'previous_rows.npy'), live_rows)
+    return TfidfIndex.load(index_dir), drift
@@ -0,0 +1,285 @@
+"""
+Streaming index builder for datasets larger than RAM
+
+Only the target column is parsed (usecols) and the file is read in chunks
+(chunksize), twice; a Parquet file is read in record batches of that
+column, and a memory-mapped Arrow file in slices of it:
+
+    pass 1  tokenise every chunk and count term and document frequencies,
+            then pick the vocabulary and idf weights exactly like
+            TfidfVectorizer(max_features=..., stop_words='english')
+    pass 2  vectorize every chunk with the fixed vocabulary and append its
+            CSR rows and texts straight to the index files on disk
+
+Peak memory is one chunk plus the term counters, so it is set by
+memory_budget_mb and the number of distinct terms, not by the file size.
+"""
+
+import os
+import shutil
+from collections import Counter
+
+import numpy as np
+
+from tfidf_index import (
+    INDEX_FORMAT_VERSION,
+    MATRIX_DTYPES,
+    HashedFeatures,
+    TextStore,
+    check_column,
+    file_fingerprint,
+    input_format,
+    iter_arrow_text_chunks,
+    make_analyzer,
+    narrowest_uint,
+    offset_dtype,
+    quantize_rows,
+    next_revision,
+    replace_index_dir,
+    smooth_idf,
+    tfidf_vectors,
+    write_model_files,
+)
+
+# Rough Python memory per byte of text while a chunk is tokenised and
+# vectorized (str objects, token lists, per-row dicts), plus a fixed cost
+# per row. Deliberately pessimistic.
+BYTES_PER_TEXT_BYTE = 24
+BYTES_PER_ROW = 600
+
+MIN_CHUNK_ROWS = 1000
+
+
+def iter_text_chunks(csv_file, column_name, chunk_rows):
+    """
+    Yield the texts of one column, chunk_rows at a time
+
+    Chunks of a CSV file are lists of strings, those of a Parquet or Arrow
+    file TextStores over the column's buffers.
+    """
+    fmt = input_format(csv_file)
+    if fmt != 'csv':
+        yield from iter_arrow_text_chunks(csv_file, column_name, chunk_rows, fmt)
+        return
+    import pandas as pd
+
+    check_column(csv_file, column_name)
+    reader = pd.read_csv(csv_file, usecols=[column_name], dtype={column_name: str},
+                         chunksize=chunk_rows)
+    for chunk in reader:
+        yield chunk[column_name].fillna('').tolist()
+
+
+def estimate_chunk_rows(csv_file, column_name, memory_budget_mb, sample_rows=1000):
+    """
+    Rows per chunk so that one chunk stays within the memory budget
+
+    The average text length is measured on the first sample_rows rows.
+    Half of the budget is left for the term counters of pass 1.
+    """
+    sample = next(iter_text_chunks(csv_file, column_name, sample_rows), [])
+    avg_bytes = np.mean([len(text.encode('utf-8')) for text in sample]) if sample else 0
+    per_row = avg_bytes * BYTES_PER_TEXT_BYTE + BYTES_PER_ROW
+    budget = memory_budget_mb * 1024 * 1024 / 2
+    return max(MIN_CHUNK_ROWS, int(budget // per_row))
+
+
+def count_terms(chunks, analyzer, features=None):
+    """
+    Pass 1: count term occurrences and document frequencies
+
+    Texts are tokenised with analyzer (see make_analyzer). With features
+    (HashedFeatures), tokens are counted by hashed column.
+
+    Returns:
+        (n_docs, term_counts, doc_freq)
+    """
+    term_counts = Counter()
+    doc_freq = Counter()
+    n_docs = 0
+    for texts in chunks:
+        for text in texts:
+            tokens = analyzer(text)
+            if features is not None:
+                tokens = [features.get(token) for token in tokens]
+            term_counts.update(tokens)
+            doc_freq.update(set(tokens))
+        n_docs += len(texts)
+    return n_docs, term_counts, doc_freq
+
+
+def select_vocabulary(term_counts, max_features=None):
+    """
+    Keep the max_features most frequent terms, in alphabetical order
+
+    Uses the same (unstable) argsort over alphabetically sorted counts as
+    TfidfVectorizer, so ties at the cut-off resolve to the same terms.
+    """
+    terms = sorted(term_counts)
+    if not terms:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+    if max_features is not None and len(terms) > max_features:
+        counts = np.array([term_counts[term] for term in terms], dtype=np.int64)
+        terms = [terms[i] for i in top_feature_columns(counts, max_features)]
+    return terms
+
+
+def top_feature_columns(counts, max_features=None):
+    """
+    Columns of the max_features largest int64 term counts, in column order
+
+    Columns must be in alphabetical term order; ties at the cut-off resolve
+    like TfidfVectorizer's (unstable) argsort.
+    """
+    if max_features is None or len(counts) <= max_features:
+        return np.arange(len(counts))
+    return np.sort((-counts).argsort()[:max_features])
+
+
+def _raw_to_npy(raw_path, npy_path, dtype, count, block=1 << 24):
+    """Copy a raw binary array into a .npy file without loading it whole"""
+    out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(count,))
+    with open(raw_path, 'rb') as f:
+        for start in range(0, count, block):
+            n = min(block, count - start)
+            out[start:start + n] = np.fromfile(f, dtype=dtype, count=n)
+    out.flush()
+    del out
+    os.remove(raw_path)
+
+
+def _narrow_npy(path, dtype):
+    """Rewrite a .npy file with a narrower dtype"""
+    np.save(path, np.load(path).astype(dtype))
+
+
+def build_index_streaming(csv_file, column_name, index_dir, max_features=5000,
+                          memory_budget_mb=512, chunk_rows=None, hash_features=None,
+                          precision='float64', char_ngrams=None):
+    """
+    Build a saved TF-IDF index from one CSV column without loading the file
+
+    The result is identical to TfidfIndex.from_texts(...).save(index_dir).
+
+    Args:
+        csv_file: Path to CSV file
+        column_name: Name of the column to analyze
+        index_dir: Directory to write the index to
+        max_features: Max TF-IDF features (default: 5000)
+        memory_budget_mb: Target peak memory in MB (default: 512)
+        chunk_rows: Rows per chunk (default: derived from memory_budget_mb)
+        hash_features: If given, hash tokens into this many columns instead
+            of fitting a vocabulary
+        precision: 'float64' (default), 'float32' or 'uint8' matrix values
+        char_ngrams: (min_n, max_n) to index character n-grams instead of words
+
+    Returns:
+        Number of indexed rows
+    """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    stop_words = () if char_ngrams else ENGLISH_STOP_WORDS
+    analyzer = make_analyzer(stop_words, char_ngrams)
+    chunk_rows = chunk_rows or estimate_chunk_rows(csv_file, column_name, memory_budget_mb)
+
+    # Pass 1: vocabulary and idf
+    features = HashedFeatures(hash_features) if hash_features else None
+    n_docs, term_counts, doc_freq = count_terms(
+        iter_text_chunks(csv_file, column_name, chunk_rows), analyzer, features
+    )
+    term_order = None
+    if features is not None:
+        feature_names = vocabulary = features
+        column_df = np.zeros(hash_features, dtype=np.int64)
+        column_df[list(doc_freq)] = list(doc_freq.values())
+    else:
+        feature_names = select_vocabulary(term_counts, max_features)
+        vocabulary = {term: i for i, term in enumerate(feature_names)}
+        column_df = np.array([doc_freq[term] for term in feature_names], dtype=np.int64)
+        # term_counts is in order of first occurrence, the order fit_transform
+        # normalises each row in
+        first_seen = {term: rank for rank, term in enumerate(term_counts)}
+        term_order = np.array([first_seen[term] for term in feature_names], dtype=np.int64)
+        del first_seen
+    idf = smooth_idf(column_df, n_docs)
+    del term_counts, doc_freq
+
+    # Pass 2: vectorize chunk by chunk, appending to the index files
+    tmp_dir = index_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    indptr = np.lib.format.open_memmap(
+        os.path.join(tmp_dir, 'indptr.npy'), mode='w+', dtype=np.int64, shape=(n_docs + 1,)
+    )
+    offsets = np.lib.format.open_memmap(
+        os.path.join(tmp_dir, 'text_offsets.npy'), mode='w+', dtype=np.int64, shape=(n_docs + 1,)
+    )
+    indptr[0] = offsets[0] = 0
+    data_path = os.path.join(tmp_dir, 'data.raw')
+    indices_path = os.path.join(tmp_dir, 'indices.raw')
+    scale_path = os.path.join(tmp_dir, 'row_scale.raw')
+    quantized = precision == 'uint8'
+    data_dtype = np.uint8 if quantized else MATRIX_DTYPES[precision]
+    indices_dtype = narrowest_uint(len(feature_names) - 1) if quantized else np.int32
+
+    row = nnz = text_bytes = 0
+    with open(data_path, 'wb') as data_file, open(indices_path, 'wb') as indices_file, \
+            open(scale_path, 'wb') as scale_file, \
+            open(os.path.join(tmp_dir, 'texts.bin'), 'wb') as texts_file:
+        for texts in iter_text_chunks(csv_file, column_name, chunk_rows):
+            if row + len(texts) > n_docs:
+                raise ValueError(f"'{csv_file}' changed while the index was being built")
+            vectors = tfidf_vectors(texts, vocabulary, idf, stop_words, analyzer, term_order)
+            if quantized:
+                # Rows never span chunks, so per-row scales can be computed chunk by chunk
+                codes, row_scale = quantize_rows(vectors.data, vectors.indptr)
+                codes.tofile(data_file)
+                row_scale.tofile(scale_file)
+            else:
+                vectors.data.astype(data_dtype).tofile(data_file)
+            vectors.indices.astype(indices_dtype).tofile(indices_file)
+            indptr[row + 1:row + 1 + len(texts)] = vectors.indptr[1:] + nnz
+
+            # Already UTF-8 with offsets when the chunk came from a columnar file
+            store = texts if isinstance(texts, TextStore) else TextStore.from_list(texts)
+            store.buffer.tofile(texts_file)
+            offsets[row + 1:row + 1 + len(texts)] = store.offsets[1:].astype(np.int64) + text_bytes
+
+            row += len(texts)
+            nnz += vectors.nnz
+            text_bytes += len(store.buffer)
+
+    if row != n_docs:
+        raise ValueError(f"'{csv_file}' changed while the index was being built")
+    indptr.flush()
+    offsets.flush()
+    del indptr, offsets
+
+    _raw_to_npy(data_path, os.path.join(tmp_dir, 'data.npy'), data_dtype, nnz)
+    _raw_to_npy(indices_path, os.path.join(tmp_dir, 'indices.npy'), indices_dtype, nnz)
+    if quantized:
+        _raw_to_npy(scale_path, os.path.join(tmp_dir, 'row_scale.npy'), np.float32, n_docs)
+    else:
+        os.remove(scale_path)
+    # Narrow the row arrays now that the totals are known (one int64 per row in memory)
+    _narrow_npy(os.path.join(tmp_dir, 'indptr.npy'), np.int32 if nnz < 2**31 else np.int64)
+    _narrow_npy(os.path.join(tmp_dir, 'text_offsets.npy'), offset_dtype(text_bytes))
+
+    np.save(os.path.join(tmp_dir, 'doc_freq.npy'), column_df)
+    meta = {
+        'source': file_fingerprint(csv_file),
+        'column': column_name,
+        'format_version': INDEX_FORMAT_VERSION,
+        'max_features': None if hash_features else max_features,
+        'n_rows': n_docs,
+        'memory_budget_mb': memory_budget_mb,
+        'precision': precision,
+        'char_ngrams': list(char_ngrams) if char_ngrams else None,
+        'revision': next_revision(index_dir),
+    }
+    if hash_features:
+        meta['hash_features'] = hash_features
+    write_model_files(tmp_dir, feature_names, idf, stop_words, meta)
+    replace_index_dir(tmp_dir, index_dir)
+    return n_docs
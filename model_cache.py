@@ -0,0 +1,158 @@
+"""
+Content-addressed cache of fitted TF-IDF indexes
+
+A model is keyed by the SHA-256 of the uploaded file, the column and the
+fitting parameters, so every session that uploads the same file with the
+same settings shares one parse and one fit. The cache has two layers:
+
+    memory  fitted TfidfIndex objects, evicted least recently used first
+            once their total size (TfidfIndex.nbytes) exceeds max_bytes
+    disk    optional saved index directories under cache_dir; a model that
+            was evicted from memory, or fit before a restart, is loaded
+            back memory-mapped instead of refit. Directories are evicted
+            least recently used first beyond max_disk_bytes.
+
+One ModelCache is meant to be shared by all sessions of a process (e.g.
+through st.cache_resource), so every method is thread-safe and concurrent
+requests for the same missing key fit it only once.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from tfidf_index import META_FILE, TfidfIndex
+
+
+def bytes_sha256(data, block_size=1 << 24):
+    """SHA-256 hex digest of an in-memory file, hashed block by block"""
+    digest = hashlib.sha256()
+    view = memoryview(data)
+    for start in range(0, len(view), block_size):
+        digest.update(view[start:start + block_size])
+    return digest.hexdigest()
+
+
+def model_key(file_hash, column, max_features, hash_features=None, precision='float64',
+              char_ngrams=None):
+    """Cache key of the model fit on one column of one file"""
+    params = {'file': file_hash, 'column': column, 'max_features': max_features,
+              'hash_features': hash_features, 'precision': precision,
+              'char_ngrams': list(char_ngrams) if char_ngrams else None}
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+class ModelCache:
+    """LRU cache of fitted indexes bounded by total memory size"""
+
+    def __init__(self, max_bytes=2 * 1024**3, cache_dir=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.build_locks = {}
+        self.counts = {'memory_hits': 0, 'disk_hits': 0, 'builds': 0, 'evictions': 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _model_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Cached index for key from memory or disk, or None"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts['memory_hits'] += 1
+                return self.entries[key][0]
+        index = self._load_from_disk(key)
+        if index is not None:
+            with self.lock:
+                self.counts['disk_hits'] += 1
+            self._insert(key, index)
+        return index
+
+    def get_or_build(self, key, build):
+        """
+        Cached index for key, calling build() to fit it when missing
+
+        Returns:
+            (index, source) where source is 'memory', 'disk' or 'built'
+        """
+        with self.lock:
+            hit = key in self.entries
+        index = self.get(key)
+        if index is not None:
+            return index, 'memory' if hit else 'disk'
+
+        with self.lock:
+            build_lock = self.build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            # Another session may have fit it while we waited
+            index = self.get(key)
+            if index is not None:
+                return index, 'memory'
+            index = build()
+            with self.lock:
+                self.counts['builds'] += 1
+            if self.cache_dir:
+                index.save(self._model_dir(key))
+                self._evict_disk(keep=key)
+            self._insert(key, index)
+        with self.lock:
+            self.build_locks.pop(key, None)
+        return index, 'built'
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir or not os.path.exists(os.path.join(self._model_dir(key), META_FILE)):
+            return None
+        try:
+            index = TfidfIndex.load(self._model_dir(key))
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(self._model_dir(key), ignore_errors=True)
+            return None
+        # Mark as recently used for disk eviction
+        os.utime(os.path.join(self._model_dir(key), META_FILE))
+        return index
+
+    def _insert(self, key, index):
+        size = index.nbytes
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (index, size)
+            self.total_bytes += size
+            # Evict least recently used models, but always keep the newest one
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.counts['evictions'] += 1
+
+    def _evict_disk(self, keep):
+        if not self.max_disk_bytes:
+            return
+        models = []
+        for name in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, name, META_FILE)
+            if name == keep or not os.path.exists(meta_path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(self.cache_dir, name)))
+            models.append((os.path.getmtime(meta_path), name, size))
+        total = sum(size for _, _, size in models) + sum(
+            entry.stat().st_size for entry in os.scandir(self._model_dir(keep))
+        )
+        for _, name, size in sorted(models):
+            if total <= self.max_disk_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, models=len(self.entries), bytes=self.total_bytes,
+                        max_bytes=self.max_bytes)
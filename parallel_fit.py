@@ -0,0 +1,162 @@
+"""
+Multi-process TF-IDF fitting
+
+The corpus is split into contiguous shards and every shard is tokenised
+once, in a worker process, into term counts over a shard-local vocabulary.
+The parent then merges the shard vocabularies, picks the max_features
+terms from the merged term counts, computes idf from the merged document
+frequencies and assembles the CSR matrix from the shard counts.
+
+The result is identical, bit for bit, to TfidfVectorizer(max_features=...,
+stop_words='english').fit_transform on the whole corpus (or to
+TfidfVectorizer(analyzer='char_wb', ngram_range=...) with char_ngrams): terms are ranked
+with the same argsort, and every row's entries are weighted and
+L2-normalised in the order the vectorizer stores them (order of first
+occurrence of each term in the corpus) before the indices are sorted.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from ingest import top_feature_columns
+from tfidf_index import (
+    INDEX_FORMAT_VERSION,
+    TfidfIndex,
+    as_text_store,
+    make_analyzer,
+    sequential_row_norms,
+    smooth_idf,
+)
+
+# Shards per worker, so one slow shard does not leave the others idle
+SHARDS_PER_WORKER = 4
+
+MIN_SHARD_ROWS = 2000
+
+
+def _count_shard(texts, analyzer):
+    """
+    Tokenise one shard into counts over a shard-local vocabulary
+
+    Returns:
+        (terms, counts, columns, indptr): terms in order of first occurrence
+        within the shard, and CSR arrays of per-row counts over their positions
+    """
+    vocabulary = {}
+    counts, columns, indptr = [], [], [0]
+    for text in texts:
+        row = {}
+        for token in analyzer(text):
+            col = vocabulary.setdefault(token, len(vocabulary))
+            row[col] = row.get(col, 0) + 1
+        columns.extend(row)
+        counts.extend(row.values())
+        indptr.append(len(columns))
+    return (
+        list(vocabulary),
+        np.asarray(counts, dtype=np.int64),
+        np.asarray(columns, dtype=np.int64),
+        np.asarray(indptr, dtype=np.int64),
+    )
+
+
+def shard_bounds(n_rows, n_jobs):
+    """Row ranges of the shards for n_jobs workers"""
+    n_shards = max(1, min(n_jobs * SHARDS_PER_WORKER, n_rows // MIN_SHARD_ROWS))
+    edges = np.linspace(0, n_rows, n_shards + 1).astype(np.int64)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def fit_tfidf_parallel(text_data, max_features=5000, n_jobs=None, meta=None, char_ngrams=None):
+    """
+    Fit a TF-IDF index on text_data with a process pool
+
+    Returns the same TfidfIndex as TfidfIndex.from_texts(text_data,
+    max_features, meta, char_ngrams=char_ngrams).
+
+    Args:
+        text_data: List of strings
+        max_features: Max TF-IDF features (None keeps every term)
+        n_jobs: Worker processes (default: all cores)
+        meta: Extra meta entries stored with the index
+        char_ngrams: (min_n, max_n) to count character n-grams instead of words
+    """
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+    stop_words = () if char_ngrams else ENGLISH_STOP_WORDS
+    analyzer = make_analyzer(stop_words, char_ngrams)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    n_docs = len(text_data)
+    bounds = shard_bounds(n_docs, n_jobs)
+
+    if n_jobs == 1 or len(bounds) == 1:
+        shards = [_count_shard(text_data[start:end], analyzer) for start, end in bounds]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            shards = list(pool.map(
+                _count_shard,
+                [text_data[start:end] for start, end in bounds],
+                [analyzer] * len(bounds)
+            ))
+
+    # Merge shard vocabularies: alphabetical term ids (the vectorizer's column
+    # order before max_features) and the first corpus-wide occurrence of each term
+    shard_terms = np.empty(sum(len(terms) for terms, *_ in shards), dtype=object)
+    shard_offsets = np.cumsum([0] + [len(terms) for terms, *_ in shards])
+    for (terms, *_), offset in zip(shards, shard_offsets):
+        shard_terms[offset:offset + len(terms)] = terms
+    if len(shard_terms) == 0:
+        raise ValueError("empty vocabulary; perhaps the documents only contain stop words")
+    all_terms, term_ids = np.unique(shard_terms, return_inverse=True)
+    term_ids = term_ids.ravel()
+    first_seen = np.full(len(all_terms), len(shard_terms), dtype=np.int64)
+    np.minimum.at(first_seen, term_ids, np.arange(len(shard_terms)))
+
+    # Corpus-wide entries, with columns as alphabetical term ids
+    counts = np.concatenate([shard[1] for shard in shards])
+    columns = np.concatenate([
+        term_ids[offset + shard[2]] for shard, offset in zip(shards, shard_offsets[:-1])
+    ])
+    row_lengths = np.concatenate([np.diff(shard[3]) for shard in shards])
+    del shards, shard_terms, term_ids
+
+    term_counts = np.bincount(columns, weights=counts, minlength=len(all_terms)).astype(np.int64)
+    keep = top_feature_columns(term_counts, max_features)
+    new_column = np.full(len(all_terms), -1, dtype=np.int64)
+    new_column[keep] = np.arange(len(keep))
+
+    # Drop unselected terms and order each row by first occurrence of its terms
+    rows = np.repeat(np.arange(n_docs), row_lengths)
+    kept = new_column[columns] >= 0
+    rows, counts, columns = rows[kept], counts[kept], columns[kept]
+    order = np.lexsort((first_seen[columns], rows))
+    rows, counts, columns = rows[order], counts[order], new_column[columns[order]]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_docs))])
+
+    doc_freq = np.bincount(columns, minlength=len(keep)).astype(np.int64)
+    idf = smooth_idf(doc_freq, n_docs)
+
+    # Weight and normalise exactly like TfidfTransformer, then sort the indices
+    data = counts.astype(np.float64)
+    data *= idf[columns]
+    norms = sequential_row_norms(data, indptr)
+    norms[norms == 0.0] = 1.0
+    data /= np.repeat(norms, np.diff(indptr))
+    matrix = sp.csr_matrix(
+        (data, columns.astype(np.int32), indptr.astype(np.int32 if len(data) < 2**31 else np.int64)),
+        shape=(n_docs, len(keep))
+    )
+    matrix.sort_indices()
+
+    meta = dict(meta or {})
+    meta.update({
+        'format_version': INDEX_FORMAT_VERSION,
+        'max_features': max_features,
+        'n_rows': n_docs,
+        'char_ngrams': list(char_ngrams) if char_ngrams else None,
+    })
+    return TfidfIndex(all_terms[keep], idf, stop_words, matrix, as_text_store(text_data),
+                      meta, doc_freq)
@@ -0,0 +1,170 @@
+"""
+Stage timing and memory instrumentation for the duplicate check pipeline
+
+A StageProfiler times named stages (CSV parse, fit, transform, scoring,
+result materialization, interpretability, ...) with time.perf_counter and,
+when memory tracking is on, records the peak of traced allocations inside
+every stage with tracemalloc (numpy buffers included). Stages may nest; an
+inner stage's peak also counts towards the outer one.
+
+    with StageProfiler(memory=True) as profiler:
+        with profile_stage(profiler, 'fit'):
+            ...
+    print(json.dumps(profiler.report()))
+
+Code paths take an optional profiler and wrap their stages in
+profile_stage(profiler, name), which does nothing when profiler is None.
+With dump_dir, the whole run is also profiled with cProfile and the final
+tracemalloc snapshot is saved next to it for offline analysis.
+"""
+
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CPROFILE_FILE = 'cprofile.prof'
+TRACEMALLOC_FILE = 'tracemalloc.snapshot'
+
+
+def max_rss_mb():
+    """Peak resident set size of this process so far, or None where unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageProfiler:
+    """Wall time and peak traced memory of named pipeline stages"""
+
+    def __init__(self, memory=True, dump_dir=None):
+        self.memory = memory or dump_dir is not None
+        self.dump_dir = dump_dir
+        self.stages = []
+        self.open_stages = []
+        self.depth = 0
+        self.started_tracing = False
+        self.cprofile = None
+        self.start_time = None
+        self.total_s = None
+
+    def start(self):
+        """Start tracemalloc (and cProfile with dump_dir) for the run"""
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        if self.dump_dir is not None:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.start_time = time.perf_counter()
+        return self
+
+    def stop(self):
+        """Stop the run, writing the cProfile and tracemalloc dumps with dump_dir"""
+        if self.start_time is not None:
+            self.total_s = time.perf_counter() - self.start_time
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            os.makedirs(self.dump_dir, exist_ok=True)
+            self.cprofile.dump_stats(os.path.join(self.dump_dir, CPROFILE_FILE))
+            tracemalloc.take_snapshot().dump(os.path.join(self.dump_dir, TRACEMALLOC_FILE))
+            self.cprofile = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextmanager
+    def stage(self, name):
+        tracing = self.memory and tracemalloc.is_tracing()
+        record = {'stage': name, 'depth': self.depth, 'seconds': None, 'peak_mb': None,
+                  'retained_mb': None, 'max_rss_mb': None}
+        self.stages.append(record)
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak so far belongs to the enclosing stage; restart it for this one
+            if self.open_stages:
+                self.open_stages[-1]['peak'] = max(self.open_stages[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame = {'start': current, 'peak': current}
+            self.open_stages.append(frame)
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self.depth -= 1
+            if tracing:
+                self.open_stages.pop()
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame['peak'], peak)
+                record['peak_mb'] = (peak - frame['start']) / 2**20
+                record['retained_mb'] = (current - frame['start']) / 2**20
+                if self.open_stages:
+                    self.open_stages[-1]['peak'] = max(self.open_stages[-1]['peak'], peak)
+            record['max_rss_mb'] = max_rss_mb()
+
+    def report(self):
+        """
+        Structured report of the run
+
+        Returns:
+            Dict with one entry per stage (in start order, depth > 0 for
+            stages nested in another one) holding seconds,
+            peak_mb (traced allocations above the stage's start, at the
+            stage's peak), retained_mb (still allocated when it ended) and
+            max_rss_mb (process high-water mark when it ended), plus the
+            total run time and the dump files
+        """
+        report = {
+            'stages': [dict(record) for record in self.stages],
+            'total_s': self.total_s,
+            'memory_tracked': self.memory,
+        }
+        if self.dump_dir is not None:
+            report['dumps'] = {
+                'cprofile': os.path.join(self.dump_dir, CPROFILE_FILE),
+                'tracemalloc': os.path.join(self.dump_dir, TRACEMALLOC_FILE),
+            }
+        return report
+
+    def format_table(self):
+        """Lines of a text table of the stages"""
+        lines = [f"{'Stage':<20} {'Seconds':>10} {'Share':>7} {'Peak MB':>10} {'Kept MB':>10} "
+                 f"{'Max RSS MB':>11}"]
+        total = self.total_s or sum(record['seconds'] or 0.0 for record in self.stages
+                                    if record['depth'] == 0)
+        for record in self.stages:
+            share = record['seconds'] / total if total else 0.0
+            name = '  ' * record['depth'] + record['stage']
+            lines.append(f"{name:<20} {record['seconds']:>10.4f} {share:>7.1%} "
+                         f"{_format_mb(record['peak_mb']):>10} {_format_mb(record['retained_mb']):>10} "
+                         f"{_format_mb(record['max_rss_mb']):>11}")
+        lines.append(f"{'total':<20} {total:>10.4f}")
+        return lines
+
+
+def _format_mb(value):
+    return '-' if value is None else f"{value:.1f}"
+
+
+def profile_stage(profiler, name):
+    """profiler.stage(name), or a no-op context when profiler is None"""
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
@@ -0,0 +1,305 @@
+"""
+LRU cache of duplicate-check results
+
+Upstream systems re-check the same strings (retries, duplicate
+submissions); a cached result answers them without transform and a scan of
+the corpus. An entry is stored under
+
+    an index version    a digest of the index metadata (index_version), which
+                        changes when the index is rebuilt or updated, but
+                        not when its source file is only touched
+    a key               the normalized item plus the search options that
+                        shape the result (threshold, top-k, backend, ...)
+
+The item is normalized to its sorted in-vocabulary tokens (normalize_item):
+items that differ only in case, punctuation, word order, stop words or
+out-of-vocabulary words vectorize identically, so they share an entry and
+the cached result is exactly the one a scan would return. The fingerprint
+fast path (fingerprints.py) is not a scan: it answers from the sorted
+tokens including out-of-vocabulary ones, and only with the rows of equal
+fingerprint. Searches that use it put fast_path among the options and
+pass all_tokens=True, so their entries are keyed by every token and stay
+apart from the entries of plain scans.
+
+Entries are evicted least recently used first once their estimated size
+exceeds max_bytes, and expire ttl seconds after they were stored. An entry
+of another index version is never returned; drop_stale(version) frees them
+all when an index is swapped out. A ResultCache is thread-safe, and save()
+and load() keep it in a JSON file for other processes (cli_app.py query and
+batch --cache), so values must then be JSON-serializable. A process that
+only checks one item appends its lookups and new entries to a log next to
+the file with save_changes() instead of rewriting the whole cache; load()
+replays the log and the next save() folds it into the file.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_FILE = 'result_cache.json'
+CACHE_FORMAT_VERSION = 1
+
+# save_changes() rewrites the cache file once its log grows beyond this
+MAX_LOG_BYTES = 4 * 2**20
+
+# Per-entry bookkeeping (OrderedDict node, tuple, key object) in bytes
+ENTRY_OVERHEAD = 200
+
+
+def index_version(index):
+    """
+    Digest of an index's metadata, changing whenever its rows can change
+
+    Building, updating and compacting all bump the revision counter of the
+    metadata, so an index rebuilt in place with otherwise identical
+    metadata (e.g. compacted after as many appends as deletes) still gets a
+    new version. The size and mtime of the source file are left out: they
+    are rewritten when the source is only touched, which changes no row.
+    """
+    meta = dict(index.meta)
+    if isinstance(meta.get('source'), dict):
+        meta['source'] = {name: value for name, value in meta['source'].items()
+                          if name not in ('size', 'mtime_ns')}
+    parts = [meta]
+    if hasattr(index, 'shards'):
+        # A sharded index loaded with --shard only holds some of the rows
+        parts.append([shard.meta['shard']['id'] for shard in index.shards])
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def normalize_item(index, item, all_tokens=False):
+    """
+    Sorted in-vocabulary tokens of an item, one list per field
+
+    Two items with the same normalized form have the same TF-IDF vector.
+    With all_tokens, out-of-vocabulary tokens are kept too, so two items
+    with the same normalized form also have the same fingerprint.
+    """
+    model = getattr(index, 'model', index)
+    if model.fields is None:
+        blocks = [(item, model.vocabulary)]
+    else:
+        blocks = [(item.get(column, '') if isinstance(item, dict) else item, vocabulary)
+                  for column, _, vocabulary, _, _ in model.fields]
+    return [sorted(token for token in model.analyze(text)
+                   if all_tokens or vocabulary.get(token) is not None)
+            for text, vocabulary in blocks]
+
+
+def result_key(index, item, *options, all_tokens=False):
+    """
+    Cache key of one item checked with the given search options
+
+    Pass all_tokens=True when the search may use the fingerprint fast path.
+    """
+    return json.dumps([normalize_item(index, item, all_tokens), *options],
+                      separators=(',', ':'))
+
+
+def estimate_nbytes(value):
+    """Rough memory size of a cached value (numpy arrays, strings, containers)"""
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes) + 100
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return 64 + sum(estimate_nbytes(k) + estimate_nbytes(v) + 16 for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(estimate_nbytes(v) + 8 for v in value)
+    return 32
+
+
+def cache_log_path(path):
+    """Log of the changes appended to the cache saved in path (see save_changes)"""
+    return os.path.splitext(path)[0] + '.log'
+
+
+class ResultCache:
+    """LRU cache of check results bounded by total size, with optional expiry"""
+
+    def __init__(self, max_bytes=64 * 2**20, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+                       'invalidations': 0}
+        # Lookups and entries since load(), for save_changes(); None when not loaded
+        self.changes = None
+
+    def get(self, version, key):
+        """Cached value of key for this index version, or None"""
+        with self.lock:
+            if self.changes is not None:
+                self.changes.append(['get', version, key])
+            entry = self.entries.get((version, key))
+            if entry is not None and entry[2] is not None and entry[2] <= time.time():
+                self._remove((version, key))
+                self.counts['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.counts['misses'] += 1
+                return None
+            self.entries.move_to_end((version, key))
+            self.counts['hits'] += 1
+            return entry[0]
+
+    def contains(self, version, key):
+        """Whether get() would hit, without counting a lookup or reordering"""
+        with self.lock:
+            entry = self.entries.get((version, key))
+            return entry is not None and (entry[2] is None or entry[2] > time.time())
+
+    def put(self, version, key, value):
+        """Store a value, evicting least recently used entries beyond max_bytes"""
+        expires = time.time() + self.ttl if self.ttl else None
+        if self.changes is not None:
+            with self.lock:
+                self.changes.append(['put', version, key, value, expires])
+        self._insert(version, key, value, expires)
+
+    def _insert(self, version, key, value, expires):
+        size = estimate_nbytes(value) + sys.getsizeof(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._remove((version, key))
+            self.entries[(version, key)] = (value, size, expires)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counts['evictions'] += 1
+
+    def _remove(self, entry_key):
+        entry = self.entries.pop(entry_key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def drop_stale(self, version):
+        """Drop the entries of every other index version"""
+        with self.lock:
+            stale = [entry_key for entry_key in self.entries if entry_key[0] != version]
+            for entry_key in stale:
+                self._remove(entry_key)
+            self.counts['invalidations'] += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['hits'] + self.counts['misses']
+            return dict(self.counts, entries=len(self.entries), bytes=self.total_bytes,
+                        max_bytes=self.max_bytes, ttl=self.ttl,
+                        hit_rate=self.counts['hits'] / lookups if lookups else None)
+
+    def save(self, path):
+        """
+        Write the cache to a JSON file, replacing it atomically
+
+        The file then holds everything its log held when the cache was
+        loaded, so the log is removed. Changes another process logged in
+        between are lost, which only costs those results a rescan.
+        """
+        with self.lock:
+            state = {
+                'format_version': CACHE_FORMAT_VERSION,
+                'counts': self.counts,
+                'entries': [[version, key, value, expires]
+                            for (version, key), (value, _, expires) in self.entries.items()],
+            }
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, separators=(',', ':'))
+            if self.changes is not None:
+                self.changes = []
+        os.replace(tmp_path, path)
+        try:
+            os.remove(cache_log_path(path))
+        except FileNotFoundError:
+            pass
+
+    def save_changes(self, path):
+        """
+        Append the lookups and entries since load() to the log of path
+
+        Costs one small write whatever the size of the cache, as long as the
+        log stays below MAX_LOG_BYTES; beyond that the whole cache is saved.
+        """
+        with self.lock:
+            changes, self.changes = self.changes or [], []
+        log_path = cache_log_path(path)
+        if changes:
+            lines = ''.join(json.dumps(change, separators=(',', ':')) + '\n' for change in changes)
+            # One write per run, so concurrent runs append whole lines
+            with open(log_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        if os.path.exists(log_path) and os.path.getsize(log_path) > MAX_LOG_BYTES:
+            self.save(path)
+
+    @classmethod
+    def load(cls, path, version=None, max_bytes=64 * 2**20, ttl=None):
+        """
+        Cache saved in path (empty if missing or unreadable), with the
+        changes of its log replayed
+
+        With version, entries of other index versions are dropped and
+        counted as invalidations. Statistics carry over from earlier runs.
+        The cache records its changes from here on for save_changes().
+        """
+        cache = cls(max_bytes, ttl)
+        try:
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if state.get('format_version') == CACHE_FORMAT_VERSION:
+            cache.counts.update(state.get('counts', {}))
+            for entry_version, key, value, expires in state['entries']:
+                cache._restore(version, entry_version, key, value, expires)
+        cache._replay_log(cache_log_path(path), version)
+        cache.changes = []
+        return cache
+
+    def _restore(self, version, entry_version, key, value, expires):
+        if version is not None and entry_version != version:
+            self.counts['invalidations'] += 1
+        elif expires is not None and expires <= time.time():
+            self.counts['expirations'] += 1
+        else:
+            self._insert(entry_version, key, value, expires)
+
+    def _replay_log(self, log_path, version):
+        try:
+            f = open(log_path, encoding='utf-8')
+        except OSError:
+            return
+        with f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # A line cut short by a run that was killed while appending
+                    continue
+                if change[0] == 'get':
+                    self.get(change[1], change[2])
+                elif change[0] == 'put':
+                    self._restore(version, *change[1:])
+
+
+def format_cache_stats(stats):
+    """One line summary of ResultCache.stats()"""
+    hit_rate = f"{stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else "n/a"
+    return (f"{stats['hits']} hit(s), {stats['misses']} miss(es) ({hit_rate} hit rate), "
+            f"{stats['entries']} entries, {stats['bytes'] / 2**20:.1f} / "
+            f"{stats['max_bytes'] / 2**20:.0f} MB, {stats['evictions']} evicted, "
+            f"{stats['expirations']} expired, {stats['invalidations']} invalidated")
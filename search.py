@@ -0,0 +1,250 @@
+"""
+Vectorized search over a TF-IDF matrix
+
+Rows of the TF-IDF matrix are L2-normalised, so cosine similarity is a plain
+sparse dot product. These helpers score many items at once with blocked
+matrix products instead of one cosine_similarity call per item, and find
+duplicates within the indexed rows themselves.
+"""
+
+import os
+
+import numpy as np
+
+# Bytes per score of a dense chunk: float64 value + boolean threshold mask
+BYTES_PER_SCORE = 9
+
+# Bins of similarity_histogram over [0, 1]
+HISTOGRAM_BINS = 50
+
+
+def rows_per_chunk(n_rows, n_features, memory_budget_mb):
+    """How many query rows can be scored against n_rows within the budget"""
+    budget = int(memory_budget_mb * 1024 * 1024)
+    per_query = n_rows * BYTES_PER_SCORE + n_features * 8
+    return max(1, budget // per_query)
+
+
+def top_matches(rows, scores, threshold=0.0, top_k=None):
+    """
+    Best-scoring rows at or above the threshold, best first
+
+    With top_k, np.argpartition finds the k-th best score in linear time so
+    only k rows are sorted, however many rows pass the threshold. Rows are
+    expected in ascending order (as every backend returns them).
+
+    Args:
+        rows: Row index of each score
+        scores: Similarity scores
+        threshold: Minimum similarity (default: 0.0)
+        top_k: Keep at most this many rows (default: all above threshold)
+
+    Returns:
+        (rows, scores) arrays sorted by descending score, then row
+    """
+    if top_k is not None and top_k < len(scores):
+        if top_k <= 0:
+            return rows[:0], scores[:0]
+        kth = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+        # Rows tied with the k-th score are taken in row order, as a full sort would
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:top_k - len(above)]
+        positions = np.concatenate([above, ties])
+        positions = positions[scores[positions] >= threshold]
+    else:
+        positions = np.flatnonzero(scores >= threshold)
+    order = np.lexsort((rows[positions], -scores[positions]))
+    positions = positions[order]
+    return rows[positions], scores[positions]
+
+
+def similarity_histogram(scores, n_bins=HISTOGRAM_BINS):
+    """
+    Distribution of similarity scores in fixed bins over [0, 1]
+
+    However many rows were scored, the result holds n_bins counts and a
+    few statistics, so it is cheap to keep and to chart.
+
+    Returns:
+        Dict with the bin edges, the number of scores in each bin, and the
+        count, mean, standard deviation, min and max of the scores
+        (None when nothing was scored)
+    """
+    scores = np.asarray(scores)
+    # Rounding can put an identical row a hair above 1.0; keep it in the last bin
+    counts, edges = np.histogram(np.clip(scores, 0.0, 1.0), bins=n_bins, range=(0.0, 1.0))
+    summary = {'edges': edges.tolist(), 'counts': counts.tolist(), 'n': int(len(scores)),
+               'mean': None, 'std': None, 'min': None, 'max': None}
+    if len(scores):
+        summary.update(mean=float(scores.mean()), std=float(scores.std()),
+                       min=float(scores.min()), max=float(scores.max()))
+    return summary
+
+
+def batch_matches(item_vectors, tfidf_matrix, threshold=0.7, memory_budget_mb=256, top_k=None):
+    """
+    Find every (item, row) pair with similarity >= threshold
+
+    Items are scored in chunks: each chunk is one sparse-matrix times
+    dense-block product whose dense score block stays inside
+    memory_budget_mb.
+
+    Args:
+        item_vectors: CSR matrix of vectorized items (one row per item)
+        tfidf_matrix: CSR matrix of the indexed rows
+        threshold: Similarity threshold (default: 0.7)
+        memory_budget_mb: Upper bound for one chunk of scores (default: 256)
+        top_k: Keep at most this many matches per item (default: all)
+
+    Yields:
+        (item_index, row_index, similarity), best matches of each item first
+    """
+    n_rows, n_features = tfidf_matrix.shape
+    chunk = rows_per_chunk(n_rows, n_features, memory_budget_mb)
+
+    for start in range(0, item_vectors.shape[0], chunk):
+        block = item_vectors[start:start + chunk].T.toarray()
+        scores = np.asarray(tfidf_matrix @ block)
+        rows, items = np.nonzero(scores >= threshold)
+        values = scores[rows, items]
+        del scores
+        order = np.lexsort((rows, -values, items))
+        if top_k is not None:
+            # Rank of each match within its item, matches being grouped by item
+            sorted_items = items[order]
+            first = np.searchsorted(sorted_items, sorted_items, side='left')
+            order = order[np.arange(len(order)) - first < top_k]
+        for pos in order:
+            yield start + int(items[pos]), int(rows[pos]), float(values[pos])
+
+
+# Worker state for dedupe_pairs, set once per process by _init_dedupe_worker
+_worker_matrix = None
+_worker_pieces = None
+
+# The transposed matrix is kept as this many pieces of consecutive rows, so a
+# block skips the pieces before it and wastes at most one piece of the lower
+# triangle
+DEDUPE_PIECES = 16
+
+# Bytes per stored score of a block product: float64 value, int32 column and
+# the threshold mask, plus the int64 row and column of the pairs kept
+DEDUPE_BYTES_PER_SCORE = 16
+
+
+def _init_dedupe_worker(matrix, index_dir):
+    global _worker_matrix, _worker_pieces
+    if index_dir is not None:
+        from tfidf_index import TfidfIndex
+        matrix = TfidfIndex.load(index_dir).matrix
+    _worker_matrix = matrix
+    # Transposed once per worker rather than sliced and transposed per block
+    n_rows = matrix.shape[0]
+    piece_rows = max(1, -(-n_rows // DEDUPE_PIECES))
+    _worker_pieces = [(first, matrix[first:first + piece_rows].T.tocsr())
+                      for first in range(0, n_rows, piece_rows)]
+
+
+def _dedupe_block(start, end, threshold):
+    """Pairs (i, j), start <= i < end, i < j, with similarity >= threshold"""
+    block_rows = _worker_matrix[start:end]
+    parts = []
+    for first, piece in _worker_pieces:
+        if first + piece.shape[1] <= start:
+            continue
+        scores = block_rows @ piece
+        positions = np.flatnonzero(scores.data >= threshold)
+        rows = np.searchsorted(scores.indptr, positions, side='right').astype(np.int64) - 1 + start
+        cols = scores.indices[positions].astype(np.int64) + first
+        keep = cols > rows
+        parts.append((rows[keep], cols[keep], scores.data[positions[keep]]))
+        del scores
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def dedupe_block_size(matrix, memory_budget_mb):
+    """
+    Rows per block so that the expected block product fits the budget
+
+    A row sharing a feature with df other rows meets each of them, so a row
+    has at most sum(df**2) / n_rows scores on average (an upper bound:
+    rows sharing several features are counted once per feature).
+    """
+    n_rows, n_features = matrix.shape
+    budget = int(memory_budget_mb * 1024 * 1024)
+    doc_freq = np.bincount(matrix.indices, minlength=n_features).astype(np.float64)
+    scores_per_row = min(n_rows, float(doc_freq @ doc_freq) / max(1, n_rows))
+    return max(1, int(budget // max(1.0, scores_per_row * DEDUPE_BYTES_PER_SCORE)))
+
+
+def dedupe_pairs(tfidf_matrix, threshold=0.7, block_size=None, n_jobs=None,
+                 memory_budget_mb=256, index_dir=None):
+    """
+    Find all pairs of rows of one matrix with similarity >= threshold
+
+    The N x N similarity matrix is never materialised: rows are processed
+    in blocks, each block multiplied against the transposed rows from its
+    own piece of DEDUPE_PIECES onwards (transposed once per worker) keeping
+    only pairs in the upper triangle, and blocks run across a process pool.
+
+    Args:
+        tfidf_matrix: CSR matrix of L2-normalised rows
+        threshold: Similarity threshold (default: 0.7)
+        block_size: Rows per block (default: derived from memory_budget_mb)
+        n_jobs: Worker processes (default: all cores, 1 disables the pool)
+        memory_budget_mb: Memory bound for one block of scores per worker
+        index_dir: If the matrix comes from a saved index, workers
+            memory-map it from here instead of receiving a pickled copy
+            (each still holds its own transposed copy)
+
+    Returns:
+        (rows, cols, scores) arrays with rows < cols, sorted by row then col
+    """
+    n_rows = tfidf_matrix.shape[0]
+    block_size = block_size or dedupe_block_size(tfidf_matrix, memory_budget_mb)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    starts = range(0, n_rows, block_size)
+
+    if n_jobs == 1:
+        _init_dedupe_worker(tfidf_matrix, None)
+        parts = [_dedupe_block(s, min(s + block_size, n_rows), threshold) for s in starts]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        initargs = (None, index_dir) if index_dir else (tfidf_matrix, None)
+        with ProcessPoolExecutor(n_jobs, initializer=_init_dedupe_worker,
+                                 initargs=initargs) as pool:
+            futures = [pool.submit(_dedupe_block, s, min(s + block_size, n_rows), threshold)
+                       for s in starts]
+            parts = [future.result() for future in futures]
+
+    if not parts:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float64)
+    rows = np.concatenate([p[0] for p in parts])
+    cols = np.concatenate([p[1] for p in parts])
+    scores = np.concatenate([p[2] for p in parts])
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], scores[order]
+
+
+def duplicate_clusters(n_rows, rows, cols):
+    """
+    Group rows connected by duplicate pairs
+
+    Returns:
+        List of clusters (sorted lists of row indices) with at least two
+        rows, largest first
+    """
+    import scipy.sparse as sp
+    from scipy.sparse.csgraph import connected_components
+
+    graph = sp.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_rows, n_rows))
+    _, labels = connected_components(graph, directed=False)
+    nodes = np.unique(np.concatenate([rows, cols])).astype(np.int64)
+    # Group the rows of every component, keeping rows ascending within each
+    order = np.argsort(labels[nodes], kind='stable')
+    nodes, node_labels = nodes[order], labels[nodes][order]
+    bounds = np.flatnonzero(np.diff(node_labels)) + 1
+    clusters = [cluster.tolist() for cluster in np.split(nodes, bounds)] if len(nodes) else []
+    return sorted(clusters, key=lambda c: (-len(c), c[0]))
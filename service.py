@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+HTTP duplicate-check service with a warm in-memory index
+Usage: python service.py <index_dir> [--host HOST] [--port PORT] [--backend BACKEND]
+
+The index is loaded once at startup and kept in memory; requests are served
+concurrently by a thread per connection, with at most --max-concurrency
+requests scoring at the same time.
+
+Endpoints:
+    GET  /health        index version and row count
+    GET  /stats         request counts, latency percentiles, fast-path and result cache
+                        counters (JSON)
+    GET  /metrics       latency histograms in Prometheus text format
+    POST /check         {"item": "...", "threshold": 0.7, "top_k": 10}
+    POST /check_batch   {"items": ["...", ...], "threshold": 0.7, "top_k": 10}
+
+Against a multi-column index an item can also be an object of column -> text
+(a plain string is matched against every column).
+    POST /reload        {"index_dir": "..."} (optional) swap in a rebuilt index
+
+Reloading builds the new index in the background while the old one keeps
+serving, then swaps it in atomically; requests already running finish on
+the index they started with. SIGHUP triggers the same reload.
+
+With --fast-path, items whose normalized tokens equal those of indexed rows
+are answered from the fingerprint table (see fingerprints.py) without
+scoring the corpus.
+
+Results are cached by normalized item, options and index version (see
+result_cache.py; --cache-mb 0 turns it off), so retries and duplicate
+submissions skip transform and scoring. Swapping in a new index drops the
+cached results of the old one.
+"""
+
+import argparse
+import bisect
+import json
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from backends import BACKENDS, DEFAULT_MIN_OVERLAP, make_backend
+from fingerprints import open_fingerprints, split_fast_path
+from result_cache import ResultCache, result_key
+from search import batch_matches, top_matches
+from tfidf_index import load_or_build_index
+
+# Upper bounds of the latency buckets in seconds (Prometheus-style)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class LatencyHistogram:
+    """Thread-safe cumulative latency histogram with fixed buckets"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, lock=None):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = lock or threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.total += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        with self.lock:
+            if self.count == 0:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+                seen += n
+                if seen >= rank:
+                    return bound
+        return float('inf')
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': 1000 * self.total / self.count if self.count else None,
+            'p50_ms': _ms(self.quantile(0.50)),
+            'p95_ms': _ms(self.quantile(0.95)),
+            'p99_ms': _ms(self.quantile(0.99)),
+        }
+
+    def prometheus(self, name, endpoint):
+        lines = []
+        with self.lock:
+            cumulative = 0
+            for bound, n in zip(self.buckets, self.counts):
+                cumulative += n
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {self.count}')
+            lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {self.total}')
+            lines.append(f'{name}_count{{endpoint="{endpoint}"}} {self.count}')
+        return lines
+
+
+def _ms(seconds):
+    if seconds is None:
+        return None
+    return 1000 * seconds if seconds != float('inf') else 'inf'
+
+
+class IndexHolder:
+    """
+    The index currently being served, swappable without downtime
+
+    Requests take a snapshot (index, backend, fingerprints, version) once and
+    use it for their whole lifetime, so a swap never changes an index under
+    a request.
+    """
+
+    def __init__(self, index_dir, backend='exact', bands=20, rows=5, fast_path=False,
+                 min_overlap=DEFAULT_MIN_OVERLAP, result_cache=None):
+        self.index_dir = index_dir
+        self.backend_args = (backend, bands, rows, min_overlap)
+        self.fast_path = fast_path
+        self.result_cache = result_cache
+        self.version = 0
+        self.snapshot = None
+        self.reload_lock = threading.Lock()
+        self.reloading = False
+        self.last_error = None
+        self.swap(index_dir)
+
+    def swap(self, index_dir=None):
+        """Load (rebuilding if stale) an index and make it the current one"""
+        index_dir = index_dir or self.index_dir
+        index, _ = load_or_build_index(index_dir)
+        backend, bands, rows, min_overlap = self.backend_args
+        search_backend = make_backend(index.matrix, backend, bands, rows, cache_dir=index_dir,
+                                      min_overlap=min_overlap)
+        # Warm up the vectorizer and scoring path before taking traffic
+        search_backend.score(index.transform(['warm up']))
+        fingerprints = open_fingerprints(index, index_dir) if self.fast_path else None
+        self.index_dir = index_dir
+        self.snapshot = (index, search_backend, fingerprints, self.version + 1)
+        self.version += 1
+        if self.result_cache is not None:
+            # Results of the previous index can no longer be returned; free them
+            self.result_cache.drop_stale(self.version)
+
+    def reload_async(self, index_dir=None):
+        """Swap in a new index from a background thread"""
+        with self.reload_lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+
+        def run():
+            try:
+                self.swap(index_dir)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            finally:
+                self.reloading = False
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+def _valid_item(item):
+    if isinstance(item, dict):
+        return all(isinstance(value, str) for value in item.values())
+    return isinstance(item, str)
+
+
+class DuplicateService:
+    """Request handling independent of the HTTP layer"""
+
+    def __init__(self, holder, max_concurrency=8, default_threshold=0.7, default_top_k=10):
+        self.holder = holder
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.default_threshold = default_threshold
+        self.default_top_k = default_top_k
+        # Guards the latency histograms and the error counter
+        self.stats_lock = threading.Lock()
+        self.latency = {name: LatencyHistogram(lock=self.stats_lock)
+                        for name in ('check', 'check_batch')}
+        self.errors = 0
+
+    def count_error(self):
+        with self.stats_lock:
+            self.errors += 1
+
+    def error_count(self):
+        with self.stats_lock:
+            return self.errors
+
+    def _options(self, payload):
+        threshold = float(payload.get('threshold', self.default_threshold))
+        top_k = payload.get('top_k', self.default_top_k)
+        return threshold, (int(top_k) if top_k is not None else None)
+
+    def check(self, payload):
+        item = payload.get('item')
+        if not _valid_item(item):
+            raise ValueError("'item' must be a string or an object of column -> string")
+        threshold, top_k = self._options(payload)
+        index, backend, fingerprints, version = self.holder.snapshot
+        cache = self.holder.result_cache
+
+        key = None
+        if cache is not None:
+            key = result_key(index, item, 'check', threshold, top_k,
+                             all_tokens=fingerprints is not None)
+        cached = cache.get(version, key) if cache is not None else None
+        if cached is not None:
+            n_above, rows, scores = cached
+        else:
+            with self.slots:
+                item_vector = index.transform([item])
+                fast = fingerprints.score(item, item_vector) if fingerprints is not None else None
+                if fast is not None:
+                    scored_rows, similarities, _ = fast
+                else:
+                    scored_rows, similarities = backend.score(item_vector)
+                n_above = int(np.count_nonzero(similarities >= threshold))
+                rows, scores = top_matches(scored_rows, similarities, threshold, top_k)
+            if cache is not None:
+                cache.put(version, key, (n_above, rows, scores))
+
+        return {
+            'item': item,
+            'is_duplicate': n_above > 0,
+            'n_above_threshold': n_above,
+            'duplicates': [
+                {'index': int(idx), 'item': text, 'similarity': float(score)}
+                for idx, text, score in zip(rows, index.texts.take(rows), scores)
+            ],
+            'index_version': version,
+        }
+
+    def check_batch(self, payload):
+        items = payload.get('items')
+        if not isinstance(items, list) or not all(_valid_item(i) for i in items):
+            raise ValueError("'items' must be a list of strings or objects of column -> string")
+        threshold, top_k = self._options(payload)
+        index, _, fingerprints, version = self.holder.snapshot
+        cache = self.holder.result_cache
+
+        results = [None] * len(items)
+        if cache is not None:
+            keys = [result_key(index, item, 'check_batch', threshold, top_k,
+                               all_tokens=fingerprints is not None) for item in items]
+            results = [cache.get(version, key) for key in keys]
+        # Only the items missing from the result cache are vectorized and scored
+        pending = [item_idx for item_idx, matches in enumerate(results) if matches is None]
+        if pending:
+            for item_idx in pending:
+                results[item_idx] = []
+            with self.slots:
+                item_vectors = index.transform([items[item_idx] for item_idx in pending])
+                remaining = np.arange(len(pending))
+                if fingerprints is not None:
+                    fast_matches, remaining = split_fast_path(
+                        fingerprints, [items[item_idx] for item_idx in pending], item_vectors,
+                        threshold, top_k
+                    )
+                    for item_idx, row, score in fast_matches:
+                        results[pending[item_idx]].append((row, score))
+                for item_idx, row, score in batch_matches(item_vectors[remaining], index.matrix,
+                                                          threshold, top_k=top_k):
+                    results[pending[remaining[item_idx]]].append((row, score))
+            if cache is not None:
+                for item_idx in pending:
+                    cache.put(version, keys[item_idx], results[item_idx])
+
+        return {
+            'results': [
+                {
+                    'item': item,
+                    'is_duplicate': bool(matches),
+                    'duplicates': [
+                        {'index': row, 'item': index.texts[row], 'similarity': score}
+                        for row, score in matches
+                    ],
+                }
+                for item, matches in zip(items, results)
+            ],
+            'index_version': version,
+        }
+
+    def health(self):
+        index, backend, _, version = self.holder.snapshot
+        return {
+            'status': 'ok',
+            'index_dir': self.holder.index_dir,
+            'index_version': version,
+            'rows': len(index),
+            'backend': backend.name,
+            'reloading': self.holder.reloading,
+            'last_reload_error': self.holder.last_error,
+        }
+
+    def stats(self):
+        fingerprints = self.holder.snapshot[2]
+        cache = self.holder.result_cache
+        return {
+            'latency': {name: hist.summary() for name, hist in self.latency.items()},
+            'errors': self.error_count(),
+            'index_version': self.holder.version,
+            'fast_path': fingerprints.stats() if fingerprints is not None else None,
+            'result_cache': cache.stats() if cache is not None else None,
+        }
+
+    def metrics(self):
+        lines = [
+            '# HELP duplicate_finder_request_seconds Request latency',
+            '# TYPE duplicate_finder_request_seconds histogram',
+        ]
+        for name, hist in self.latency.items():
+            lines.extend(hist.prometheus('duplicate_finder_request_seconds', name))
+        lines.append(f'duplicate_finder_errors_total {self.error_count()}')
+        lines.append(f'duplicate_finder_index_version {self.holder.version}')
+        fingerprints = self.holder.snapshot[2]
+        if fingerprints is not None:
+            counts = fingerprints.stats()
+            lines.append(f'duplicate_finder_fast_path_queries_total {counts["queries"]}')
+            for kind in ('exact', 'normalized'):
+                lines.append(f'duplicate_finder_fast_path_hits_total{{kind="{kind}"}} {counts[kind]}')
+        if self.holder.result_cache is not None:
+            counts = self.holder.result_cache.stats()
+            for name in ('hits', 'misses', 'evictions', 'expirations', 'invalidations'):
+                lines.append(f'duplicate_finder_result_cache_{name}_total {counts[name]}')
+            lines.append(f'duplicate_finder_result_cache_entries {counts["entries"]}')
+            lines.append(f'duplicate_finder_result_cache_bytes {counts["bytes"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def make_handler(service):
+    """Build a request handler class bound to a DuplicateService"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/json'):
+            data = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_BODY_BYTES:
+                raise ValueError("request body too large")
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send(200, service.health())
+            elif self.path == '/stats':
+                self._send(200, service.stats())
+            elif self.path == '/metrics':
+                self._send(200, service.metrics(), 'text/plain; version=0.0.4')
+            else:
+                self._send(404, {'error': f"unknown path '{self.path}'"})
+
+        def do_POST(self):
+            routes = {'/check': service.check, '/check_batch': service.check_batch}
+            try:
+                payload = self._read_json()
+                if self.path == '/reload':
+                    started = service.holder.reload_async(payload.get('index_dir'))
+                    self._send(202 if started else 409,
+                               {'reloading': True, 'started': started})
+                    return
+                if self.path not in routes:
+                    self._send(404, {'error': f"unknown path '{self.path}'"})
+                    return
+                start = time.perf_counter()
+                result = routes[self.path](payload)
+                service.latency[self.path.lstrip('/')].observe(time.perf_counter() - start)
+                self._send(200, result)
+            except (ValueError, TypeError) as e:
+                service.count_error()
+                self._send(400, {'error': str(e)})
+            except Exception as e:
+                service.count_error()
+                self._send(500, {'error': str(e)})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Duplicate Finder - HTTP service",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python service.py ./product_index --port 8080
+  curl -s localhost:8080/check -d '{"item": "iPhone 13 Pro", "threshold": 0.8}'
+  curl -s localhost:8080/check_batch -d '{"items": ["iPhone 13 Pro", "Galaxy S21"]}'
+  curl -s -X POST localhost:8080/reload
+        """
+    )
+    parser.add_argument('index_dir', help='Directory written by cli_app.py build-index')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port (default: 8080)')
+    parser.add_argument('--backend', choices=BACKENDS, default='exact',
+                        help='Search backend (default: exact brute force)')
+    parser.add_argument('--bands', type=int, default=20, help='LSH bands (default: 20)')
+    parser.add_argument('--rows', type=int, default=5, help='LSH rows per band (default: 5)')
+    parser.add_argument('--min-overlap', type=float, default=DEFAULT_MIN_OVERLAP,
+                        help='Share of the item\'s features a row must contain to be scored by '
+                             f'the inverted backend (default: {DEFAULT_MIN_OVERLAP:g})')
+    parser.add_argument('--threshold', type=float, default=0.7,
+                        help='Default similarity threshold (default: 0.7)')
+    parser.add_argument('--top-k', type=int, default=10,
+                        help='Default number of matches returned (default: 10)')
+    parser.add_argument('--max-concurrency', type=int, default=8,
+                        help='Requests scoring at the same time (default: 8)')
+    parser.add_argument('--fast-path', action='store_true',
+                        help='Answer exact and normalized duplicates from fingerprints before scoring')
+    parser.add_argument('--cache-mb', type=float, default=64,
+                        help='Memory bound of the result cache in MB, 0 to disable (default: 64)')
+    parser.add_argument('--cache-ttl', type=float, default=None, metavar='SECONDS',
+                        help='Expire cached results after this many seconds (default: never)')
+    args = parser.parse_args()
+
+    print(f"📂 Loading index from {args.index_dir}...")
+    result_cache = ResultCache(args.cache_mb * 2**20, args.cache_ttl) if args.cache_mb > 0 else None
+    holder = IndexHolder(args.index_dir, args.backend, args.bands, args.rows,
+                         args.fast_path, args.min_overlap, result_cache)
+    service = DuplicateService(holder, args.max_concurrency, args.threshold, args.top_k)
+    print(f"✅ Loaded {len(holder.snapshot[0])} rows")
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: holder.reload_async())
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"🚀 Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
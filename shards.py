@@ -0,0 +1,358 @@
+"""
+Sharded TF-IDF index with scatter-gather search
+
+A sharded index splits the rows of one fitted index into N contiguous row
+ranges. Every shard is an ordinary index directory holding its slice of the
+stored arrays and an exact copy of the model files (vocabulary, idf, stop
+words, document frequencies):
+
+    shards.json     format version, total rows, model checksum and the
+                    directory, first row and size of every shard
+    shard-000/      index directory of rows [0, n0)
+    shard-001/      index directory of rows [n0, n0 + n1)
+    ...
+
+Each shard loads on its own (TfidfIndex.load works on a shard directory),
+so a worker can host any subset of them (ShardedIndex.load with shard_ids).
+Row ids stay global: local row r of a shard starting at first_row is row
+first_row + r of the unsharded index.
+
+A query is vectorized once with the shared model and scattered to the
+shards on a thread pool; scipy's sparse products release the GIL, so shards
+are scored in parallel. Every shard keeps its own top-k above the threshold,
+sorted by (-score, row), and heapq.merge gathers them into the global top-k.
+A shard stores exactly the values of its rows in the unsharded index, so
+every score, and therefore the merged answer (ties included), is the one the
+unsharded index gives.
+
+Shards are read-only: the model is fixed when the index is split. Rebuild or
+compact the source index and split it again to change them.
+"""
+
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from explain import explain_dense, explain_matches
+from search import batch_matches, top_matches
+from tfidf_index import TfidfIndex, offset_dtype, read_meta, replace_index_dir, write_meta
+
+SHARDS_FILE = 'shards.json'
+SHARDS_FORMAT_VERSION = 1
+
+# Files every shard shares with the source index, byte for byte
+MODEL_FILES = ('vocabulary.json', 'stop_words.json', 'idf.npy', 'doc_freq.npy')
+
+
+def is_sharded(directory):
+    """True if directory holds a sharded index written by split_index"""
+    return os.path.exists(os.path.join(directory, SHARDS_FILE))
+
+
+def model_digest(index_dir):
+    """SHA-256 of the model files of an index directory"""
+    digest = hashlib.sha256()
+    for name in MODEL_FILES:
+        with open(os.path.join(index_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def shard_bounds(n_rows, n_shards):
+    """First row of every shard plus n_rows: contiguous ranges of near-equal size"""
+    if not 1 <= n_shards <= max(1, n_rows):
+        raise ValueError(f"Cannot split {n_rows} rows into {n_shards} shard(s)")
+    return [n_rows * i // n_shards for i in range(n_shards + 1)]
+
+
+def split_index(index_dir, output_dir, n_shards):
+    """
+    Split a saved index into n_shards index directories under output_dir
+
+    The stored arrays are sliced as they are on disk (no refit, no
+    re-quantization), so every shard scores its rows exactly like the
+    source index does.
+
+    Args:
+        index_dir: Directory written by build-index (without pending updates)
+        output_dir: Directory of the sharded index, replaced if it exists
+        n_shards: Number of shards
+
+    Returns:
+        The shards.json contents
+    """
+    meta = read_meta(index_dir)
+    if meta.get('updates'):
+        raise ValueError("The index has pending updates; run 'compact' before sharding it")
+    n_rows = meta['n_rows']
+    bounds = shard_bounds(n_rows, n_shards)
+
+    def load_array(name):
+        return np.load(os.path.join(index_dir, name), mmap_mode='r')
+
+    data, indices, indptr = load_array('data.npy'), load_array('indices.npy'), load_array('indptr.npy')
+    row_scale_path = os.path.join(index_dir, 'row_scale.npy')
+    row_scale = np.load(row_scale_path, mmap_mode='r') if os.path.exists(row_scale_path) else None
+    offsets = load_array('text_offsets.npy')
+    texts_path = os.path.join(index_dir, 'texts.bin')
+    buffer = (np.memmap(texts_path, dtype=np.uint8, mode='r') if os.path.getsize(texts_path) > 0
+              else np.zeros(0, dtype=np.uint8))
+    digest = model_digest(index_dir)
+
+    tmp_dir = output_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    shards = []
+    for shard_id, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        name = f'shard-{shard_id:03d}'
+        shard_dir = os.path.join(tmp_dir, name)
+        os.makedirs(shard_dir)
+        lo, hi = int(indptr[start]), int(indptr[stop])
+        np.save(os.path.join(shard_dir, 'data.npy'), data[lo:hi])
+        np.save(os.path.join(shard_dir, 'indices.npy'), indices[lo:hi])
+        np.save(os.path.join(shard_dir, 'indptr.npy'),
+                (np.asarray(indptr[start:stop + 1], dtype=np.int64) - lo).astype(indptr.dtype))
+        if row_scale is not None:
+            np.save(os.path.join(shard_dir, 'row_scale.npy'), row_scale[start:stop])
+
+        text_lo, text_hi = int(offsets[start]), int(offsets[stop])
+        with open(os.path.join(shard_dir, 'texts.bin'), 'wb') as f:
+            f.write(buffer[text_lo:text_hi].tobytes())
+        np.save(os.path.join(shard_dir, 'text_offsets.npy'),
+                (np.asarray(offsets[start:stop + 1], dtype=np.int64) - text_lo)
+                .astype(offset_dtype(text_hi - text_lo)))
+
+        for model_file in MODEL_FILES:
+            shutil.copyfile(os.path.join(index_dir, model_file), os.path.join(shard_dir, model_file))
+        write_meta(shard_dir, dict(meta, n_rows=stop - start, shard={
+            'id': shard_id, 'n_shards': n_shards, 'first_row': start, 'model_sha256': digest,
+        }))
+        shards.append({'id': shard_id, 'dir': name, 'first_row': start, 'n_rows': stop - start,
+                       'nnz': hi - lo})
+
+    sharded_meta = {
+        'format_version': SHARDS_FORMAT_VERSION,
+        'n_rows': n_rows,
+        'n_shards': n_shards,
+        'model_sha256': digest,
+        'column': meta.get('column'),
+        'precision': meta.get('precision', 'float64'),
+        'source_index': os.path.abspath(index_dir),
+        # Ties the result cache version (result_cache.index_version) to the rows sharded
+        'source_revision': meta.get('revision', 0),
+        'shards': shards,
+    }
+    with open(os.path.join(tmp_dir, SHARDS_FILE), 'w') as f:
+        json.dump(sharded_meta, f, indent=2)
+    replace_index_dir(tmp_dir, output_dir)
+    return sharded_meta
+
+
+class ShardedIndex:
+    """
+    Some or all shards of a sharded index, searched as one index
+
+    Rows are addressed by their global row id. Only rows of the hosted
+    shards are searched; with every shard loaded, results equal those of the
+    unsharded index.
+    """
+
+    def __init__(self, shards, first_rows, meta, n_jobs=None):
+        self.shards = shards
+        self.first_rows = first_rows
+        self.meta = meta
+        self.n_jobs = n_jobs or min(len(shards), os.cpu_count() or 1)
+        # Every shard holds the same model; the first one vectorizes queries
+        self.model = shards[0]
+        self.fields = self.model.fields
+        self.feature_names = self.model.feature_names
+        self.vocabulary = self.model.vocabulary
+
+    @classmethod
+    def load(cls, directory, shard_ids=None, mmap=True, n_jobs=None):
+        """
+        Load the shards of a sharded index (all of them, or shard_ids)
+
+        Raises:
+            ValueError: For an unknown shard id, or a shard whose model
+                differs from the one the index was split with
+        """
+        with open(os.path.join(directory, SHARDS_FILE)) as f:
+            meta = json.load(f)
+        if meta.get('format_version') != SHARDS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported sharded index format in '{directory}'")
+        entries = meta['shards']
+        if shard_ids is not None:
+            unknown = sorted(set(shard_ids) - {entry['id'] for entry in entries})
+            if unknown:
+                raise ValueError(f"No shard(s) {', '.join(map(str, unknown))} in '{directory}' "
+                                 f"(it has {len(entries)})")
+            entries = [entry for entry in entries if entry['id'] in set(shard_ids)]
+
+        shards = []
+        for entry in entries:
+            shard_dir = os.path.join(directory, entry['dir'])
+            if model_digest(shard_dir) != meta['model_sha256']:
+                raise ValueError(f"Shard {entry['id']} does not share the model of '{directory}'")
+            shards.append(TfidfIndex.load(shard_dir, mmap=mmap))
+        return cls(shards, [entry['first_row'] for entry in entries], meta, n_jobs)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    @property
+    def n_rows(self):
+        """Rows of the whole sharded index, hosted here or not"""
+        return self.meta['n_rows']
+
+    def shard_position(self, row):
+        """Position in self.shards of the shard holding global row"""
+        pos = bisect.bisect_right(self.first_rows, row) - 1
+        if pos < 0 or row - self.first_rows[pos] >= len(self.shards[pos]):
+            raise KeyError(f"Row {row} is not in a loaded shard")
+        return pos
+
+    def locate(self, row):
+        """(shard, local row) holding global row"""
+        pos = self.shard_position(row)
+        return self.shards[pos], row - self.first_rows[pos]
+
+    def take_texts(self, rows):
+        """Texts of several global rows as a list"""
+        texts = []
+        for row in rows:
+            shard, local = self.locate(int(row))
+            texts.append(shard.texts[local])
+        return texts
+
+    def transform(self, items):
+        return self.model.transform(items)
+
+    def dense_vector(self, item):
+        return self.model.dense_vector(item)
+
+    def item_text(self, item):
+        return self.model.item_text(item)
+
+    def _scatter(self, score_shard):
+        """score_shard(shard, first_row) for every shard, on the thread pool"""
+        if self.n_jobs == 1 or len(self.shards) == 1:
+            return [score_shard(shard, first) for shard, first in zip(self.shards, self.first_rows)]
+        with ThreadPoolExecutor(self.n_jobs) as pool:
+            return list(pool.map(score_shard, self.shards, self.first_rows))
+
+    def query(self, item_vector, threshold=0.7, top_k=None):
+        """
+        Best rows for one item, gathered from every shard
+
+        Args:
+            item_vector: Dense vector of the item (dense_vector)
+            threshold: Similarity threshold
+            top_k: Keep at most this many rows (default: all above threshold)
+
+        Returns:
+            (rows, scores, stats) where rows and scores are sorted like
+            search.top_matches and stats holds n_above, rows_scored and the
+            mean, max and min similarity over the hosted rows
+        """
+        def score_shard(shard, first_row):
+            similarities = np.asarray(shard.matrix @ item_vector).ravel()
+            rows, scores = top_matches(np.arange(first_row, first_row + len(similarities)),
+                                       similarities, threshold, top_k)
+            summary = (int(np.count_nonzero(similarities >= threshold)), len(similarities),
+                       float(similarities.sum()), float(similarities.max(initial=-np.inf)),
+                       float(similarities.min(initial=np.inf)))
+            return rows, scores, summary
+
+        parts = self._scatter(score_shard)
+        merged = heapq.merge(*(zip((-scores).tolist(), rows.tolist()) for rows, scores, _ in parts))
+        best = list(itertools.islice(merged, top_k))
+        rows = np.array([row for _, row in best], dtype=np.int64)
+        scores = np.array([-score for score, _ in best], dtype=np.float64)
+
+        n_above, n_scored, total, high, low = zip(*(summary for _, _, summary in parts))
+        stats = {
+            'n_above': sum(n_above),
+            'rows_scored': sum(n_scored),
+            'mean': sum(total) / max(1, sum(n_scored)),
+            'max': max(high),
+            'min': min(low),
+        }
+        return rows, scores, stats
+
+    def search(self, item_vectors, threshold=0.7, memory_budget_mb=256, top_k=None):
+        """
+        batch_matches over every hosted shard, merged into one stream
+
+        The memory budget is shared by the shards scored at the same time.
+
+        Yields:
+            (item_index, row, similarity) in the order batch_matches gives
+            for the unsharded index: by item, best first, ties by row
+        """
+        budget = memory_budget_mb / self.n_jobs
+
+        def score_shard(shard, first_row):
+            return [(item, first_row + row, score) for item, row, score in
+                    batch_matches(item_vectors, shard.matrix, threshold, budget, top_k)]
+
+        merged = heapq.merge(*self._scatter(score_shard),
+                             key=lambda match: (match[0], -match[2], match[1]))
+        item, kept = None, 0
+        for match in merged:
+            if match[0] != item:
+                item, kept = match[0], 0
+            if top_k is None or kept < top_k:
+                kept += 1
+                yield match
+
+    def explain(self, item_vector, rows, top_n=10):
+        """explain_dense for global rows, each explained by its own shard"""
+        explanations = []
+        for row in rows:
+            shard, local = self.locate(int(row))
+            explanations.extend(explain_dense(item_vector, shard.csr_arrays, [local],
+                                              self.feature_names, top_n))
+        return explanations
+
+    def with_explanations(self, matches, item_vectors, top_n=10, group_size=4096):
+        """
+        Attach shared-term explanations to a stream of search() matches
+
+        Like explain.with_explanations, group_size matches at a time with
+        one sparse product per shard.
+
+        Yields:
+            (item_index, row, score, terms) for every (item_index, row, score)
+        """
+        group = []
+        for match in matches:
+            group.append(match)
+            if len(group) == group_size:
+                yield from self._explain_group(group, item_vectors, top_n)
+                group = []
+        yield from self._explain_group(group, item_vectors, top_n)
+
+    def _explain_group(self, group, item_vectors, top_n):
+        by_shard = {}
+        for pos, (_, row, _) in enumerate(group):
+            by_shard.setdefault(self.shard_position(row), []).append(pos)
+        terms = [None] * len(group)
+        for shard_pos, positions in by_shard.items():
+            first_row = self.first_rows[shard_pos]
+            explanations = explain_matches(
+                item_vectors, self.shards[shard_pos].matrix,
+                [group[pos][1] - first_row for pos in positions], self.feature_names,
+                item_ids=[group[pos][0] for pos in positions], top_n=top_n
+            )
+            for pos, explanation in zip(positions, explanations):
+                terms[pos] = explanation
+        for (item, row, score), explanation in zip(group, terms):
+            yield item, row, score, explanation
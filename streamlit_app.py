@@ -1,12 +1,41 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import plotly.express as px
 import plotly.graph_objects as go
 from collections import Counter
+import json
+import os
 import re
+import tempfile
+import time
+
+from backends import BACKENDS, DEFAULT_MIN_OVERLAP, make_backend
+from explain import explain_matches
+from model_cache import ModelCache, bytes_sha256, model_key
+from profiling import StageProfiler, profile_stage
+from result_cache import ResultCache, result_key
+from search import batch_matches, similarity_histogram, top_matches
+from tfidf_index import (
+    PRECISIONS,
+    TfidfIndex,
+    column_fields,
+    field_spec,
+    input_format,
+    read_text_columns,
+    table_columns,
+)
+
+# Fitted models are shared by all sessions; these bound the shared cache
+MODEL_CACHE_MB = float(os.environ.get('DUPLICATE_FINDER_MODEL_CACHE_MB', 2048))
+MODEL_CACHE_DIR = os.environ.get(
+    'DUPLICATE_FINDER_MODEL_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'duplicate-finder-models')
+)
+MODEL_CACHE_DISK_MB = float(os.environ.get('DUPLICATE_FINDER_MODEL_CACHE_DISK_MB', 10240))
+# Check results are shared too, keyed by model, settings and normalized item
+RESULT_CACHE_MB = float(os.environ.get('DUPLICATE_FINDER_RESULT_CACHE_MB', 256))
+RESULT_CACHE_TTL = float(os.environ.get('DUPLICATE_FINDER_RESULT_CACHE_TTL', 0)) or None
 
 # Page configuration
 st.set_page_config(
@@ -15,17 +44,63 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def get_model_cache():
+    """One model cache per server process, shared by every session"""
+    return ModelCache(
+        max_bytes=MODEL_CACHE_MB * 2**20,
+        cache_dir=MODEL_CACHE_DIR,
+        max_disk_bytes=MODEL_CACHE_DISK_MB * 2**20
+    )
+
+@st.cache_resource
+def get_result_cache():
+    """One result cache per server process, shared by every session"""
+    return ResultCache(max_bytes=RESULT_CACHE_MB * 2**20, ttl=RESULT_CACHE_TTL)
+
+def fit_uploaded_model(data, column, max_features, file_hash, precision='float64',
+                       char_ngrams=None, profiler=None, fmt='csv'):
+    """
+    Parse the selected column(s) of an uploaded file and fit the TF-IDF index
+
+    column is a column name, or [[column, weight], ...] for a weighted
+    multi-column index (see field_spec); char_ngrams (min_n, max_n) fits
+    on character n-grams instead of words. fmt is the upload's format
+    (see input_format): Parquet and Arrow columns are fit on in place.
+    """
+    names = [name for name, _ in column_fields(column)]
+    with profile_stage(profiler, f'read_{fmt}'):
+        texts = read_text_columns(data, names, fmt)
+    meta = {'source': {'sha256': file_hash}, 'column': column}
+    with profile_stage(profiler, 'fit'):
+        if isinstance(column, str):
+            return TfidfIndex.from_texts(
+                texts[column],
+                max_features=max_features,
+                meta=meta,
+                precision=precision,
+                char_ngrams=char_ngrams
+            )
+        return TfidfIndex.from_fields(
+            column,
+            texts,
+            max_features=max_features,
+            meta=meta,
+            precision=precision,
+            char_ngrams=char_ngrams
+        )
+
 # Initialize session state
-if 'dataset' not in st.session_state:
-    st.session_state.dataset = None
-if 'tfidf_vectorizer' not in st.session_state:
-    st.session_state.tfidf_vectorizer = None
-if 'tfidf_matrix' not in st.session_state:
-    st.session_state.tfidf_matrix = None
-if 'selected_column' not in st.session_state:
-    st.session_state.selected_column = None
-if 'text_data' not in st.session_state:
-    st.session_state.text_data = None
+if 'upload' not in st.session_state:
+    st.session_state.upload = None
+if 'index' not in st.session_state:
+    st.session_state.index = None
+if 'model_key' not in st.session_state:
+    st.session_state.model_key = None
+if 'search_backend' not in st.session_state:
+    st.session_state.search_backend = None
+if 'profiles' not in st.session_state:
+    st.session_state.profiles = {}
 
 st.title("🔍 Duplicate Finder with Interpretability")
 st.markdown("**TF-IDF + Cosine Similarity for Duplicate Detection**")
@@ -35,7 +110,55 @@ with st.sidebar:
     st.header("⚙️ Configuration")
     threshold = st.slider("Similarity Threshold", 0.0, 1.0, 0.7, 0.05)
     max_features = st.slider("Max TF-IDF Features", 100, 10000, 5000, 100)
+    analyzer = st.selectbox(
+        "Features",
+        options=['words', 'character n-grams (3-4)'],
+        help="Character n-grams tolerate typos and run-together tokens (\"iphn 13pro\"); "
+             "pair them with the inverted backend"
+    )
+    char_ngrams = (3, 4) if analyzer != 'words' else None
+    precision = st.selectbox(
+        "Matrix Precision",
+        options=list(PRECISIONS),
+        index=PRECISIONS.index('float64'),
+        help="float64 scores exactly like TfidfVectorizer; float32 halves the matrix values; "
+             "uint8 only shrinks the saved model, it is scored as float32 in memory "
+             "(see cli_app.py precision-report for the ranking change)"
+    )
+    top_k = st.number_input(
+        "Top-K Matches (0 = all above threshold)",
+        min_value=0, max_value=10000, value=0, step=10
+    )
     show_interpretability = st.checkbox("Show Interpretability", value=True)
+    profile_memory = st.checkbox(
+        "Track Memory per Stage",
+        value=False,
+        help="Record the peak memory of every stage with tracemalloc (slows down the fit)"
+    )
+    backend_kind = st.selectbox(
+        "Search Backend",
+        options=list(BACKENDS),
+        help="'exact' scores every row; LSH and inverted backends only rescore candidate rows"
+    )
+    lsh_bands, lsh_rows, min_overlap = 20, 5, DEFAULT_MIN_OVERLAP
+    if backend_kind == 'inverted':
+        min_overlap = st.slider("Min Feature Overlap", 0.0, 1.0, DEFAULT_MIN_OVERLAP, 0.05,
+                                help="Share of the item's features a row must contain to be scored")
+    elif backend_kind != 'exact':
+        lsh_bands = st.number_input("LSH Bands", min_value=1, max_value=200, value=20)
+        lsh_rows = st.number_input("LSH Rows per Band", min_value=1, max_value=64, value=5)
+
+    cache_stats = get_model_cache().stats()
+    st.caption(f"🗄️ Model cache: {cache_stats['models']} model(s), "
+               f"{cache_stats['bytes'] / 2**20:.0f} / {cache_stats['max_bytes'] / 2**20:.0f} MB")
+    result_stats = get_result_cache().stats()
+    hit_rate = f"{result_stats['hit_rate']:.0%}" if result_stats['hit_rate'] is not None else "n/a"
+    st.caption(f"🗃️ Result cache: {result_stats['hits']} hit(s), {result_stats['misses']} miss(es) "
+               f"({hit_rate} hit rate), {result_stats['entries']} entries, "
+               f"{result_stats['bytes'] / 2**20:.1f} / {result_stats['max_bytes'] / 2**20:.0f} MB")
+    if st.button("🧹 Clear Result Cache", disabled=result_stats['entries'] == 0):
+        get_result_cache().clear()
+        st.rerun()
 
 # Main content area
 col1, col2 = st.columns([1, 1])
@@ -44,40 +167,75 @@ with col1:
     st.header("📥 Input")
     
     # File upload
-    uploaded_file = st.file_uploader("Upload CSV Dataset", type=['csv'])
+    uploaded_file = st.file_uploader(
+        "Upload Dataset",
+        type=['csv', 'parquet', 'pq', 'feather', 'arrow', 'ipc'],
+        help="CSV, or Parquet / Arrow IPC (Feather) files, which load much faster: "
+             "only the selected columns are read"
+    )
     
     if uploaded_file is not None:
         try:
-            st.session_state.dataset = pd.read_csv(uploaded_file)
-            st.success(f"✅ Dataset loaded: {len(st.session_state.dataset)} rows")
+            # Hash the upload and read its header once, not on every rerun
+            upload_id = (uploaded_file.name, uploaded_file.size, getattr(uploaded_file, 'file_id', None))
+            if st.session_state.upload is None or st.session_state.upload[0] != upload_id:
+                data = uploaded_file.getvalue()
+                st.session_state.upload = (
+                    upload_id,
+                    bytes_sha256(data),
+                    table_columns(data, input_format(uploaded_file.name))
+                )
+            _, file_hash, columns = st.session_state.upload
+            st.success(f"✅ File uploaded: {uploaded_file.size / 2**20:.1f} MB")
             
-            # Column selection
-            st.session_state.selected_column = st.selectbox(
-                "Select Text Column to Analyze",
-                options=st.session_state.dataset.columns.tolist()
+            # Column selection: several columns are matched together, each with a weight
+            selected_columns = st.multiselect(
+                "Select Text Column(s) to Analyze",
+                options=columns,
+                default=columns[:1]
             )
+            weights = [1.0] * len(selected_columns)
+            if len(selected_columns) > 1:
+                weight_cols = st.columns(len(selected_columns))
+                weights = [
+                    weight_col.number_input(f"Weight: {column}", min_value=0.1, max_value=10.0,
+                                            value=1.0, step=0.1, key=f"weight_{column}")
+                    for weight_col, column in zip(weight_cols, selected_columns)
+                ]
+            selected_column = (field_spec(list(zip(selected_columns, weights)))
+                               if selected_columns else None)
             
-            if st.session_state.selected_column:
-                # Train model button
+            if selected_column:
+                model_cache = get_model_cache()
+                key = model_key(file_hash, selected_column, max_features, precision=precision,
+                                char_ngrams=char_ngrams)
+                
+                # Train model button (reuses a model any session already fit on this file)
                 if st.button("🚀 Train Model", type="primary"):
                     with st.spinner("Training TF-IDF model..."):
-                        # Prepare text data
-                        st.session_state.text_data = st.session_state.dataset[
-                            st.session_state.selected_column
-                        ].fillna('').astype(str).tolist()
-                        
-                        # Train TF-IDF
-                        st.session_state.tfidf_vectorizer = TfidfVectorizer(
-                            max_features=max_features,
-                            stop_words='english'
-                        )
-                        st.session_state.tfidf_matrix = st.session_state.tfidf_vectorizer.fit_transform(
-                            st.session_state.text_data
-                        )
-                        st.success("✅ Model trained successfully!")
-                        
-                        # Show model info
-                        st.info(f"📊 Vocabulary size: {len(st.session_state.tfidf_vectorizer.vocabulary_)}")
+                        with StageProfiler(memory=profile_memory) as profiler:
+                            with profile_stage(profiler, 'model') as record:
+                                index, source = model_cache.get_or_build(
+                                    key,
+                                    lambda: fit_uploaded_model(
+                                        uploaded_file.getvalue(), selected_column, max_features,
+                                        file_hash, precision, char_ngrams, profiler,
+                                        input_format(uploaded_file.name)
+                                    )
+                                )
+                                record['stage'] = f"model ({source})"
+                        st.session_state.profiles['Train Model'] = profiler.report()
+                        st.session_state.index = index
+                        st.session_state.model_key = key
+                        if source == 'built':
+                            st.success("✅ Model trained successfully!")
+                        else:
+                            st.success(f"✅ Cached model reused ({source})")
+                
+                if st.session_state.index is not None and st.session_state.model_key == key:
+                    # Show model info
+                    st.info(f"📊 {len(st.session_state.index)} rows, "
+                            f"vocabulary size: {len(st.session_state.index.vocabulary)}")
         except Exception as e:
             st.error(f"Error loading file: {str(e)}")
     
@@ -89,59 +247,138 @@ with col1:
         placeholder="Enter item name or description..."
     )
     
-    check_button = st.button("🔍 Check for Duplicates", type="primary", disabled=st.session_state.tfidf_vectorizer is None)
+    check_button = st.button("🔍 Check for Duplicates", type="primary", disabled=st.session_state.index is None)
+    
+    # Batch input
+    st.subheader("📑 Batch Check")
+    batch_file = st.file_uploader("Upload candidate items (one per line)", type=['txt'], key='batch_file')
+    batch_button = st.button(
+        "📑 Check Batch",
+        disabled=st.session_state.index is None or batch_file is None
+    )
 
 with col2:
     st.header("📤 Output")
     
     if check_button and item_input:
-        if st.session_state.tfidf_vectorizer is None:
+        if st.session_state.index is None:
             st.warning("⚠️ Please train the model first!")
         else:
             with st.spinner("Analyzing..."):
-                # Vectorize input
-                item_vector = st.session_state.tfidf_vectorizer.transform([item_input])
-                
-                # Calculate similarity
-                similarities = cosine_similarity(item_vector, st.session_state.tfidf_matrix)[0]
+                profiler = StageProfiler(memory=profile_memory).start()
+                # Reuse the backend (and its LSH tables) until the model or settings change
+                index = st.session_state.index
+                backend_key = (st.session_state.model_key, backend_kind, lsh_bands, lsh_rows,
+                               min_overlap)
+                with profile_stage(profiler, 'backend'):
+                    if st.session_state.search_backend is None or st.session_state.search_backend[0] != backend_key:
+                        st.session_state.search_backend = (
+                            backend_key,
+                            make_backend(index.matrix, backend_kind, lsh_bands, lsh_rows,
+                                         min_overlap=min_overlap)
+                        )
+                search_backend = st.session_state.search_backend[1]
                 
-                # Find duplicates
-                duplicate_indices = np.where(similarities >= threshold)[0]
+                # A repeated check (same model, settings and normalized item) is
+                # answered from the shared result cache
+                result_cache = get_result_cache()
+                cache_key = result_key(index, item_input, *backend_key[1:], threshold, top_k)
+                cached = result_cache.get(st.session_state.model_key, cache_key)
+                if cached is not None:
+                    n_above, duplicate_indices, duplicate_scores, explanations, distribution = cached
+                    st.caption("🗃️ Answered from the result cache")
+                else:
+                    # Vectorize input
+                    with profile_stage(profiler, 'transform'):
+                        item_vector = index.transform([item_input])
+                    
+                    # Calculate similarity (every row for exact search, LSH candidates otherwise)
+                    with profile_stage(profiler, 'score'):
+                        scored_rows, similarities = search_backend.score(item_vector)
+                    
+                    # Find duplicates
+                    with profile_stage(profiler, 'select'):
+                        n_above = int(np.count_nonzero(similarities >= threshold))
+                        duplicate_indices, duplicate_scores = top_matches(
+                            scored_rows, similarities, threshold, top_k or None
+                        )
+                        # Only the binned distribution of the scores is kept,
+                        # never one score per corpus row
+                        distribution = similarity_histogram(similarities)
+                        del similarities
+                    
+                    # Shared terms of every shown match in one sparse product,
+                    # reusing the query vector computed above
+                    explanations = []
+                    if n_above > 0:
+                        with profile_stage(profiler, 'explain'):
+                            explanations = explain_matches(
+                                item_vector, index.matrix, duplicate_indices,
+                                index.feature_names, top_n=20
+                            )
+                    result_cache.put(st.session_state.model_key, cache_key,
+                                     (n_above, duplicate_indices, duplicate_scores, explanations,
+                                      distribution))
                 
-                if len(duplicate_indices) > 0:
-                    st.error(f"⚠️ **DUPLICATE DETECTED!** Found {len(duplicate_indices)} similar item(s)")
+                if n_above > 0:
+                    shown = f", showing top {len(duplicate_indices)}" if len(duplicate_indices) < n_above else ""
+                    st.error(f"⚠️ **DUPLICATE DETECTED!** Found {n_above} similar item(s){shown}")
                     
-                    # Create results dataframe
-                    results = []
-                    for idx in duplicate_indices:
-                        results.append({
-                            'Item': st.session_state.dataset.iloc[idx][st.session_state.selected_column],
-                            'Similarity Score': f"{similarities[idx]:.3f}",
-                            'Similarity %': f"{similarities[idx]*100:.1f}%"
+                    # Create results dataframe (already ranked by score)
+                    with profile_stage(profiler, 'output'):
+                        duplicate_items = index.texts.take(duplicate_indices)
+                        results_df = pd.DataFrame({
+                            'Item': duplicate_items,
+                            'Similarity Score': np.round(duplicate_scores, 3),
+                            'Similarity %': [f"{score*100:.1f}%" for score in duplicate_scores]
                         })
-                    
-                    results_df = pd.DataFrame(results)
-                    results_df = results_df.sort_values('Similarity Score', ascending=False)
-                    st.dataframe(results_df, use_container_width=True)
+                        st.dataframe(results_df, use_container_width=True)
                     
                     # Store for interpretability
                     st.session_state.duplicate_results = {
                         'item': item_input,
-                        'duplicates': [
-                            {
-                                'index': int(idx),
-                                'item': st.session_state.dataset.iloc[idx][st.session_state.selected_column],
-                                'similarity': float(similarities[idx])
-                            }
-                            for idx in duplicate_indices
-                        ],
-                        'similarities': similarities
+                        'indices': duplicate_indices,
+                        'explanations': explanations,
+                        'items': duplicate_items,
+                        'scores': duplicate_scores,
+                        'n_above': n_above,
+                        'distribution': distribution
                     }
                 else:
                     st.success("✅ **No duplicates found!** This item is unique.")
                     st.session_state.duplicate_results = None
+                profiler.stop()
+                st.session_state.profiles['Check'] = profiler.report()
+    
+    if batch_button and batch_file is not None:
+        candidates = [
+            line for line in batch_file.getvalue().decode('utf-8').splitlines() if line.strip()
+        ]
+        with st.spinner(f"Checking {len(candidates)} items..."):
+            start = time.perf_counter()
+            # One transform call and chunked matrix products for the whole batch
+            item_vectors = st.session_state.index.transform(candidates)
+            batch_df = pd.DataFrame(
+                list(batch_matches(item_vectors, st.session_state.index.matrix, threshold,
+                                   top_k=top_k or None)),
+                columns=['candidate_id', 'match_index', 'score']
+            )
+            elapsed = time.perf_counter() - start
+        
+        batch_df.insert(1, 'candidate', [candidates[i] for i in batch_df['candidate_id']])
+        rate = len(candidates) / elapsed if elapsed > 0 else float('inf')
+        st.info(f"📑 {len(batch_df)} match(es) for {len(candidates)} item(s) "
+                f"in {elapsed:.2f}s ({rate:,.0f} items/s)")
+        st.dataframe(batch_df, use_container_width=True)
+        st.download_button(
+            "⬇️ Download Matches (CSV)",
+            batch_df.to_csv(index=False),
+            file_name='batch_matches.csv',
+            mime='text/csv'
+        )
 
 # Interpretability Section
+render_start = time.perf_counter()
 if show_interpretability and 'duplicate_results' in st.session_state and st.session_state.duplicate_results:
     st.header("🔬 Interpretability")
     
@@ -158,12 +395,21 @@ if show_interpretability and 'duplicate_results' in st.session_state and st.sess
     with tab1:
         st.subheader("Similarity Score Distribution")
         
-        # Create histogram
-        fig = px.histogram(
-            x=results['similarities'],
-            nbins=50,
-            labels={'x': 'Cosine Similarity Score', 'y': 'Count'},
-            title="Distribution of Similarity Scores"
+        # Counts were binned when the item was checked, so the chart has a
+        # fixed number of bars whatever the corpus size
+        distribution = results['distribution']
+        edges = np.asarray(distribution['edges'])
+        fig = go.Figure(go.Bar(
+            x=(edges[:-1] + edges[1:]) / 2,
+            y=distribution['counts'],
+            width=np.diff(edges),
+            hovertext=[f"{low:.2f}-{high:.2f}" for low, high in zip(edges[:-1], edges[1:])]
+        ))
+        fig.update_layout(
+            title="Distribution of Similarity Scores",
+            xaxis_title="Cosine Similarity Score",
+            yaxis_title="Count",
+            bargap=0
         )
         fig.add_vline(
             x=threshold,
@@ -176,48 +422,37 @@ if show_interpretability and 'duplicate_results' in st.session_state and st.sess
         # Statistics
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Mean Similarity", f"{np.mean(results['similarities']):.3f}")
+            st.metric("Mean Similarity", f"{distribution['mean']:.3f}")
         with col2:
-            st.metric("Max Similarity", f"{np.max(results['similarities']):.3f}")
+            st.metric("Max Similarity", f"{distribution['max']:.3f}")
         with col3:
-            st.metric("Min Similarity", f"{np.min(results['similarities']):.3f}")
+            st.metric("Min Similarity", f"{distribution['min']:.3f}")
         with col4:
-            st.metric("Above Threshold", f"{len(results['duplicates'])}")
+            st.metric("Above Threshold", f"{results['n_above']}")
+        st.caption(f"{distribution['n']:,} row(s) scored, standard deviation "
+                   f"{distribution['std']:.3f}")
     
     with tab2:
         st.subheader("TF-IDF Feature Importance")
         
-        if len(results['duplicates']) > 0:
-            # Get top match
-            top_match = results['duplicates'][0]
-            top_idx = top_match['index']
-            
-            # Get feature names
-            feature_names = st.session_state.tfidf_vectorizer.get_feature_names_out()
-            
-            # Get TF-IDF vectors
-            input_vector = st.session_state.tfidf_vectorizer.transform([results['item']])
-            match_vector = st.session_state.tfidf_matrix[top_idx]
-            
-            # Convert to arrays
-            input_array = input_vector.toarray()[0]
-            match_array = match_vector.toarray()[0]
-            
-            # Get top contributing features
-            # Use product of both vectors to find important shared features
-            shared_features = input_array * match_array
-            top_feature_indices = np.argsort(shared_features)[-20:][::-1]
+        if len(results['indices']) > 0:
+            # Explanations were computed for every shown match with the results
+            match_number = st.selectbox(
+                "Match to explain:",
+                options=list(range(1, len(results['indices']) + 1)),
+                format_func=lambda i: f"Match #{i}: {results['items'][i - 1]}"
+            )
             
             # Create feature importance dataframe
-            feature_importance = []
-            for idx in top_feature_indices:
-                if shared_features[idx] > 0:
-                    feature_importance.append({
-                        'Feature': feature_names[idx],
-                        'Input TF-IDF': f"{input_array[idx]:.4f}",
-                        'Match TF-IDF': f"{match_array[idx]:.4f}",
-                        'Shared Importance': f"{shared_features[idx]:.4f}"
-                    })
+            feature_importance = [
+                {
+                    'Feature': feature,
+                    'Input TF-IDF': f"{input_weight:.4f}",
+                    'Match TF-IDF': f"{match_weight:.4f}",
+                    'Shared Importance': f"{shared:.4f}"
+                }
+                for feature, input_weight, match_weight, shared in results['explanations'][match_number - 1]
+            ]
             
             if feature_importance:
                 importance_df = pd.DataFrame(feature_importance)
@@ -237,11 +472,11 @@ if show_interpretability and 'duplicate_results' in st.session_state and st.sess
     with tab3:
         st.subheader("Top Matches Detailed Analysis")
         
-        # Sort duplicates by similarity
-        sorted_duplicates = sorted(results['duplicates'], key=lambda x: x['similarity'], reverse=True)
-        
-        for i, dup in enumerate(sorted_duplicates[:5], 1):
-            with st.expander(f"Match #{i}: Similarity = {dup['similarity']:.3f} ({dup['similarity']*100:.1f}%)"):
+        # Duplicates are already ranked by similarity
+        for i, (item, similarity, terms) in enumerate(
+                zip(results['items'][:5], results['scores'][:5], results['explanations'][:5]), 1):
+            similarity = float(similarity)
+            with st.expander(f"Match #{i}: Similarity = {similarity:.3f} ({similarity*100:.1f}%)"):
                 col1, col2 = st.columns(2)
                 
                 with col1:
@@ -250,17 +485,21 @@ if show_interpretability and 'duplicate_results' in st.session_state and st.sess
                 
                 with col2:
                     st.write("**Matched Item:**")
-                    st.write(dup['item'])
+                    st.write(item)
                 
                 # Show similarity score
-                st.progress(dup['similarity'])
-                st.caption(f"Similarity: {dup['similarity']:.3f}")
+                st.progress(min(similarity, 1.0))
+                st.caption(f"Similarity: {similarity:.3f}")
+                if terms:
+                    st.caption("Shared terms: " + ", ".join(
+                        f"{feature} ({shared:.3f})" for feature, _, _, shared in terms[:5]
+                    ))
     
     with tab4:
         st.subheader("Word-Level Comparison")
         
-        if len(results['duplicates']) > 0:
-            top_match = results['duplicates'][0]
+        if len(results['items']) > 0:
+            top_item = results['items'][0]
             
             # Extract words
             def extract_words(text):
@@ -268,7 +507,7 @@ if show_interpretability and 'duplicate_results' in st.session_state and st.sess
                 return words
             
             input_words = Counter(extract_words(results['item']))
-            match_words = Counter(extract_words(top_match['item']))
+            match_words = Counter(extract_words(str(top_item)))
             
             # Find common words
             common_words = set(input_words.keys()) & set(match_words.keys())
@@ -324,6 +563,25 @@ if show_interpretability and 'duplicate_results' in st.session_state and st.sess
                 fig.update_xaxes(tickangle=45)
                 st.plotly_chart(fig, use_container_width=True)
 
+# Stage timings of the last training and check (and of this page's interpretability charts)
+if st.session_state.profiles:
+    render_s = time.perf_counter() - render_start
+    with st.expander("⏱️ Stage Timings"):
+        for label, report in st.session_state.profiles.items():
+            st.write(f"**{label}** ({report['total_s']:.3f}s)")
+            stages = pd.DataFrame(report['stages'])
+            stages['stage'] = ['  ' * depth + name for depth, name in zip(stages['depth'], stages['stage'])]
+            if not report['memory_tracked']:
+                stages = stages.drop(columns=['peak_mb', 'retained_mb'])
+            st.dataframe(stages.drop(columns=['depth']), use_container_width=True)
+        st.caption(f"Interpretability charts rendered in {render_s:.3f}s")
+        st.download_button(
+            "⬇️ Download Profile (JSON)",
+            json.dumps(st.session_state.profiles, indent=2),
+            file_name='profile.json',
+            mime='application/json'
+        )
+
 # Footer
 st.markdown("---")
 st.markdown("**How it works:**")
@@ -0,0 +1,49 @@
+"""Shared fixtures; the modules under test live at the repository root"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_titles, write_corpus  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def titles():
+    """Synthetic product titles with near-duplicates"""
+    return synthetic_titles(3000, vocab_size=2000)
+
+
+@pytest.fixture(scope='session')
+def corpus_csv(tmp_path_factory, titles):
+    """CSV file with the titles in a 'title' column"""
+    path = str(tmp_path_factory.mktemp('corpus') / 'corpus.csv')
+    write_corpus(path, titles)
+    return path
+
+
+@pytest.fixture(scope='session')
+def assert_same_index():
+    """Check that two index directories hold identical arrays, texts and model files"""
+
+    def check(dir_a, dir_b):
+        names = sorted(os.listdir(dir_a))
+        assert names == sorted(os.listdir(dir_b))
+        for name in names:
+            path_a, path_b = os.path.join(dir_a, name), os.path.join(dir_b, name)
+            if name.endswith('.npy'):
+                array_a, array_b = np.load(path_a), np.load(path_b)
+                assert array_a.dtype == array_b.dtype, name
+                assert np.array_equal(array_a, array_b), name
+            elif name.endswith('.json') and name != 'meta.json':
+                with open(path_a) as f_a, open(path_b) as f_b:
+                    assert json.load(f_a) == json.load(f_b), name
+            elif name == 'texts.bin':
+                with open(path_a, 'rb') as f_a, open(path_b, 'rb') as f_b:
+                    assert f_a.read() == f_b.read(), name
+
+    return check
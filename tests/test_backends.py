@@ -0,0 +1,117 @@
+"""Search backends against exact search, and reuse of their saved tables"""
+
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+
+from backends import ExactBackend, InvertedBackend, LSH_BACKENDS, make_backend, recall_report
+from search import dedupe_pairs
+from tfidf_index import TfidfIndex
+
+
+@pytest.fixture(scope='module')
+def index(titles):
+    return TfidfIndex.from_texts(titles)
+
+
+@pytest.fixture(scope='module')
+def duplicate_rows(index):
+    """Rows with at least one other row at similarity >= 0.8"""
+    rows, cols, _ = dedupe_pairs(index.matrix, 0.8, n_jobs=1)
+    return np.unique(np.concatenate([rows, cols]))[:200]
+
+
+@pytest.mark.parametrize('kind', sorted(LSH_BACKENDS))
+def test_lsh_recall_against_exact(kind, index, duplicate_rows):
+    backend = make_backend(index.matrix, kind)
+    report = recall_report(index.matrix, backend, duplicate_rows, threshold=0.8)
+
+    assert report['exact_pairs'] > 0
+    assert report['recall'] >= 0.95
+    assert report['candidate_fraction'] < 1.0
+
+
+@pytest.mark.parametrize('kind', sorted(LSH_BACKENDS))
+def test_lsh_candidates_are_scored_exactly(kind, index, titles):
+    backend = make_backend(index.matrix, kind)
+    _, exact = ExactBackend(index.matrix).score(index.transform([titles[7]]))
+    rows, similarities = backend.score(index.transform([titles[7]]))
+
+    assert 7 in rows.tolist()
+    assert np.array_equal(similarities, exact[rows])
+
+
+def saved_params(cache_dir):
+    (backend_dir,) = [name for name in os.listdir(cache_dir) if name != 'meta.json']
+    with open(os.path.join(cache_dir, backend_dir, 'params.json')) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('kind', sorted(LSH_BACKENDS) + ['inverted'])
+def test_saved_tables_are_rebuilt_when_the_rows_change(kind, index, tmp_path):
+    cache_dir = str(tmp_path)
+    make_backend(index.matrix, kind, cache_dir=cache_dir)
+
+    # Same shape, nnz and weights as the saved tables, rows in another order
+    reordered = index.matrix[np.arange(index.matrix.shape[0])[::-1]]
+    reloaded = make_backend(reordered, kind, cache_dir=cache_dir)
+    fresh = make_backend(reordered, kind)
+    for row in (0, 1, 2):
+        assert reloaded.candidates(reordered[row]).tolist() == \
+            fresh.candidates(reordered[row]).tolist()
+
+
+@pytest.mark.parametrize('kind', sorted(LSH_BACKENDS) + ['inverted'])
+def test_saved_tables_are_rebuilt_after_an_update(kind, index, tmp_path):
+    cache_dir = str(tmp_path)
+    make_backend(index.matrix, kind, cache_dir=cache_dir)
+    assert saved_params(cache_dir)['updates'] == 0
+
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+        json.dump({'updates': 1}, f)
+    make_backend(index.matrix, kind, cache_dir=cache_dir)
+    assert saved_params(cache_dir)['updates'] == 1
+
+
+@pytest.mark.parametrize('min_overlap', [0.0, 0.3, 0.5, 1.0])
+def test_inverted_returns_every_row_reaching_the_overlap(min_overlap, index, titles):
+    backend = InvertedBackend(index.matrix, min_overlap)
+    pattern = index.matrix.copy()
+    pattern.data[:] = 1
+    items = [titles[7], titles[123].upper(), ' '.join(titles[40].split()[:2]) + ' zzzunknownzzz']
+    for item in items:
+        item_vector = index.transform([item])
+        features = np.unique(item_vector.indices)
+        # Distinct item features every row contains, by brute force
+        shared = np.asarray(pattern[:, features].sum(axis=1)).ravel()
+        needed = max(1, math.ceil(min_overlap * len(features)))
+        expected_rows = np.flatnonzero(shared >= needed)
+
+        rows, similarities = backend.score(item_vector)
+        assert np.array_equal(rows, expected_rows)
+        _, exact = ExactBackend(index.matrix).score(item_vector)
+        assert np.allclose(similarities, exact[rows])
+        # Exact matches are only dropped for sharing too few of the item's features
+        missed = np.setdiff1d(np.flatnonzero(exact >= 0.5), rows)
+        assert np.all(shared[missed] < needed)
+
+
+def test_char_ngram_index_matches_misspelled_variants(titles):
+    products = ['Apple iPhone 13 Pro', 'Apple iPhone 12', 'Samsung Galaxy S21',
+                'iPhone 13 Pro case']
+    texts = titles[:1000] + products
+    iphone_13 = {1000, 1003}
+
+    words = TfidfIndex.from_texts(texts)
+    assert words.transform(['iphn 13pro']).nnz == 0
+
+    ngrams = TfidfIndex.from_texts(texts, char_ngrams=(3, 4))
+    backend = make_backend(ngrams.matrix, 'inverted')
+    for item in ('iphn 13pro', 'iPhone13 Pro', 'aple iphone 13 pro'):
+        rows, similarities = backend.score(ngrams.transform([item]))
+        best = rows[np.argsort(-similarities, kind='stable')[:2]]
+        assert set(best.tolist()) == iphone_13, item
+        assert similarities.max() >= 0.5
@@ -0,0 +1,59 @@
+"""Parquet and Arrow inputs build the index a CSV of the same column builds"""
+
+import pytest
+
+from ingest import build_index_streaming
+from tfidf_index import TfidfIndex, build_index, read_text_column
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.feather as feather  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def columnar_files(tmp_path_factory, titles):
+    root = tmp_path_factory.mktemp('columnar')
+    # An extra column, so that only the text column has to be read
+    table = pa.table({'id': list(range(len(titles))), 'title': titles})
+    paths = {
+        'parquet': str(root / 'corpus.parquet'),
+        'arrow': str(root / 'corpus.arrow'),
+        'arrow-zstd': str(root / 'corpus.feather'),
+    }
+    pq.write_table(table, paths['parquet'], row_group_size=700)
+    feather.write_feather(table, paths['arrow'], compression='uncompressed')
+    feather.write_feather(table, paths['arrow-zstd'], compression='zstd')
+    return paths
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow', 'arrow-zstd'])
+def test_columnar_build_matches_from_texts(fmt, streaming, tmp_path, titles,
+                                           columnar_files, assert_same_index):
+    expected_dir = str(tmp_path / 'from_texts')
+    TfidfIndex.from_texts(titles).save(expected_dir)
+
+    index_dir = str(tmp_path / fmt)
+    if streaming:
+        # Chunks that do not line up with the Parquet row groups
+        build_index_streaming(columnar_files[fmt], 'title', index_dir, chunk_rows=1100)
+    else:
+        build_index(columnar_files[fmt], 'title', index_dir=index_dir)
+
+    assert_same_index(expected_dir, index_dir)
+
+
+def test_uncompressed_arrow_is_read_without_copies(columnar_files, titles):
+    allocated = pa.total_allocated_bytes()
+    texts = read_text_column(columnar_files['arrow'], 'title')
+
+    assert pa.total_allocated_bytes() == allocated
+    assert list(texts) == titles
+
+
+def test_nulls_read_as_empty_strings(tmp_path):
+    path = str(tmp_path / 'nulls.arrow')
+    feather.write_feather(pa.table({'title': ['a b', None, 'c']}), path,
+                          compression='uncompressed')
+
+    assert list(read_text_column(path, 'title')) == ['a b', '', 'c']
@@ -0,0 +1,80 @@
+"""Shared-term explanations: sparse batches against the dense single-item path"""
+
+import numpy as np
+import pytest
+
+from explain import explain_dense, explain_matches, shared_terms, with_explanations
+from search import batch_matches
+from tfidf_index import TfidfIndex
+
+
+@pytest.fixture(scope='module')
+def index(titles):
+    return TfidfIndex.from_texts(titles[:2000])
+
+
+@pytest.fixture(scope='module')
+def items(titles):
+    return [titles[0], titles[11].upper(), titles[2500], 'zzzunknownzzz ' + titles[7]]
+
+
+@pytest.fixture(scope='module')
+def matches(index, items):
+    """(item_index, row, score) of every item against the index down to a low threshold"""
+    found = list(batch_matches(index.transform(items), index.matrix, threshold=0.05))
+    assert len({item_idx for item_idx, _, _ in found}) == len(items)
+    return found
+
+
+def assert_same_terms(found, expected):
+    assert [term[0] for term in found] == [term[0] for term in expected]
+    for found_term, expected_term in zip(found, expected):
+        assert found_term[1:] == pytest.approx(expected_term[1:], abs=1e-12)
+
+
+@pytest.mark.parametrize('top_n', [1, 3, 10, None])
+def test_explain_matches_equal_explain_dense(index, items, matches, top_n):
+    item_ids = [item_idx for item_idx, _, _ in matches]
+    rows = [row for _, row, _ in matches]
+    explanations = explain_matches(index.transform(items), index.matrix, rows,
+                                   index.feature_names, item_ids, top_n)
+    assert len(explanations) == len(matches)
+    for item_idx, item in enumerate(items):
+        pairs = [pos for pos, pair_item in enumerate(item_ids) if pair_item == item_idx]
+        dense = explain_dense(index.dense_vector(item), index.csr_arrays,
+                              [rows[pos] for pos in pairs], index.feature_names, top_n)
+        for pos, expected in zip(pairs, dense):
+            assert_same_terms(explanations[pos], expected)
+
+
+def test_contributions_sum_to_the_similarity(index, items, matches):
+    item_ids = [item_idx for item_idx, _, _ in matches]
+    rows = [row for _, row, _ in matches]
+    pair, _, item_weight, match_weight, contribution = shared_terms(
+        index.transform(items), index.matrix, rows, item_ids, top_n=None
+    )
+    assert np.allclose(item_weight * match_weight, contribution)
+    sums = np.bincount(pair, weights=contribution, minlength=len(rows))
+    assert np.allclose(sums, [score for _, _, score in matches])
+
+
+@pytest.mark.parametrize('group_size', [1, 7, 4096])
+def test_grouped_explanations_equal_one_product(index, items, matches, group_size):
+    item_vectors = index.transform(items)
+    # Enough pairs for several groups of the default size
+    stream = matches * (2 * 4096 // len(matches) + 1) if group_size == 4096 else matches
+    item_ids = [item_idx for item_idx, _, _ in stream]
+    rows = [row for _, row, _ in stream]
+    expected = explain_matches(item_vectors, index.matrix, rows, index.feature_names, item_ids, 5)
+
+    grouped = list(with_explanations(iter(stream), item_vectors, index.matrix,
+                                     index.feature_names, top_n=5, group_size=group_size))
+    assert len(grouped) == len(stream) > group_size
+    assert [match[:3] for match in grouped] == stream
+    for (_, _, _, terms), expected_terms in zip(grouped, expected):
+        assert_same_terms(terms, expected_terms)
+
+
+def test_no_matches():
+    empty = explain_matches(None, None, [], [], top_n=5)
+    assert empty == []
@@ -0,0 +1,120 @@
+"""Multi-column indexes: weighted stacking, plain-string items and the CLI path"""
+
+import csv
+import json
+import math
+
+import numpy as np
+import pytest
+
+import cli_app
+from tfidf_index import TfidfIndex, field_spec, read_text_columns
+
+FIELDS = [('title', 2.0), ('brand', 1.0)]
+
+
+@pytest.fixture(scope='module')
+def columns(titles):
+    titles = titles[:500]
+    brands = [f'brand{row % 23}' if row % 50 else '' for row in range(len(titles))]
+    return {'title': titles, 'brand': brands}
+
+
+@pytest.fixture(scope='module')
+def index(columns):
+    return TfidfIndex.from_fields(FIELDS, columns)
+
+
+@pytest.fixture(scope='module')
+def fields_csv(tmp_path_factory, columns):
+    path = str(tmp_path_factory.mktemp('fields') / 'products.csv')
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title', 'price', 'brand'])
+        writer.writerows(zip(columns['title'], range(len(columns['title'])), columns['brand']))
+    return path
+
+
+def test_columns_are_stacked_with_their_weights(index, columns):
+    total = sum(weight for _, weight in FIELDS)
+    blocks = []
+    for column, weight in FIELDS:
+        part = TfidfIndex.from_texts(columns[column]).matrix.toarray()
+        blocks.append(part * math.sqrt(weight / total))
+    assert np.allclose(index.matrix.toarray(), np.hstack(blocks))
+    assert [name.split(':')[0] for name in index.feature_names] == \
+        ['title'] * blocks[0].shape[1] + ['brand'] * blocks[1].shape[1]
+
+
+def test_row_norms_follow_the_weights_of_nonempty_fields(index, columns):
+    norms = np.sqrt(np.asarray(index.matrix.multiply(index.matrix).sum(axis=1)).ravel())
+    has_brand = np.array([bool(brand) for brand in columns['brand']])
+    assert np.allclose(norms[has_brand], 1.0)
+    assert np.allclose(norms[~has_brand], math.sqrt(2 / 3))
+    assert index.texts[1] == f"{columns['title'][1]} | {columns['brand'][1]}"
+    assert index.texts[0] == columns['title'][0]
+
+
+def test_a_plain_string_is_matched_against_every_column(index, columns):
+    item = f"{columns['title'][3]} {columns['brand'][3]}"
+    plain = index.transform([item]).toarray()
+    per_column = index.transform([{'title': item, 'brand': item}]).toarray()
+    assert np.array_equal(plain, per_column)
+    assert np.allclose(index.dense_vector(item), plain[0])
+    # The row itself scores highest, though each column also sees the other's words
+    assert np.argmax(index.similarities(index.transform([item]))) == 3
+
+
+def test_a_row_given_by_fields_matches_itself(index, columns):
+    item = {'title': columns['title'][3].upper(), 'brand': columns['brand'][3]}
+    scores = index.similarities(index.transform([item]))
+    assert scores[3] == pytest.approx(1.0)
+    # A missing column contributes nothing
+    title_only = index.similarities(index.transform([{'title': columns['title'][3]}]))
+    assert title_only[3] == pytest.approx(2 / 3)
+
+
+def test_streamlit_path_reads_the_selected_columns(fields_csv, index):
+    # What streamlit_app.fit_uploaded_model does with a multi-column selection
+    column = field_spec(FIELDS)
+    with open(fields_csv, 'rb') as f:
+        texts = read_text_columns(f.read(), [name for name, _ in FIELDS], 'csv')
+    uploaded = TfidfIndex.from_fields(column, texts)
+    assert np.allclose(uploaded.matrix.toarray(), index.matrix.toarray())
+    assert list(uploaded.texts) == list(index.texts)
+
+
+def test_cli_builds_and_queries_a_multi_column_index(tmp_path, fields_csv, columns, index,
+                                                     capsys):
+    index_dir = str(tmp_path / 'index')
+    cli_app.main(['build-index', fields_csv, 'title:2', index_dir, '--column', 'brand'])
+    built = TfidfIndex.load(index_dir)
+    assert built.meta['column'] == field_spec(FIELDS)
+    assert np.allclose(built.matrix.toarray(), index.matrix.toarray())
+
+    capsys.readouterr()
+    cli_app.main(['query', index_dir, columns['title'][3],
+                  '--field', f"brand={columns['brand'][3]}", '--threshold', '0.99'])
+    output = capsys.readouterr().out
+    assert f"Item: {index.texts[3]}" in output
+    assert 'Similarity: 1.000' in output
+
+    candidates = str(tmp_path / 'candidates.csv')
+    with open(candidates, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['brand', 'title'])
+        writer.writerows([[columns['brand'][row], columns['title'][row]] for row in (3, 7)])
+    output_file = str(tmp_path / 'matches.jsonl')
+    cli_app.main(['batch', index_dir, '--input', candidates, '--input-fields',
+                  '--output', output_file, '--threshold', '0.99'])
+    with open(output_file) as f:
+        matches = [json.loads(line) for line in f]
+    assert {(match['candidate_id'], match['match_index']) for match in matches} >= {(0, 3), (1, 7)}
+
+
+def test_cli_fits_several_columns_without_an_index(fields_csv, columns, index, capsys):
+    item = columns['title'][3]
+    cli_app.main([fields_csv, 'title:2', item, '--column', 'brand', '--threshold', '0.5'])
+    output = capsys.readouterr().out
+    assert 'Column: title:2, brand:1' in output
+    assert f"Item: {index.texts[3]}" in output
@@ -0,0 +1,107 @@
+"""Fingerprint fast path: hit kinds, tombstones, table reuse and scores"""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from backends import make_backend
+from fingerprints import FINGERPRINT_DIR, FingerprintIndex, open_fingerprints
+from incremental import append_rows, delete_rows
+from tfidf_index import TfidfIndex
+
+
+@pytest.fixture(scope='module')
+def index(titles):
+    return TfidfIndex.from_texts(titles[:1000])
+
+
+@pytest.fixture(scope='module')
+def fingerprints(index):
+    return FingerprintIndex.build(index)
+
+
+def variants(text):
+    """Copies of text with the same tokens but different bytes"""
+    words = text.split()
+    return [text.upper(), ' '.join(reversed(words)), '  ' + ', '.join(words).title() + '!']
+
+
+def test_byte_identical_copies_hit_as_exact(fingerprints, titles):
+    for row in (0, 5, 999):
+        rows, kind = fingerprints.lookup(titles[row])
+        assert kind == 'exact'
+        assert row in rows.tolist()
+
+
+def test_recased_and_reordered_copies_hit_as_normalized(fingerprints, index, titles):
+    for row in (0, 5, 999):
+        for variant in variants(titles[row]):
+            rows, kind = fingerprints.lookup(variant)
+            assert kind == 'normalized', variant
+            assert row in rows.tolist()
+            assert all(sorted(index.analyze(index.texts[hit])) == sorted(index.analyze(variant))
+                       for hit in rows)
+
+
+def test_other_texts_miss(fingerprints, titles):
+    for text in (titles[0] + ' zzzunknownzzz', ' '.join(titles[0].split()[:-1]), '', '!!'):
+        rows, kind = fingerprints.lookup(text)
+        assert kind is None and len(rows) == 0
+
+
+def test_fast_path_scores_equal_the_exact_backend(fingerprints, index, titles):
+    backend = make_backend(index.matrix, 'exact')
+    for row in (0, 5, 999):
+        for text in [titles[row]] + variants(titles[row]):
+            item_vector = index.transform([text])
+            rows, similarities, _ = fingerprints.score(text, item_vector)
+            exact_rows, exact_scores = backend.score(item_vector)
+            expected = dict(zip(np.asarray(exact_rows).tolist(), exact_scores.tolist()))
+            expected_scores = [expected[hit] for hit in rows.tolist()]
+            assert similarities == pytest.approx(expected_scores, abs=1e-12)
+            assert similarities == pytest.approx(1.0)
+            # Dense vectors take the numpy-only path to the same scores
+            dense = fingerprints.score(text, index.dense_vector(text))[1]
+            assert dense == pytest.approx(similarities, abs=1e-12)
+
+
+def test_deleted_rows_are_filtered(tmp_path, titles):
+    index_dir = str(tmp_path / 'index')
+    TfidfIndex.from_texts(titles[:500]).save(index_dir)
+    append_rows(index_dir, [titles[7].upper()])
+    delete_rows(index_dir, [7])
+
+    fingerprints = open_fingerprints(TfidfIndex.load(index_dir), index_dir)
+    rows, kind = fingerprints.lookup(titles[7])
+    assert 7 not in rows.tolist()
+    assert 500 in rows.tolist() and kind == 'normalized'
+
+    delete_rows(index_dir, [500])
+    fingerprints = open_fingerprints(TfidfIndex.load(index_dir), index_dir)
+    rows, kind = fingerprints.lookup(titles[7])
+    assert not {7, 500} & set(rows.tolist())
+
+
+def test_saved_table_is_rebuilt_after_an_append(tmp_path, titles):
+    index_dir = str(tmp_path / 'index')
+    TfidfIndex.from_texts(titles[:500]).save(index_dir)
+    params_path = os.path.join(index_dir, FINGERPRINT_DIR, 'params.json')
+    open_fingerprints(TfidfIndex.load(index_dir), index_dir)
+    with open(params_path) as f:
+        before = json.load(f)
+
+    new_text = 'zzzfreshzzz ' + titles[0]
+    append_rows(index_dir, [new_text])
+    fingerprints = open_fingerprints(TfidfIndex.load(index_dir), index_dir)
+    with open(params_path) as f:
+        after = json.load(f)
+    assert after != before
+    assert after['n_rows'] == 501 and after['updates'] == 1
+    rows, kind = fingerprints.lookup(new_text)
+    assert kind == 'exact' and 500 in rows.tolist()
+
+    # An unchanged index reuses the saved table
+    reopened = open_fingerprints(TfidfIndex.load(index_dir), index_dir)
+    assert isinstance(reopened.sorted_keys, np.memmap)
@@ -0,0 +1,133 @@
+"""Incremental updates: refit tolerance, tombstones, compaction and staleness"""
+
+import csv
+import os
+
+import numpy as np
+import pytest
+
+from backends import BACKENDS, make_backend
+from fingerprints import open_fingerprints, split_fast_path
+from incremental import append_rows, compact_index, delete_rows
+from search import batch_matches, top_matches
+from tfidf_index import TfidfIndex, build_index, load_or_build_index
+
+# Reweighting on load matches a refit up to floating point rounding (see README)
+REFIT_TOLERANCE = 1e-12
+
+
+def write_csv(path, titles):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title'])
+        writer.writerows([title] for title in titles)
+
+
+def known_titles(index, titles, n):
+    """Titles made only of terms in the vocabulary of index"""
+    known = [title for title in titles
+             if all(token in index.vocabulary for token in index.analyze(title))]
+    assert len(known) >= n
+    return known[:n]
+
+
+@pytest.mark.parametrize('hash_features', [None, 2**12])
+def test_append_then_reweight_matches_a_refit(tmp_path, titles, hash_features):
+    index_dir = str(tmp_path / 'index')
+    TfidfIndex.from_texts(titles[:1000], hash_features=hash_features).save(index_dir)
+    appended = titles[1000:1200]
+    if hash_features is None:
+        # A fitted vocabulary stays frozen: only rows of known terms match a refit
+        appended = known_titles(TfidfIndex.load(index_dir), titles[1000:3000], 50)
+    assert append_rows(index_dir, appended) == (1000, 0)
+
+    updated = TfidfIndex.load(index_dir)
+    refit = TfidfIndex.from_texts(titles[:1000] + appended, hash_features=hash_features)
+    assert len(updated) == len(refit) == 1000 + len(appended)
+    queries = [titles[0], titles[500], appended[0], appended[-1]]
+    for query in queries:
+        before = updated.similarities(updated.transform([query]))
+        after = refit.similarities(refit.transform([query]))
+        assert np.abs(before - after).max() <= REFIT_TOLERANCE
+
+    _, drift = compact_index(index_dir)
+    assert drift <= REFIT_TOLERANCE
+
+
+@pytest.fixture
+def deleted_index(tmp_path, titles):
+    """(index_dir, deleted rows) of an index with a few rows deleted after an append"""
+    index_dir = str(tmp_path / 'index')
+    TfidfIndex.from_texts(titles[:500]).save(index_dir)
+    append_rows(index_dir, titles[:5])
+    deleted = [3, 10, 42, 502]
+    assert delete_rows(index_dir, deleted) == 4
+    assert delete_rows(index_dir, [3]) == 0
+    return index_dir, deleted
+
+
+def test_deleted_rows_are_never_returned(deleted_index, titles):
+    index_dir, deleted = deleted_index
+    index = TfidfIndex.load(index_dir)
+    # Row 3 was deleted but its appended copy (row 503) is live
+    items = [titles[3], titles[10], titles[42], titles[2], titles[3].upper()]
+    item_vectors = index.transform(items)
+
+    for kind in BACKENDS:
+        backend = make_backend(index.matrix, kind, cache_dir=index_dir)
+        for item_idx in range(len(items)):
+            rows, scores = backend.score(item_vectors[item_idx])
+            rows, _ = top_matches(rows, scores, threshold=0.01)
+            assert not set(rows.tolist()) & set(deleted), kind
+
+    batch_rows = {row for _, row, _ in batch_matches(item_vectors, index.matrix, 0.01)}
+    assert batch_rows and not batch_rows & set(deleted)
+
+    fingerprints = open_fingerprints(index, index_dir)
+    fast_matches, remaining = split_fast_path(fingerprints, items, item_vectors, threshold=0.01)
+    fast_rows = {row for _, row, _ in fast_matches}
+    assert 503 in fast_rows and not fast_rows & set(deleted)
+    # titles[10] and titles[42] only had their deleted rows
+    assert fingerprints.score(titles[10], item_vectors[1]) is None
+    assert 1 in remaining and 2 in remaining
+
+
+def test_compaction_drops_tombstones_and_keeps_previous_rows(deleted_index, titles):
+    index_dir, deleted = deleted_index
+    compacted, _ = compact_index(index_dir)
+
+    live_rows = np.setdiff1d(np.arange(505), deleted)
+    assert compacted.deleted is None
+    assert not os.path.exists(os.path.join(index_dir, 'deleted.npy'))
+    assert len(compacted) == len(live_rows)
+    assert compacted.meta.get('compacted')
+    assert not compacted.meta.get('updates')
+    previous_rows = np.load(os.path.join(index_dir, 'previous_rows.npy'))
+    assert np.array_equal(previous_rows, live_rows)
+    texts = titles[:500] + titles[:5]
+    assert [compacted.texts[row] for row in range(len(compacted))] == \
+        [texts[row] for row in previous_rows]
+
+
+@pytest.mark.parametrize('update', ['append', 'delete', 'compact'])
+def test_stale_updated_index_is_not_rebuilt(tmp_path, titles, update):
+    corpus = str(tmp_path / 'corpus.csv')
+    index_dir = str(tmp_path / 'index')
+    write_csv(corpus, titles[:300])
+    build_index(corpus, 'title', index_dir=index_dir)
+    if update == 'append':
+        append_rows(index_dir, titles[300:310])
+    else:
+        delete_rows(index_dir, [0, 1])
+        if update == 'compact':
+            compact_index(index_dir)
+
+    index, reason = load_or_build_index(index_dir)
+    assert reason is None
+    n_rows = len(index)
+
+    write_csv(corpus, titles[:350])
+    with pytest.raises(ValueError, match='incremental updates'):
+        load_or_build_index(index_dir)
+    # The updated index is left as it was
+    assert len(TfidfIndex.load(index_dir)) == n_rows
@@ -0,0 +1,25 @@
+"""The chunked two-pass build writes the index from_texts().save() writes"""
+
+import pytest
+
+from ingest import build_index_streaming
+from tfidf_index import TfidfIndex
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'hash_features': 2**12},
+    {'char_ngrams': (3, 4), 'max_features': 2000},
+    {'precision': 'float32'},
+])
+def test_streaming_build_matches_from_texts(options, tmp_path, titles, corpus_csv,
+                                            assert_same_index):
+    expected_dir = str(tmp_path / 'from_texts')
+    TfidfIndex.from_texts(titles, **options).save(expected_dir)
+
+    streamed_dir = str(tmp_path / 'streamed')
+    # Several chunks, the last one partial
+    n_rows = build_index_streaming(corpus_csv, 'title', streamed_dir, chunk_rows=1100, **options)
+
+    assert n_rows == len(titles)
+    assert_same_index(expected_dir, streamed_dir)
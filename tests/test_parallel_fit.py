@@ -0,0 +1,27 @@
+"""The multi-process fit gives TfidfVectorizer's matrix, bit for bit"""
+
+import numpy as np
+import pytest
+
+import parallel_fit
+from tfidf_index import TfidfIndex
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+@pytest.mark.parametrize('options', [
+    {},
+    {'max_features': 300},
+    {'char_ngrams': (3, 4), 'max_features': 2000},
+])
+def test_parallel_fit_matches_vectorizer(n_jobs, options, titles, monkeypatch):
+    # Several shards per worker even on a small corpus
+    monkeypatch.setattr(parallel_fit, 'MIN_SHARD_ROWS', 400)
+    # n_jobs=1 fits with TfidfVectorizer itself
+    expected = TfidfIndex.from_texts(titles, **options)
+    fitted = parallel_fit.fit_tfidf_parallel(titles, n_jobs=n_jobs, **options)
+
+    assert list(fitted.feature_names) == list(expected.feature_names)
+    assert np.array_equal(fitted.idf, expected.idf)
+    assert np.array_equal(fitted.doc_freq, expected.doc_freq)
+    for name in ('data', 'indices', 'indptr'):
+        assert np.array_equal(getattr(fitted.matrix, name), getattr(expected.matrix, name)), name
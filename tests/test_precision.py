@@ -0,0 +1,68 @@
+"""Matrix precisions: quantization error, save/load parity and the ranking report"""
+
+import os
+
+import numpy as np
+import pytest
+
+from tfidf_index import PRECISIONS, TfidfIndex, dequantize_rows, precision_report, quantize_rows
+
+
+@pytest.fixture(scope='module')
+def index(titles):
+    return TfidfIndex.from_texts(titles[:1000])
+
+
+def test_quantize_rows_error_is_at_most_half_a_step(index):
+    matrix = index.matrix
+    codes, row_scale = quantize_rows(matrix.data, matrix.indptr)
+    assert codes.dtype == np.uint8 and row_scale.dtype == np.float32
+    values = dequantize_rows(codes, matrix.indptr, row_scale)
+    scale = np.repeat(row_scale.astype(np.float64), np.diff(matrix.indptr))
+    # Half a quantization step, plus float32 rounding of the scale and the product
+    tolerance = scale / 2 + 256 * scale * np.finfo(np.float32).eps
+    assert np.all(np.abs(values - matrix.data) <= tolerance)
+    row_max = np.maximum.reduceat(matrix.data, matrix.indptr[:-1])
+    assert np.allclose(row_scale * 255, row_max, rtol=1e-6)
+
+
+def test_quantize_rows_with_empty_rows():
+    indptr = np.array([0, 2, 2, 3])
+    codes, row_scale = quantize_rows(np.array([0.2, 1.0, 0.25]), indptr)
+    assert codes.tolist() == [51, 255, 255]
+    assert row_scale[1] == 0
+
+
+@pytest.mark.parametrize('precision', PRECISIONS)
+def test_saved_index_scores_like_the_fitted_one(tmp_path, titles, precision):
+    fitted = TfidfIndex.from_texts(titles[:1000], precision=precision)
+    index_dir = str(tmp_path / 'index')
+    fitted.save(index_dir)
+    loaded = TfidfIndex.load(index_dir)
+    assert loaded.precision == precision
+    assert np.load(os.path.join(index_dir, 'data.npy'), mmap_mode='r').dtype == \
+        {'float64': np.float64, 'float32': np.float32, 'uint8': np.uint8}[precision]
+    assert os.path.exists(os.path.join(index_dir, 'row_scale.npy')) == (precision == 'uint8')
+    for query in (titles[0], titles[7], 'unknown words only'):
+        before = fitted.similarities(fitted.transform([query]))
+        after = loaded.similarities(loaded.transform([query]))
+        if precision == 'float64':
+            assert np.array_equal(before, after)
+        else:
+            assert np.allclose(before, after, atol=1e-6)
+
+
+def test_float64_report_is_exact(index):
+    report = precision_report(index.matrix, 'float64', np.arange(0, 1000, 10))
+    assert report['max_score_error'] == 0.0
+    assert report['topk_overlap'] == 1.0
+    assert report['same_order_fraction'] == 1.0
+    assert report['threshold_recall'] == 1.0
+    assert report['stored_bytes'] == report['float64_bytes']
+
+
+def test_uint8_report_is_disk_only(index):
+    report = precision_report(index.matrix, 'uint8', np.arange(0, 1000, 10))
+    assert not report['memory_mapped']
+    assert report['stored_bytes'] < report['resident_bytes']
+    assert precision_report(index.matrix, 'float32', [0])['memory_mapped']
@@ -0,0 +1,82 @@
+"""Stage profiling: the --profile report and the no-op path without a profiler"""
+
+import argparse
+import json
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import cli_app
+from profiling import StageProfiler, profile_stage
+from tfidf_index import build_index
+
+DIRECT_STAGES = ['read_csv', 'fit', 'backend', 'transform', 'score', 'select',
+                 'interpretability', 'output']
+QUERY_STAGES = ['load_index', 'backend', 'transform', 'score', 'select', 'interpretability',
+                'output']
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def check_stages(report, names, memory):
+    assert [stage['stage'] for stage in report['stages']] == names
+    assert report['memory_tracked'] is memory
+    for stage in report['stages']:
+        assert stage['depth'] == 0
+        assert stage['seconds'] >= 0
+        if memory:
+            assert stage['peak_mb'] >= 0
+            assert stage['peak_mb'] >= stage['retained_mb']
+        else:
+            assert stage['peak_mb'] is None
+    assert report['total_s'] >= sum(stage['seconds'] for stage in report['stages'])
+
+
+def test_profile_json_reports_every_stage(tmp_path, corpus_csv, titles):
+    output = str(tmp_path / 'profile.json')
+    cli_app.main([corpus_csv, 'title', titles[5], '--profile', 'json', '--profile-memory',
+                  '--profile-output', output])
+    report = read_report(output)
+    check_stages(report, DIRECT_STAGES, memory=True)
+    stages = {stage['stage']: stage for stage in report['stages']}
+    # Fitting holds the vocabulary and the matrix; formatting the output holds next to nothing
+    assert stages['fit']['peak_mb'] > stages['output']['peak_mb']
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_json_of_a_saved_index_query(tmp_path, corpus_csv, titles, capsys):
+    index_dir = str(tmp_path / 'index')
+    build_index(corpus_csv, 'title', index_dir=index_dir)
+    capsys.readouterr()
+    cli_app.main(['query', index_dir, titles[5], '--profile', 'json'])
+    # Without --profile-output the report goes to stderr, after the query's own output
+    report = json.loads(capsys.readouterr().err)
+    check_stages(report, QUERY_STAGES, memory=False)
+
+
+def test_profile_stage_without_a_profiler_is_a_no_op():
+    with profile_stage(None, 'score') as record:
+        values = np.arange(1000).sum()
+    assert record is None
+    assert values == 499500
+    assert not tracemalloc.is_tracing()
+
+    args = argparse.Namespace(profile=None, profile_memory=False, profile_dump=None)
+    assert cli_app.open_profiler(args) is None
+
+
+def test_nested_stage_peaks_count_towards_the_outer_stage():
+    with StageProfiler(memory=True) as profiler:
+        with profile_stage(profiler, 'outer'):
+            with profile_stage(profiler, 'inner'):
+                block = np.ones(2**20)  # 8 MB
+                del block
+    outer, inner = profiler.report()['stages']
+    assert (outer['depth'], inner['depth']) == (0, 1)
+    assert inner['peak_mb'] == pytest.approx(8, abs=0.5)
+    assert outer['peak_mb'] >= inner['peak_mb']
+    assert inner['retained_mb'] < 0.5
@@ -0,0 +1,179 @@
+"""Result cache keys: what must share an entry and what must not"""
+
+import csv
+import json
+import os
+
+import pytest
+
+import cli_app
+import result_cache
+from incremental import compact_index, delete_rows
+from result_cache import CACHE_FILE, ResultCache, cache_log_path, index_version, result_key
+from tfidf_index import TfidfIndex, build_index, load_or_build_index, read_meta
+
+
+@pytest.fixture(scope='module')
+def index(titles):
+    return TfidfIndex.from_texts(titles)
+
+
+def test_equivalent_items_share_a_key(index, titles):
+    words = titles[0].split()
+    variant = ' '.join(reversed(words)).upper() + ', the zzzunknownzzz'
+    assert result_key(index, variant, 'query', 0.7) == result_key(index, titles[0], 'query', 0.7)
+
+
+def test_options_are_part_of_the_key(index, titles):
+    keys = {
+        result_key(index, titles[0], 'query', 0.7, 5, False),
+        result_key(index, titles[0], 'query', 0.8, 5, False),
+        result_key(index, titles[0], 'query', 0.7, None, False),
+        result_key(index, titles[0], 'query', 0.7, 5, True),
+        result_key(index, titles[0], 'batch', 0.7, 5, False),
+    }
+    assert len(keys) == 5
+
+
+def test_fast_path_keys_keep_unknown_tokens(index, titles):
+    unknown = titles[0] + ' zzzunknownzzz'
+    assert result_key(index, unknown, all_tokens=True) != result_key(index, titles[0], all_tokens=True)
+    assert result_key(index, titles[0].upper(), all_tokens=True) == \
+        result_key(index, titles[0], all_tokens=True)
+
+
+def test_entries_of_other_versions_are_never_returned():
+    cache = ResultCache()
+    cache.put('v1', 'key', [1, 2])
+    assert cache.get('v2', 'key') is None
+    assert cache.get('v1', 'key') == [1, 2]
+    assert cache.drop_stale('v2') == 1
+
+
+def run_batch(index_dir, input_file, output_file, *options):
+    cli_app.main(['batch', index_dir, '--input', input_file, '--output', output_file,
+                  '--threshold', '0.5', '--cache', *options])
+    with open(output_file, newline='') as f:
+        return [(row['match_index'], row['score']) for row in csv.DictReader(f)]
+
+
+def test_fast_path_results_are_not_served_to_full_scans(tmp_path, titles):
+    corpus = str(tmp_path / 'corpus.csv')
+    with open(corpus, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title'])
+        writer.writerows([['alpha beta gamma delta'], ['alpha beta gamma delta epsilon']])
+        writer.writerows([title] for title in titles[:500])
+    index_dir = str(tmp_path / 'index')
+    build_index(corpus, 'title', index_dir=index_dir)
+    candidates = str(tmp_path / 'candidates.txt')
+    with open(candidates, 'w') as f:
+        f.write('alpha beta gamma delta\n')
+
+    # The fast path answers from the exact duplicate alone
+    fast = run_batch(index_dir, candidates, str(tmp_path / 'fast.csv'), '--fast-path')
+    full = run_batch(index_dir, candidates, str(tmp_path / 'full.csv'))
+
+    assert [row for row, _ in fast] == ['0']
+    assert [row for row, _ in full] == ['0', '1']
+
+
+@pytest.fixture
+def built_index(tmp_path, corpus_csv):
+    """(csv_file, index_dir) of a fresh index over a private copy of the corpus"""
+    csv_file = str(tmp_path / 'corpus.csv')
+    with open(corpus_csv, 'rb') as src, open(csv_file, 'wb') as dst:
+        dst.write(src.read())
+    index_dir = str(tmp_path / 'index')
+    build_index(csv_file, 'title', index_dir=index_dir)
+    return csv_file, index_dir
+
+
+def test_touching_the_source_keeps_the_version(built_index):
+    csv_file, index_dir = built_index
+    index, _ = load_or_build_index(index_dir)
+    version = index_version(index)
+    stat = os.stat(csv_file)
+    os.utime(csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    touched, reason = load_or_build_index(index_dir)
+    assert reason is None
+    # The new mtime was recorded, but the version only follows the rows
+    assert read_meta(index_dir)['source']['mtime_ns'] == stat.st_mtime_ns + 10**9
+    assert index_version(touched) == version
+
+
+def test_every_build_update_and_compaction_changes_the_version(built_index):
+    csv_file, index_dir = built_index
+    versions = [index_version(TfidfIndex.load(index_dir))]
+    # Rebuilt from the same CSV: same metadata apart from the revision
+    build_index(csv_file, 'title', index_dir=index_dir)
+    versions.append(index_version(TfidfIndex.load(index_dir)))
+    delete_rows(index_dir, [0])
+    versions.append(index_version(TfidfIndex.load(index_dir)))
+    compact_index(index_dir)
+    versions.append(index_version(TfidfIndex.load(index_dir)))
+    assert len(set(versions)) == 4
+    assert read_meta(index_dir)['revision'] == 4
+
+
+def run_query(index_dir, item, capsys):
+    cli_app.main(['query', index_dir, item, '--threshold', '0.5', '--cache'])
+    return capsys.readouterr().out
+
+
+def test_query_appends_to_the_log_instead_of_rewriting_the_cache(built_index, titles, capsys):
+    _, index_dir = built_index
+    path = os.path.join(index_dir, CACHE_FILE)
+    output = run_query(index_dir, titles[3], capsys)
+    assert 'Result cache hit' not in output
+    assert not os.path.exists(path)
+    with open(cache_log_path(path)) as f:
+        assert [json.loads(line)[0] for line in f] == ['get', 'put']
+
+    assert 'Result cache hit' in run_query(index_dir, titles[3].upper(), capsys)
+    assert not os.path.exists(path)
+
+    # A batch run rewrites the cache file with everything the log held
+    candidates = os.path.join(index_dir, '..', 'candidates.txt')
+    with open(candidates, 'w') as f:
+        f.write(titles[4] + '\n')
+    cli_app.main(['batch', index_dir, '--input', candidates, '--output',
+                  os.path.join(index_dir, '..', 'matches.csv'), '--cache'])
+    assert os.path.exists(path) and not os.path.exists(cache_log_path(path))
+    cache = ResultCache.load(path)
+    assert len(cache.entries) == 2
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+    assert 'Result cache hit' in run_query(index_dir, titles[3], capsys)
+
+
+def test_a_long_log_is_folded_into_the_cache_file(tmp_path, monkeypatch):
+    path = str(tmp_path / CACHE_FILE)
+    cache = ResultCache.load(path)
+    cache.put('v1', 'a', [1])
+    cache.save_changes(path)
+    assert not os.path.exists(path)
+
+    monkeypatch.setattr(result_cache, 'MAX_LOG_BYTES', 0)
+    cache = ResultCache.load(path)
+    assert cache.get('v1', 'a') == [1]
+    cache.put('v1', 'b', [2])
+    cache.save_changes(path)
+    assert os.path.exists(path) and not os.path.exists(cache_log_path(path))
+    cache = ResultCache.load(path)
+    assert (cache.get('v1', 'a'), cache.get('v1', 'b')) == ([1], [2])
+
+
+def test_a_cut_short_log_line_is_skipped(tmp_path):
+    path = str(tmp_path / CACHE_FILE)
+    cache = ResultCache.load(path)
+    cache.put('v1', 'a', [1])
+    cache.save_changes(path)
+    with open(cache_log_path(path), 'a') as f:
+        f.write('["put","v1","b",[')
+    cache = ResultCache.load(path, version='v1')
+    assert cache.get('v1', 'a') == [1]
+    assert len(cache.entries) == 1
+    # Entries logged for another index version are invalidated like saved ones
+    assert ResultCache.load(path, version='v2').stats()['invalidations'] == 1
@@ -0,0 +1,159 @@
+"""Scoring helpers of search.py checked against brute-force references"""
+
+import numpy as np
+import pytest
+
+from search import (
+    DEDUPE_PIECES,
+    HISTOGRAM_BINS,
+    dedupe_pairs,
+    duplicate_clusters,
+    similarity_histogram,
+    top_matches,
+)
+from tfidf_index import TfidfIndex
+
+N_ROWS = 600
+THRESHOLD = 0.5
+# Rows of one transposed piece; blocks straddling a piece boundary are the edge cases
+PIECE_ROWS = -(-N_ROWS // DEDUPE_PIECES)
+
+
+@pytest.fixture(scope='module')
+def matrix(titles):
+    return TfidfIndex.from_texts(titles[:N_ROWS]).matrix
+
+
+@pytest.fixture(scope='module')
+def brute_force_pairs(matrix):
+    """(rows, cols, scores) of the full X @ X.T above the threshold, upper triangle"""
+    similarities = np.triu((matrix @ matrix.T).toarray(), k=1)
+    rows, cols = np.nonzero(similarities >= THRESHOLD)
+    return rows, cols, similarities[rows, cols]
+
+
+def connected_components(n_rows, rows, cols):
+    """Clusters of the pair graph found by a plain depth-first search"""
+    neighbours = [[] for _ in range(n_rows)]
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        neighbours[row].append(col)
+        neighbours[col].append(row)
+    seen, clusters = set(), []
+    for start in range(n_rows):
+        if start in seen or not neighbours[start]:
+            continue
+        stack, cluster = [start], []
+        seen.add(start)
+        while stack:
+            node = stack.pop()
+            cluster.append(node)
+            for other in neighbours[node]:
+                if other not in seen:
+                    seen.add(other)
+                    stack.append(other)
+        clusters.append(sorted(cluster))
+    return sorted(clusters, key=lambda c: (-len(c), c[0]))
+
+
+@pytest.mark.parametrize('block_size', [1, 7, PIECE_ROWS - 1, PIECE_ROWS, PIECE_ROWS + 1, 250,
+                                        N_ROWS])
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_dedupe_pairs_match_the_full_product(matrix, brute_force_pairs, block_size, n_jobs):
+    rows, cols, scores = dedupe_pairs(matrix, THRESHOLD, block_size=block_size, n_jobs=n_jobs)
+    expected_rows, expected_cols, expected_scores = brute_force_pairs
+    assert len(expected_rows) > 0
+    assert np.array_equal(rows, expected_rows)
+    assert np.array_equal(cols, expected_cols)
+    assert np.allclose(scores, expected_scores)
+
+
+def test_dedupe_pairs_from_a_saved_index(tmp_path, titles, brute_force_pairs):
+    index_dir = str(tmp_path / 'index')
+    TfidfIndex.from_texts(titles[:N_ROWS]).save(index_dir)
+    matrix = TfidfIndex.load(index_dir).matrix
+    rows, cols, _ = dedupe_pairs(matrix, THRESHOLD, block_size=PIECE_ROWS + 1, n_jobs=2,
+                                 index_dir=index_dir)
+    assert np.array_equal(rows, brute_force_pairs[0])
+    assert np.array_equal(cols, brute_force_pairs[1])
+
+
+def test_clusters_are_the_connected_components(brute_force_pairs):
+    rows, cols, _ = brute_force_pairs
+    clusters = duplicate_clusters(N_ROWS, rows, cols)
+    assert clusters == connected_components(N_ROWS, rows, cols)
+    assert any(len(cluster) > 2 for cluster in clusters)
+
+
+def test_clusters_of_no_pairs():
+    empty = np.array([], dtype=np.int64)
+    assert duplicate_clusters(10, empty, empty) == []
+
+
+def sorted_matches(rows, scores, threshold, top_k):
+    """Reference for top_matches: a full stable sort by descending score, then row"""
+    positions = np.flatnonzero(scores >= threshold)
+    positions = positions[np.argsort(-scores[positions], kind='stable')][:top_k]
+    return rows[positions], scores[positions]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('threshold', [0.0, 0.5, 0.95])
+@pytest.mark.parametrize('top_k', [None, 0, 1, 2, 5, 17, 100, 10_000])
+def test_top_matches_equal_a_full_sort(seed, threshold, top_k):
+    rng = np.random.RandomState(seed)
+    n_rows = 1000
+    rows = np.sort(rng.choice(5 * n_rows, size=n_rows, replace=False))
+    # Few distinct scores, so the k-th score is usually shared by several rows
+    scores = np.round(rng.rand(n_rows), 1)
+    found_rows, found_scores = top_matches(rows, scores, threshold, top_k)
+    expected_rows, expected_scores = sorted_matches(rows, scores, threshold, top_k)
+    assert np.array_equal(found_rows, expected_rows)
+    assert np.array_equal(found_scores, expected_scores)
+
+
+def test_top_matches_ties_at_the_kth_score_keep_row_order():
+    rows = np.arange(8)
+    scores = np.array([0.5, 0.9, 0.7, 0.9, 0.7, 0.7, 0.2, 0.7])
+    found_rows, found_scores = top_matches(rows, scores, 0.0, 4)
+    assert found_rows.tolist() == [1, 3, 2, 4]
+    assert found_scores.tolist() == [0.9, 0.9, 0.7, 0.7]
+
+
+def test_top_k_beyond_the_rows_above_the_threshold():
+    rows = np.arange(6)
+    scores = np.array([0.1, 0.8, 0.75, 0.3, 0.8, 0.2])
+    # top_k is below the number of scores but above the number of rows passing
+    found_rows, _ = top_matches(rows, scores, 0.7, 5)
+    assert found_rows.tolist() == [1, 4, 2]
+    assert top_matches(rows, scores, 0.7, None)[0].tolist() == [1, 4, 2]
+    assert len(top_matches(rows, scores, 0.9, 3)[0]) == 0
+
+
+def test_similarity_histogram_matches_the_full_array(matrix):
+    # The scores the Streamlit app bins: one item against every row
+    scores = np.asarray(matrix @ matrix[3].toarray()[0]).ravel()
+    summary = similarity_histogram(scores)
+    counts, edges = np.histogram(scores, bins=HISTOGRAM_BINS, range=(0.0, 1.0))
+    assert HISTOGRAM_BINS == 50
+    assert summary['counts'] == counts.tolist()
+    assert np.allclose(summary['edges'], edges)
+    assert summary['n'] == sum(summary['counts']) == N_ROWS
+    assert summary['mean'] == pytest.approx(scores.mean())
+    assert summary['std'] == pytest.approx(scores.std())
+    assert (summary['min'], summary['max']) == (scores.min(), scores.max())
+
+
+def test_similarity_histogram_keeps_rounded_ones_in_the_last_bin():
+    scores = np.array([0.0, 0.01, 0.5, 1.0, 1.0 + 1e-12])
+    summary = similarity_histogram(scores)
+    assert summary['counts'][0] == 2
+    assert summary['counts'][25] == 1
+    assert summary['counts'][-1] == 2
+    assert summary['max'] == 1.0 + 1e-12
+
+
+def test_similarity_histogram_of_no_scores():
+    summary = similarity_histogram(np.array([]))
+    assert summary['n'] == 0 and sum(summary['counts']) == 0
+    assert len(summary['counts']) == HISTOGRAM_BINS
+    assert summary['mean'] is None and summary['max'] is None
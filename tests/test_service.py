@@ -0,0 +1,154 @@
+"""HTTP service: endpoints, request errors and swapping in a rebuilt index"""
+
+import csv
+import http.client
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import service
+from result_cache import ResultCache
+from tfidf_index import build_index
+
+
+def write_csv(path, titles):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title'])
+        writer.writerows([title] for title in titles)
+
+
+@pytest.fixture(scope='module')
+def index_dirs(tmp_path_factory, titles):
+    """Two saved indexes over different rows: the one served and its replacement"""
+    base = tmp_path_factory.mktemp('service')
+    dirs = []
+    for name, rows in (('old', titles[:500]), ('new', titles[500:1000])):
+        write_csv(str(base / f'{name}.csv'), rows)
+        build_index(str(base / f'{name}.csv'), 'title', index_dir=str(base / name))
+        dirs.append(str(base / name))
+    return dirs
+
+
+@pytest.fixture
+def holder(index_dirs):
+    return service.IndexHolder(index_dirs[0], result_cache=ResultCache())
+
+
+@pytest.fixture
+def server(holder):
+    """(host, port) of a running service"""
+    handler = service.make_handler(service.DuplicateService(holder))
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd.server_address
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(server, path, body):
+    connection = http.client.HTTPConnection(*server, timeout=30)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    connection.request('POST', path, data, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def get(server, path):
+    connection = http.client.HTTPConnection(*server, timeout=30)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def test_check_finds_the_indexed_row(server, titles):
+    status, result = post(server, '/check', {'item': titles[3], 'threshold': 0.9, 'top_k': 5})
+    assert status == 200
+    assert result['is_duplicate']
+    assert result['duplicates'][0]['index'] == 3
+    assert result['duplicates'][0]['item'] == titles[3]
+    assert result['duplicates'][0]['similarity'] == pytest.approx(1.0)
+    assert result['n_above_threshold'] >= len(result['duplicates']) >= 1
+    assert result['index_version'] == 1
+
+
+def test_check_batch_matches_check(server, titles):
+    items = [titles[3], titles[42], 'zzzunknownzzz']
+    status, batch = post(server, '/check_batch', {'items': items, 'threshold': 0.5, 'top_k': 3})
+    assert status == 200
+    assert [result['item'] for result in batch['results']] == items
+    for item, result in zip(items, batch['results']):
+        _, single = post(server, '/check', {'item': item, 'threshold': 0.5, 'top_k': 3})
+        assert [match['index'] for match in result['duplicates']] == \
+            [match['index'] for match in single['duplicates']]
+        assert [match['similarity'] for match in result['duplicates']] == \
+            pytest.approx([match['similarity'] for match in single['duplicates']])
+    assert not batch['results'][2]['is_duplicate']
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/check', {'threshold': 0.7}),
+    ('/check', {'item': 42}),
+    ('/check', {'item': 'phone', 'threshold': 'high'}),
+    ('/check_batch', {'items': 'not a list'}),
+    ('/check_batch', {'items': ['phone', None]}),
+    ('/check', b'{not json'),
+])
+def test_bad_requests_are_rejected_with_400(server, path, body):
+    status, result = post(server, path, body)
+    assert status == 400
+    assert 'error' in result
+    _, stats = get(server, '/stats')
+    assert stats['errors'] == 1
+
+
+def test_swap_serves_the_old_index_until_the_new_one_is_loaded(monkeypatch, holder, index_dirs,
+                                                              titles):
+    duplicate_service = service.DuplicateService(holder)
+    payload = {'item': titles[3], 'threshold': 0.9}
+    before = duplicate_service.check(payload)
+    assert holder.result_cache.stats()['entries'] == 1
+
+    loading, release = threading.Event(), threading.Event()
+    load = service.load_or_build_index
+
+    def slow_load(index_dir):
+        loading.set()
+        assert release.wait(30)
+        return load(index_dir)
+
+    monkeypatch.setattr(service, 'load_or_build_index', slow_load)
+    assert holder.reload_async(index_dirs[1])
+    assert loading.wait(30)
+    assert not holder.reload_async(index_dirs[1])
+
+    # While the new index loads, requests are answered by the old one
+    during = duplicate_service.check(payload)
+    assert during == before
+    assert during['index_version'] == 1
+    assert holder.result_cache.stats()['hits'] == 1
+
+    release.set()
+    deadline = time.time() + 30
+    while holder.reloading and time.time() < deadline:
+        time.sleep(0.01)
+    assert not holder.reloading
+    assert holder.last_error is None
+
+    after = duplicate_service.check(payload)
+    assert after['index_version'] == 2
+    assert holder.index_dir == index_dirs[1]
+    assert len(holder.snapshot[0]) == 500
+    assert all(match['item'] == titles[500 + match['index']] for match in after['duplicates'])
+    cache_stats = holder.result_cache.stats()
+    assert cache_stats['invalidations'] == 1
+    assert cache_stats['entries'] == 1
@@ -0,0 +1,47 @@
+"""A sharded index answers exactly like the index it was split from"""
+
+import numpy as np
+import pytest
+
+from search import batch_matches, top_matches
+from shards import ShardedIndex, split_index
+from tfidf_index import TfidfIndex, build_index
+
+
+@pytest.fixture(scope='module')
+def indexes(tmp_path_factory, corpus_csv):
+    root = tmp_path_factory.mktemp('shards')
+    index_dir, sharded_dir = str(root / 'index'), str(root / 'sharded')
+    build_index(corpus_csv, 'title', index_dir=index_dir)
+    split_index(index_dir, sharded_dir, 3)
+    return TfidfIndex.load(index_dir), ShardedIndex.load(sharded_dir, n_jobs=3)
+
+
+@pytest.fixture(scope='module')
+def queries(titles):
+    # Titles with near-duplicates in the corpus, and a few unrelated ones
+    return titles[::97] + ['nothing like the corpus', titles[5].upper()]
+
+
+@pytest.mark.parametrize('top_k', [None, 1, 5])
+def test_sharded_query_matches_unsharded(indexes, queries, top_k):
+    index, sharded = indexes
+    for item in queries:
+        vector = index.dense_vector(item)
+        similarities = np.asarray(index.matrix @ vector).ravel()
+        expected_rows, expected_scores = top_matches(np.arange(len(index)), similarities, 0.3, top_k)
+
+        rows, scores, stats = sharded.query(sharded.dense_vector(item), 0.3, top_k)
+
+        assert rows.tolist() == expected_rows.tolist()
+        assert scores.tolist() == expected_scores.tolist()
+        assert stats['n_above'] == int(np.count_nonzero(similarities >= 0.3))
+
+
+@pytest.mark.parametrize('top_k', [None, 3])
+def test_sharded_search_matches_unsharded(indexes, queries, top_k):
+    index, sharded = indexes
+    item_vectors = index.transform(queries)
+    expected = list(batch_matches(item_vectors, index.matrix, 0.3, top_k=top_k))
+
+    assert list(sharded.search(sharded.transform(queries), 0.3, top_k=top_k)) == expected
@@ -0,0 +1,53 @@
+"""Cold start of the CLI: no heavy imports, import time within the budget"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import CLI_SCRIPT, DEFAULT_IMPORT_BUDGET_MS, HEAVY_PACKAGES, cli_startup
+from tfidf_index import build_index
+
+# Runs the CLI as __main__ and prints the heavy packages left in sys.modules
+RUN_CLI = """
+import json, os, runpy, sys
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+heavy = {name.split('.')[0] for name in sys.modules} & set(json.loads(HEAVY))
+print(json.dumps(sorted(heavy)))
+"""
+
+
+@pytest.fixture(scope='module')
+def index_dir(tmp_path_factory, corpus_csv):
+    path = str(tmp_path_factory.mktemp('startup') / 'index')
+    build_index(corpus_csv, 'title', index_dir=path)
+    return path
+
+
+def cli_commands(index_dir, titles):
+    return {
+        'help': ['--help'],
+        'query': ['query', index_dir, titles[0], '--top-k', '5'],
+    }
+
+
+@pytest.mark.parametrize('command', ['help', 'query'])
+def test_no_heavy_imports(command, index_dir, titles):
+    script = RUN_CLI.replace('HEAVY', repr(json.dumps(HEAVY_PACKAGES)))
+    args = cli_commands(index_dir, titles)[command]
+    proc = subprocess.run([sys.executable, '-c', script, CLI_SCRIPT, *args],
+                          capture_output=True, text=True, check=True)
+    assert json.loads(proc.stdout.splitlines()[-1]) == []
+
+
+@pytest.mark.parametrize('command', ['help', 'query'])
+def test_import_time_within_budget(command, index_dir, titles):
+    stats = cli_startup(cli_commands(index_dir, titles)[command], repeats=3)
+    assert stats['heavy_imports'] == []
+    assert stats['import_ms'] <= DEFAULT_IMPORT_BUDGET_MS
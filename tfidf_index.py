@@ -0,0 +1,1330 @@
+"""
+Persisted TF-IDF index for Duplicate Finder
+
+An index directory holds everything needed to answer a query without
+refitting the vectorizer:
+
+    meta.json         format version, source CSV fingerprint, column,
+                      max_features, precision of the stored values and a
+                      revision counter bumped by every build, update and
+                      compaction written to the directory
+    vocabulary.json   feature names, ordered by column of the TF-IDF matrix
+                      (empty for a hashed feature space)
+    stop_words.json   stop words applied by the fitted vectorizer
+                      (none with character n-grams)
+    idf.npy           idf weights the stored matrix rows were computed with
+    doc_freq.npy      current document frequency of every column
+    deleted.npy       tombstones of deleted rows (only after incremental updates)
+    data.npy          \\
+    indices.npy        > L2-normalised TF-IDF matrix as raw CSR arrays
+    indptr.npy        /
+    row_scale.npy     per-row scale of uint8 values (only with precision uint8)
+    texts.bin         UTF-8 text of every row, concatenated
+    text_offsets.npy  byte offsets of each row inside texts.bin
+
+All arrays are plain .npy files, so loading memory-maps them instead of
+reading the whole matrix into RAM. indptr and text_offsets are stored as
+int32/uint32 whenever they fit.
+
+Loading needs numpy only: the scipy matrix is built from the mapped arrays
+the first time a sparse code path uses TfidfIndex.matrix, and a single
+query can be answered without it (dense_vector and dense_similarities).
+scipy, pandas and scikit-learn are imported inside the functions that use
+them, so the CLI starts without them.
+
+The precision of the matrix values is chosen at build time:
+
+    float64   what TfidfVectorizer produces (default)
+    float32   half the value bytes, still memory-mapped
+    uint8     each value quantized to 1/255 of its row maximum and stored
+              with a float32 scale per row (and uint16 column indices when
+              the vocabulary allows); a disk format only: loading dequantizes
+              it into a float32 copy that is not memory-mapped
+
+precision_report() measures how much rankings change against float64.
+
+Incremental updates (see incremental.py) append rows weighted with the
+stored idf and only adjust doc_freq. When an updated index is loaded, the
+matrix is reweighted once to the current idf, which gives exactly the rows
+a refit with the same vocabulary would produce.
+
+Rows are tokenised into words by default. An index built with char_ngrams
+(min_n, max_n) uses the character n-grams of every word instead, like
+TfidfVectorizer(analyzer='char_wb'), so misspelt and run-together variants
+("iphn 13pro" vs "iPhone 13 Pro") still share most of their features.
+
+An index can also cover several columns ("fields") of the same rows, each
+with its own vocabulary, idf and weight (see TfidfIndex.from_fields). Every
+field block is L2-normalised on its own and scaled by sqrt(weight / total
+weight), on the rows and on the queries alike, and the blocks are stacked
+horizontally into one matrix. The dot product of two stacked vectors is
+then the weight-averaged cosine similarity of their fields, so a query is
+still one sparse product over one matrix. Vocabulary terms are stored as
+'column:term'.
+
+Besides CSV, the source can be a Parquet or Arrow IPC / Feather file
+(chosen by extension, see input_format; needs pyarrow). Only the text
+column is read, from a memory map, and its UTF-8 buffer becomes the
+TextStore the vectorizer iterates and the index saves, with no Python
+list of strings in between.
+"""
+
+import functools
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import shutil
+import zlib
+
+import numpy as np
+
+INDEX_FORMAT_VERSION = 2
+
+# Same tokenisation as TfidfVectorizer's default token_pattern
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Whitespace runs collapsed by TfidfVectorizer(analyzer='char_wb')
+WHITE_SPACES = re.compile(r"\s\s+")
+
+META_FILE = 'meta.json'
+
+PRECISIONS = ('float64', 'float32', 'uint8')
+
+# Columnar inputs, read with pyarrow (an optional dependency); any other
+# file is read as CSV
+INPUT_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet',
+                 '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+# dtype of the matrix values once an index is in memory
+MATRIX_DTYPES = {'float64': np.float64, 'float32': np.float32, 'uint8': np.float32}
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path):
+    """Describe a source file so a stale index can be detected later"""
+    stat = os.stat(path)
+    return {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(path),
+    }
+
+
+def analyze(text, stop_words):
+    """Tokenise text exactly like TfidfVectorizer(stop_words=...) does"""
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if token not in stop_words]
+
+
+def char_wb_ngrams(text, ngram_range):
+    """Character n-grams of text exactly like TfidfVectorizer(analyzer='char_wb') does"""
+    min_n, max_n = ngram_range
+    ngrams = []
+    for word in WHITE_SPACES.sub(' ', text.lower()).split():
+        word = f' {word} '
+        for n in range(min_n, max_n + 1):
+            offset = 0
+            ngrams.append(word[offset:offset + n])
+            while offset + n < len(word):
+                offset += 1
+                ngrams.append(word[offset:offset + n])
+            # A word shorter than n is counted once
+            if offset == 0:
+                break
+    return ngrams
+
+
+def make_analyzer(stop_words, char_ngrams=None):
+    """
+    Tokeniser of an index: words minus stop words, or the character n-grams
+    of every word when char_ngrams is a (min_n, max_n) pair. The result can
+    be pickled, for worker processes.
+    """
+    if char_ngrams:
+        return functools.partial(char_wb_ngrams, ngram_range=tuple(char_ngrams))
+    return functools.partial(analyze, stop_words=frozenset(stop_words))
+
+
+def parse_char_ngrams(value):
+    """Parse 'N' or 'MIN-MAX' into a (min_n, max_n) pair"""
+    low, _, high = value.partition('-')
+    min_n, max_n = int(low), int(high or low)
+    if not 1 <= min_n <= max_n:
+        raise ValueError(f"Invalid n-gram range '{value}'")
+    return min_n, max_n
+
+
+class HashedFeatures:
+    """
+    Fixed feature space that maps each token to crc32(token) % n_features
+
+    Stands in for the vocabulary dict (get/len) and the feature names
+    (indexing) when an index uses hashing instead of a fitted vocabulary,
+    so new terms never require recomputing existing vectors.
+    """
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+
+    def get(self, token, default=None):
+        return zlib.crc32(token.encode('utf-8')) % self.n_features
+
+    def __len__(self):
+        return self.n_features
+
+    def __getitem__(self, col):
+        return f"#{col}"
+
+
+def smooth_idf(doc_freq, n_docs):
+    """TfidfVectorizer's default idf: ln((1 + n) / (1 + df)) + 1"""
+    df = np.asarray(doc_freq, dtype=np.float64)
+    return np.log((1 + n_docs) / (1 + df)) + 1
+
+
+def sequential_row_norms(data, indptr):
+    """
+    L2 norm of every CSR row, summing squares left to right like
+    sklearn.preprocessing.normalize (numpy's pairwise sum would round
+    long rows differently)
+    """
+    n_rows = len(indptr) - 1
+    lengths = np.diff(indptr)
+    sums = np.zeros(n_rows, dtype=np.float64)
+    for position in range(int(lengths.max()) if n_rows else 0):
+        rows = np.nonzero(lengths > position)[0]
+        values = data[indptr[rows] + position]
+        sums[rows] += values * values
+    return np.sqrt(sums)
+
+
+def document_frequency(matrix):
+    """Number of rows in which each column is non-zero"""
+    return np.bincount(matrix.indices, minlength=matrix.shape[1]).astype(np.int64)
+
+
+def parse_field(value):
+    """Parse 'column' or 'column:weight' into (column, weight)"""
+    column, sep, weight = value.rpartition(':')
+    if sep:
+        try:
+            return column, float(weight)
+        except ValueError:
+            pass
+    return value, 1.0
+
+
+def column_fields(column_name):
+    """
+    (column, weight) pairs of a column spec: a column name, or a list of
+    (column, weight) pairs
+    """
+    if isinstance(column_name, str):
+        return [(column_name, 1.0)]
+    fields = [(column, float(weight)) for column, weight in column_name]
+    if not fields:
+        raise ValueError("At least one column is needed")
+    if len({column for column, _ in fields}) != len(fields):
+        raise ValueError("Each column can only be given once")
+    if any(weight <= 0 for _, weight in fields):
+        raise ValueError("Column weights must be positive")
+    return fields
+
+
+def field_spec(column_name):
+    """
+    Canonical, JSON-friendly form of a column spec as stored in meta.json:
+    the column name for one column, [[column, weight], ...] for several
+    """
+    fields = column_fields(column_name)
+    if len(fields) == 1:
+        return fields[0][0]
+    return [[column, weight] for column, weight in fields]
+
+
+def format_fields(column_name):
+    """Human-readable column spec, e.g. 'title:2, brand:1'"""
+    fields = column_fields(column_name)
+    if len(fields) == 1:
+        return fields[0][0]
+    return ', '.join(f"{column}:{weight:g}" for column, weight in fields)
+
+
+def join_fields(values):
+    """Display text of a row of several fields"""
+    return ' | '.join(value for value in values if value)
+
+
+def input_format(path):
+    """'parquet', 'arrow' (Arrow IPC / Feather) or 'csv', from a file name's extension"""
+    return INPUT_FORMATS.get(os.path.splitext(str(path))[1].lower(), 'csv')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Reading Parquet and Arrow files needs pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def _arrow_source(source):
+    """A path as is, in-memory file contents (e.g. an upload) as a pyarrow buffer reader"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _import_pyarrow().BufferReader(source)
+    return source
+
+
+def table_columns(source, fmt=None):
+    """
+    Column names of a CSV, Parquet or Arrow file (a path, or its contents
+    as bytes), reading only its header or schema
+    """
+    fmt = fmt or input_format(source)
+    if fmt == 'parquet':
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(_arrow_source(source)).names
+    if fmt == 'arrow':
+        pa = _import_pyarrow()
+        import pyarrow.ipc
+
+        source = pa.memory_map(source) if isinstance(source, str) else _arrow_source(source)
+        return pyarrow.ipc.open_file(source).schema.names
+    import pandas as pd
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return pd.read_csv(source, nrows=0).columns.tolist()
+
+
+def check_column(csv_file, column_name, fmt=None):
+    """
+    Make sure a CSV, Parquet or Arrow file has the column, reading only its
+    header or schema
+
+    Raises:
+        ValueError: If the column does not exist
+    """
+    columns = table_columns(csv_file, fmt)
+    if column_name not in columns:
+        raise ValueError(
+            f"Column '{column_name}' not found in dataset. "
+            f"Available columns: {', '.join(map(str, columns))}"
+        )
+
+
+def read_arrow_table(source, columns, fmt):
+    """
+    Only the given columns of a Parquet or Arrow file, as a pyarrow Table
+
+    Arrow IPC / Feather (v2) files are memory-mapped, so uncompressed
+    columns are used in place without reading them into memory; Parquet
+    column chunks are read from a memory map and decoded.
+    """
+    pa = _import_pyarrow()
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+
+        return pq.read_table(_arrow_source(source), columns=list(columns), memory_map=True)
+    import pyarrow.ipc
+
+    # Record batches of a mapped file are views of it (unless compressed), so
+    # reading whole batches and keeping the columns costs nothing; a read with
+    # included_fields would copy even uncompressed columns
+    reader = pyarrow.ipc.open_file(pa.memory_map(source) if isinstance(source, str)
+                                   else _arrow_source(source))
+    schema = pa.schema([reader.schema.field(column) for column in columns])
+    return pa.Table.from_batches(
+        [reader.get_batch(i).select(list(columns)) for i in range(reader.num_record_batches)],
+        schema=schema
+    )
+
+
+def read_text_column(csv_file, column_name, fmt=None):
+    """
+    Read one text column of a CSV, Parquet or Arrow file
+
+    Only the requested column is parsed; the other columns are skipped.
+
+    Returns:
+        A list of strings for a CSV file; a TextStore sharing the column's
+        UTF-8 buffer for Parquet and Arrow files (see TextStore.from_arrow)
+
+    Raises:
+        ValueError: If the column does not exist
+    """
+    return read_text_columns(csv_file, [column_name], fmt)[column_name]
+
+
+def read_text_columns(csv_file, columns, fmt=None):
+    """
+    Read several text columns of a CSV, Parquet or Arrow file in one pass
+
+    csv_file may also be the contents of such a file as bytes, with fmt
+    (see input_format) telling which.
+
+    Returns:
+        Dict of column -> texts, as in read_text_column
+
+    Raises:
+        ValueError: If a column does not exist
+    """
+    fmt = fmt or input_format(csv_file)
+    for column in columns:
+        check_column(csv_file, column, fmt)
+    if fmt != 'csv':
+        table = read_arrow_table(csv_file, columns, fmt)
+        return {column: TextStore.from_arrow(table.column(column)) for column in columns}
+    import pandas as pd
+
+    source = io.BytesIO(csv_file) if isinstance(csv_file, (bytes, bytearray, memoryview)) else csv_file
+    frame = pd.read_csv(source, usecols=list(columns), dtype={column: str for column in columns})
+    return {column: frame[column].fillna('').tolist() for column in columns}
+
+
+def iter_arrow_text_chunks(path, column_name, chunk_rows, fmt):
+    """Yield TextStores of one Parquet or Arrow column, chunk_rows at a time"""
+    check_column(path, column_name, fmt)
+    if fmt == 'parquet':
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=[column_name]):
+            yield TextStore.from_arrow(batch.column(0))
+        return
+    # A memory-mapped Arrow column costs no memory until a chunk of it is read
+    column = read_arrow_table(path, [column_name], fmt).column(column_name)
+    for start in range(0, len(column), chunk_rows):
+        yield TextStore.from_arrow(column.slice(start, chunk_rows))
+
+
+def tfidf_vectors(items, vocabulary, idf, stop_words, analyzer=None, term_order=None):
+    """
+    Vectorize items like a fitted TfidfVectorizer would
+
+    Args:
+        items: Iterable of strings
+        vocabulary: Mapping of term -> column (or HashedFeatures)
+        idf: Inverse document frequency weight of each column
+        stop_words: Set of stop words removed before counting
+        analyzer: Tokeniser to use instead of words minus stop_words
+            (see make_analyzer)
+        term_order: Rank of every column by the first occurrence of its
+            term in the corpus (see weigh_counts)
+
+    Returns:
+        CSR matrix of L2-normalised TF-IDF rows
+    """
+    counts, indices, indptr = count_vectors(items, vocabulary, analyzer or make_analyzer(stop_words))
+    return weigh_counts(counts, indices, indptr, idf, term_order)
+
+
+def count_vectors(items, vocabulary, analyzer):
+    """
+    Count the vocabulary terms of every item
+
+    Returns:
+        (counts, indices, indptr) CSR arrays with sorted indices
+    """
+    data, indices, indptr = [], [], [0]
+    for item in items:
+        counts = {}
+        for token in analyzer(item):
+            col = vocabulary.get(token)
+            if col is not None:
+                counts[col] = counts.get(col, 0) + 1
+        cols = sorted(counts)
+        indices.extend(cols)
+        data.extend(counts[col] for col in cols)
+        indptr.append(len(indices))
+    return (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32),
+            np.asarray(indptr, dtype=np.int64))
+
+
+def weigh_counts(counts, indices, indptr, idf, term_order=None):
+    """
+    L2-normalised TF-IDF rows from CSR term counts, rounded like TfidfTransformer
+
+    Squares are summed in column order, like TfidfVectorizer.transform.
+    fit_transform stores (and sums) each row in the order the corpus first
+    met its terms instead; pass that rank of every column as term_order to
+    get its rows bit for bit. Indices stay sorted either way.
+    """
+    import scipy.sparse as sp
+
+    values = counts * idf[indices]
+    if term_order is None:
+        norms = sequential_row_norms(values, indptr)
+    else:
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        norms = sequential_row_norms(values[np.lexsort((term_order[indices], rows))], indptr)
+    norms[norms == 0] = 1.0
+    values /= np.repeat(norms, np.diff(indptr))
+    return sp.csr_matrix((values, indices, indptr), shape=(len(indptr) - 1, len(idf)))
+
+
+def reweight_rows(matrix, column_scale, deleted=None):
+    """
+    Rescale the columns of L2-normalised rows and normalise them again
+
+    Rows whose stored idf differs from the current idf by column_scale
+    become exactly the rows the current idf produces. Deleted rows are
+    zeroed so they never match.
+    """
+    import scipy.sparse as sp
+
+    matrix = sp.csr_matrix(matrix @ sp.diags(column_scale))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = np.inf
+    row_scale = 1.0 / norms
+    if deleted is not None:
+        row_scale[np.asarray(deleted)] = 0.0
+    matrix = sp.csr_matrix(sp.diags(row_scale) @ matrix)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def csr_dot(data, indices, indptr, vector, rows=None, block_nnz=1 << 20):
+    """
+    Product of CSR rows with a dense vector, with numpy only
+
+    Values are multiplied by the vector entries of their columns and summed
+    per row in stored order (the order scipy sums them in), block_nnz
+    values at a time so the temporaries stay small on large indexes.
+
+    Args:
+        data, indices, indptr: CSR arrays (may be memory-mapped)
+        vector: Dense vector with one entry per column
+        rows: Rows to score (default: all of them, in order)
+        block_nnz: Stored values multiplied per step
+
+    Returns:
+        float64 array with one dot product per row
+    """
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = np.asarray(indptr[rows], dtype=np.int64)
+        lengths = np.asarray(indptr[rows + 1], dtype=np.int64) - starts
+        # Positions of the stored values of every row, row after row
+        positions = np.arange(int(lengths.sum())) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        products = data[positions] * vector[indices[positions]]
+        return np.bincount(np.repeat(np.arange(len(rows)), lengths), weights=products,
+                           minlength=len(rows))
+
+    indptr = np.asarray(indptr, dtype=np.int64)
+    n_rows = len(indptr) - 1
+    result = np.zeros(n_rows)
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + block_nnz, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        lo, hi = indptr[start], indptr[stop]
+        if hi > lo:
+            products = data[lo:hi] * np.take(vector, indices[lo:hi])
+            row_ids = np.repeat(np.arange(stop - start), np.diff(indptr[start:stop + 1]))
+            result[start:stop] = np.bincount(row_ids, weights=products, minlength=stop - start)
+        start = stop
+    return result
+
+
+def narrowest_uint(max_value):
+    """Smallest unsigned dtype among uint16/uint32 holding max_value, else int64"""
+    for dtype in (np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def offset_dtype(total_bytes):
+    """dtype of text offsets: uint32 below 4 GiB of text, int64 above"""
+    return np.uint32 if total_bytes <= np.iinfo(np.uint32).max else np.int64
+
+
+def quantize_rows(data, indptr):
+    """
+    Quantize CSR values to uint8 with one scale per row
+
+    Every value becomes round(value / scale) with scale = row maximum / 255,
+    so the largest value of a row is exact and the others are off by at most
+    scale / 2.
+
+    Returns:
+        (codes, row_scale) as uint8 and float32 arrays
+    """
+    lengths = np.diff(indptr)
+    row_max = np.zeros(len(lengths), dtype=np.float64)
+    nonempty = lengths > 0
+    row_max[nonempty] = np.maximum.reduceat(np.abs(data), indptr[:-1][nonempty])
+    row_scale = (row_max / 255).astype(np.float32)
+    divisor = np.repeat(np.where(row_scale > 0, row_scale, 1).astype(np.float64), lengths)
+    codes = np.rint(data / divisor).clip(0, 255).astype(np.uint8)
+    return codes, row_scale
+
+
+def dequantize_rows(codes, indptr, row_scale):
+    """Float32 CSR values from quantize_rows() output"""
+    return codes.astype(np.float32) * np.repeat(row_scale, np.diff(indptr))
+
+
+def compact_matrix(matrix, precision):
+    """
+    The in-memory matrix an index of this precision holds
+
+    For uint8 the values are quantized and dequantized again, so a freshly
+    fit index scores like the same index after save() and load() (up to
+    float32 rounding of the row scales).
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}' (choose from {', '.join(PRECISIONS)})")
+    if precision == 'float64':
+        return matrix
+    import scipy.sparse as sp
+
+    data = np.asarray(matrix.data, dtype=np.float64)
+    if precision == 'uint8':
+        codes, row_scale = quantize_rows(data, matrix.indptr)
+        data = dequantize_rows(codes, matrix.indptr, row_scale)
+    return sp.csr_matrix((data.astype(np.float32), matrix.indices, matrix.indptr),
+                         shape=matrix.shape)
+
+
+def write_matrix_files(directory, matrix, precision='float64', n_features=None):
+    """Write the CSR arrays of matrix in the given precision"""
+    data, indices, indptr = matrix.data, matrix.indices, matrix.indptr
+    nnz = int(indptr[-1])
+    if precision == 'uint8':
+        data, row_scale = quantize_rows(np.asarray(data, dtype=np.float64), indptr)
+        np.save(os.path.join(directory, 'row_scale.npy'), row_scale)
+        # Loading copies uint8 matrices anyway, so the column ids can be narrow too
+        indices = indices.astype(narrowest_uint((n_features or matrix.shape[1]) - 1))
+    else:
+        data = data.astype(MATRIX_DTYPES[precision])
+    np.save(os.path.join(directory, 'data.npy'), data)
+    np.save(os.path.join(directory, 'indices.npy'), indices)
+    np.save(os.path.join(directory, 'indptr.npy'),
+            indptr.astype(np.int32 if nnz < 2**31 else np.int64))
+
+
+def precision_report(matrix, precision, sample_rows, threshold=0.7, top_k=10):
+    """
+    Compare the rankings of a compacted matrix with the float64 matrix
+
+    Every sampled row is used as a query against both matrices (its own row
+    included).
+
+    Returns:
+        Dict with the bytes of both matrices, the largest absolute score
+        error, the mean overlap of the top_k rows, the fraction of queries
+        whose top_k order is unchanged and the agreement on which rows pass
+        the threshold. resident_bytes is what a loaded index holds; for
+        uint8 it is the float32 copy, and memory_mapped is False.
+    """
+    import scipy.sparse as sp
+
+    reference = sp.csr_matrix(matrix, dtype=np.float64)
+    compact = compact_matrix(reference, precision)
+    max_error = overlap = same_order = 0.0
+    expected = found = 0
+    for row in sample_rows:
+        query = reference[row].toarray()[0]
+        before = np.asarray(reference @ query).ravel()
+        after = np.asarray(compact @ query).ravel()
+        max_error = max(max_error, float(np.abs(before - after).max()))
+        k = min(top_k, len(before))
+        # Stable sorts break ties by row, like top_matches
+        top_before = np.argsort(-before, kind='stable')[:k]
+        top_after = np.argsort(-after, kind='stable')[:k]
+        overlap += len(np.intersect1d(top_before, top_after)) / max(1, k)
+        same_order += np.array_equal(top_before, top_after)
+        passed = before >= threshold
+        expected += int(np.count_nonzero(passed))
+        found += int(np.count_nonzero(passed & (after >= threshold)))
+
+    n_queries = max(1, len(sample_rows))
+    if precision == 'uint8':
+        stored_bytes = compact.nnz * (1 + np.dtype(narrowest_uint(matrix.shape[1] - 1)).itemsize) + 4 * matrix.shape[0]
+    else:
+        stored_bytes = compact.data.nbytes + compact.indices.nbytes
+    return {
+        'precision': precision,
+        'queries': len(sample_rows),
+        'top_k': top_k,
+        'threshold': threshold,
+        'float64_bytes': int(reference.data.nbytes + reference.indices.nbytes + reference.indptr.nbytes),
+        'stored_bytes': int(stored_bytes + compact.indptr.nbytes),
+        'resident_bytes': int(compact.data.nbytes + compact.indices.nbytes + compact.indptr.nbytes),
+        'memory_mapped': precision != 'uint8',
+        'max_score_error': max_error,
+        'topk_overlap': overlap / n_queries,
+        'same_order_fraction': same_order / n_queries,
+        'threshold_recall': found / expected if expected else 1.0,
+    }
+
+
+class TextStore:
+    """
+    Row texts kept in one UTF-8 buffer addressed by byte offsets
+
+    A TextStore is a read-only sequence of str, so it can be fit on
+    directly instead of a list: each text is decoded when iterated.
+    """
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    @classmethod
+    def from_list(cls, texts):
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        offsets = offsets.astype(offset_dtype(offsets[-1]))
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(buffer, offsets)
+
+    @classmethod
+    def from_arrow(cls, column):
+        """
+        Texts of a pyarrow string column (Array or ChunkedArray)
+
+        Arrow already keeps strings as one UTF-8 buffer plus offsets, so a
+        single-chunk column without nulls (e.g. from a memory-mapped Arrow
+        file) is used in place; only the offsets are copied. Other columns
+        are combined, have nulls replaced by '' and are cast to strings
+        first, like read_csv(dtype=str).fillna('').
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if isinstance(column, pa.ChunkedArray):
+            column = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        if not (pa.types.is_string(column.type) or pa.types.is_large_string(column.type)):
+            column = column.cast(pa.large_string())
+        if column.null_count:
+            column = pc.fill_null(column, '')
+        if len(column) == 0:
+            return cls.from_list([])
+        _, offsets, data = column.buffers()
+        offsets = np.frombuffer(offsets, dtype=np.int64 if pa.types.is_large_string(column.type)
+                                else np.int32)[column.offset:column.offset + len(column) + 1]
+        start, end = int(offsets[0]), int(offsets[-1])
+        buffer = np.frombuffer(data, dtype=np.uint8)[start:end] if data is not None and end > start \
+            else np.zeros(0, dtype=np.uint8)
+        return cls(buffer, (offsets - start).astype(offset_dtype(end - start)))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            # A contiguous range of rows, sharing this buffer
+            first, last, step = idx.indices(len(self))
+            if step != 1:
+                raise ValueError("TextStore slices must be contiguous")
+            last = max(first, last)
+            offsets = self.offsets[first:last + 1]
+            start = int(offsets[0])
+            return TextStore(self.buffer[start:int(offsets[-1])], offsets - offsets.dtype.type(start))
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.buffer[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        # Decode straight from the buffer, converting offsets block by block
+        data, block = memoryview(self.buffer), 1 << 16
+        for first in range(0, len(self), block):
+            bounds = self.offsets[first:first + block + 1].tolist()
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                yield str(data[start:end], 'utf-8')
+
+    def take(self, indices):
+        """Return the texts of several rows as a list"""
+        return [self[int(idx)] for idx in indices]
+
+
+def as_text_store(texts):
+    """texts as a TextStore (a list of strings is encoded once)"""
+    return texts if isinstance(texts, TextStore) else TextStore.from_list(texts)
+
+
+class TfidfIndex:
+    """
+    A fitted TF-IDF model together with the matrix of the indexed rows
+
+    Attributes:
+        feature_names: Array of vocabulary terms, one per matrix column
+            (HashedFeatures for a hashed feature space)
+        vocabulary: Mapping of term -> column (HashedFeatures when hashed)
+        idf: Inverse document frequency weight of each column
+        stop_words: Set of stop words removed before counting
+        analyze: Tokeniser of the index (words or character n-grams)
+        matrix: CSR matrix of L2-normalised TF-IDF rows
+        texts: TextStore with the original text of every row
+        meta: Dict describing how the index was built
+        doc_freq: Document frequency of each column over the live rows
+        deleted: Boolean tombstone per row, or None if nothing was deleted
+        fields: For a multi-column index, one (column, scale, vocabulary,
+            start, stop) tuple per field, where start:stop are its matrix
+            columns; None for a single-column index
+    """
+
+    def __init__(self, feature_names, idf, stop_words, matrix, texts, meta=None,
+                 doc_freq=None, deleted=None):
+        if isinstance(feature_names, HashedFeatures):
+            self.feature_names = self.vocabulary = feature_names
+        else:
+            self.feature_names = np.asarray(feature_names, dtype=object)
+            self.vocabulary = {term: i for i, term in enumerate(self.feature_names)}
+        self.idf = idf
+        self.stop_words = frozenset(stop_words or ())
+        if isinstance(matrix, tuple):
+            # Raw (data, indices, indptr, shape) of a loaded index; the scipy
+            # matrix is only built when a sparse code path asks for it
+            self._matrix, self._arrays = None, matrix
+        else:
+            self.matrix = matrix
+        self.texts = texts
+        self.meta = meta or {}
+        self.doc_freq = document_frequency(self.matrix) if doc_freq is None else doc_freq
+        self.deleted = deleted
+        self.analyze = make_analyzer(self.stop_words, self.meta.get('char_ngrams'))
+        self.fields = None
+        if self.meta.get('fields'):
+            self.fields = self._field_blocks(self.meta['fields'])
+
+    def _field_blocks(self, fields):
+        total = sum(field['weight'] for field in fields)
+        blocks, start = [], 0
+        for field in fields:
+            stop = start + field['n_features']
+            prefix = len(field['column']) + 1
+            vocabulary = {term[prefix:]: col for col, term in
+                          enumerate(self.feature_names[start:stop])}
+            blocks.append((field['column'], math.sqrt(field['weight'] / total), vocabulary,
+                           start, stop))
+            start = stop
+        return blocks
+
+    @classmethod
+    def from_texts(cls, text_data, max_features=5000, meta=None, hash_features=None, n_jobs=1,
+                   precision='float64', char_ngrams=None):
+        """
+        Fit a TfidfVectorizer on text_data and wrap the result
+
+        With hash_features, tokens are hashed into that many columns
+        instead of fitting a vocabulary (max_features is then unused).
+        With n_jobs other than 1 (None for all cores), the vocabulary fit is
+        sharded across processes (see parallel_fit.py); the result is the same.
+        The matrix is then kept in the given precision (see PRECISIONS).
+        With char_ngrams (min_n, max_n), rows are tokenised into character
+        n-grams of words instead of words.
+        """
+        meta = dict(meta or {}, char_ngrams=list(char_ngrams) if char_ngrams else None)
+        if hash_features:
+            index = cls._from_texts_hashed(text_data, hash_features, meta)
+        elif n_jobs != 1 and (n_jobs or os.cpu_count() or 1) > 1:
+            from parallel_fit import fit_tfidf_parallel
+
+            index = fit_tfidf_parallel(text_data, max_features, n_jobs, meta, char_ngrams)
+        else:
+            index = cls._from_texts_fitted(text_data, max_features, meta)
+        index.matrix = compact_matrix(index.matrix, precision)
+        index.meta['precision'] = precision
+        return index
+
+    @classmethod
+    def from_fields(cls, fields, columns, max_features=5000, meta=None, n_jobs=1,
+                    precision='float64', char_ngrams=None):
+        """
+        Fit one TF-IDF model per column and stack them into one weighted index
+
+        Args:
+            fields: List of (column, weight) pairs
+            columns: Dict of column -> list of strings, all of the same length
+            max_features: Max TF-IDF features of each column
+            meta: Extra meta entries stored with the index
+            n_jobs: Processes fitting each column (see from_texts)
+            precision: Precision of the stacked matrix (see PRECISIONS)
+            char_ngrams: Character n-gram range of every column (see from_texts)
+        """
+        import scipy.sparse as sp
+
+        fields = column_fields(fields)
+        total = sum(weight for _, weight in fields)
+        blocks, feature_names, idf, doc_freq, field_meta = [], [], [], [], []
+        for column, weight in fields:
+            part = cls.from_texts(columns[column], max_features, n_jobs=n_jobs,
+                                  char_ngrams=char_ngrams)
+            blocks.append(part.matrix * math.sqrt(weight / total))
+            feature_names.extend(f"{column}:{term}" for term in part.feature_names)
+            idf.append(part.idf)
+            doc_freq.append(part.doc_freq)
+            field_meta.append({'column': column, 'weight': weight,
+                               'n_features': len(part.feature_names)})
+            stop_words = part.stop_words
+
+        matrix = sp.hstack(blocks, format='csr')
+        matrix.sort_indices()
+        texts = [join_fields(values) for values in zip(*(columns[column] for column, _ in fields))]
+
+        meta = dict(meta or {})
+        meta.update({
+            'format_version': INDEX_FORMAT_VERSION,
+            'max_features': max_features,
+            'n_rows': matrix.shape[0],
+            'fields': field_meta,
+            'precision': precision,
+            'char_ngrams': list(char_ngrams) if char_ngrams else None,
+        })
+        return cls(feature_names, np.concatenate(idf), stop_words, compact_matrix(matrix, precision),
+                   TextStore.from_list(texts), meta, np.concatenate(doc_freq))
+
+    @classmethod
+    def _from_texts_fitted(cls, text_data, max_features, meta=None):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        char_ngrams = (meta or {}).get('char_ngrams')
+        if char_ngrams:
+            tfidf_vectorizer = TfidfVectorizer(
+                max_features=max_features,
+                analyzer='char_wb',
+                ngram_range=tuple(char_ngrams)
+            )
+        else:
+            tfidf_vectorizer = TfidfVectorizer(
+                max_features=max_features,
+                stop_words='english'
+            )
+        tfidf_matrix = tfidf_vectorizer.fit_transform(text_data).tocsr()
+        tfidf_matrix.sort_indices()
+
+        meta = dict(meta or {})
+        meta.update({
+            'format_version': INDEX_FORMAT_VERSION,
+            'max_features': max_features,
+            'n_rows': tfidf_matrix.shape[0],
+        })
+        return cls(
+            tfidf_vectorizer.get_feature_names_out(),
+            tfidf_vectorizer.idf_,
+            tfidf_vectorizer.get_stop_words(),
+            tfidf_matrix,
+            as_text_store(text_data),
+            meta
+        )
+
+    @classmethod
+    def _from_texts_hashed(cls, text_data, hash_features, meta=None):
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+        features = HashedFeatures(hash_features)
+        stop_words = () if (meta or {}).get('char_ngrams') else ENGLISH_STOP_WORDS
+        analyzer = make_analyzer(stop_words, (meta or {}).get('char_ngrams'))
+        counts, indices, indptr = count_vectors(text_data, features, analyzer)
+        doc_freq = np.bincount(indices, minlength=hash_features).astype(np.int64)
+        idf = smooth_idf(doc_freq, len(text_data))
+        tfidf_matrix = weigh_counts(counts, indices, indptr, idf)
+
+        meta = dict(meta or {})
+        meta.update({
+            'format_version': INDEX_FORMAT_VERSION,
+            'max_features': None,
+            'hash_features': hash_features,
+            'n_rows': tfidf_matrix.shape[0],
+        })
+        return cls(features, idf, stop_words, tfidf_matrix,
+                   as_text_store(text_data), meta, doc_freq)
+
+    @property
+    def matrix(self):
+        """CSR matrix of the rows (imports scipy on first use)"""
+        if self._matrix is None:
+            import scipy.sparse as sp
+
+            data, indices, indptr, shape = self._arrays
+            self._matrix = sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+        return self._matrix
+
+    @matrix.setter
+    def matrix(self, matrix):
+        self._matrix, self._arrays = matrix, None
+
+    @property
+    def csr_arrays(self):
+        """(data, indices, indptr) of the matrix, without building it"""
+        if self._matrix is not None:
+            return self._matrix.data, self._matrix.indices, self._matrix.indptr
+        return self._arrays[:3]
+
+    def __len__(self):
+        return len(self.csr_arrays[2]) - 1
+
+    @property
+    def precision(self):
+        return self.meta.get('precision', 'float64')
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the index arrays (mapped or in RAM)"""
+        arrays = [*self.csr_arrays, self.texts.buffer, self.texts.offsets, self.idf, self.doc_freq]
+        if self.deleted is not None:
+            arrays.append(self.deleted)
+        vocabulary_bytes = 0
+        if not isinstance(self.feature_names, HashedFeatures):
+            # Term strings, plus the object array and vocabulary dict pointing at them
+            vocabulary_bytes = sum(len(term) for term in self.feature_names) + 120 * len(self.feature_names)
+        return sum(np.asarray(a).nbytes for a in arrays) + vocabulary_bytes
+
+    def transform(self, items):
+        """
+        Vectorize items with the fitted vocabulary and idf weights
+
+        Items of a multi-column index are dicts of column -> text; a plain
+        string is matched against every column.
+        """
+        if self.fields is None:
+            return tfidf_vectors(items, self.vocabulary, self.idf, self.stop_words, self.analyze)
+        import scipy.sparse as sp
+
+        blocks = []
+        for column, scale, vocabulary, start, stop in self.fields:
+            values = [item.get(column, '') if isinstance(item, dict) else item for item in items]
+            vectors = tfidf_vectors(values, vocabulary, np.asarray(self.idf[start:stop]),
+                                    self.stop_words, self.analyze)
+            blocks.append(vectors * scale)
+        return sp.hstack(blocks, format='csr')
+
+    def item_text(self, item):
+        """Display text of a query item (a string, or a dict of fields)"""
+        if isinstance(item, dict):
+            columns = [field[0] for field in self.fields] if self.fields else list(item)
+            return join_fields(item.get(column, '') for column in columns)
+        return item
+
+    def similarities(self, item_vector):
+        """Cosine similarity of one vectorized item against every row"""
+        return np.asarray(self.matrix @ item_vector.toarray()[0]).ravel()
+
+    def dense_vector(self, item):
+        """
+        One item vectorized like transform([item]), as a dense array
+
+        Needs numpy only, so a single query against a loaded index never
+        imports scipy (see dense_similarities).
+        """
+        vector = np.zeros(len(self.idf))
+        if self.fields is None:
+            blocks = [(item, 1.0, self.vocabulary, 0, len(self.idf))]
+        else:
+            blocks = [(item.get(column, '') if isinstance(item, dict) else item, scale, vocabulary,
+                       start, stop) for column, scale, vocabulary, start, stop in self.fields]
+        for text, scale, vocabulary, start, stop in blocks:
+            block = vector[start:stop]
+            for token in self.analyze(text):
+                col = vocabulary.get(token)
+                if col is not None:
+                    block[col] += 1
+            block *= self.idf[start:stop]
+            norm = math.sqrt(block @ block)
+            if norm > 0:
+                block /= norm
+                block *= scale
+        return vector
+
+    def dense_similarities(self, vector, rows=None):
+        """Cosine similarity of a dense_vector() against every row (or rows), with numpy only"""
+        return csr_dot(*self.csr_arrays, vector, rows)
+
+    def save(self, index_dir):
+        """Write the index to index_dir, replacing any previous index"""
+        self.meta['revision'] = next_revision(index_dir)
+        tmp_dir = index_dir.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        write_matrix_files(tmp_dir, self.matrix, self.precision)
+        np.save(os.path.join(tmp_dir, 'text_offsets.npy'),
+                np.asarray(self.texts.offsets).astype(offset_dtype(self.texts.offsets[-1])))
+        with open(os.path.join(tmp_dir, 'texts.bin'), 'wb') as f:
+            f.write(self.texts.buffer.tobytes())
+        np.save(os.path.join(tmp_dir, 'doc_freq.npy'), self.doc_freq)
+        if self.deleted is not None:
+            np.save(os.path.join(tmp_dir, 'deleted.npy'), self.deleted)
+        write_model_files(tmp_dir, self.feature_names, self.idf, self.stop_words, self.meta)
+
+        replace_index_dir(tmp_dir, index_dir)
+
+    @classmethod
+    def load(cls, index_dir, mmap=True, reweight=True):
+        """
+        Load an index written by save(), memory-mapping its arrays
+
+        An index with pending incremental updates is reweighted to its
+        current idf here (unless reweight is False), which copies the
+        matrix into memory until the index is compacted. A uint8 index is
+        dequantized into memory. Only an update reweighting imports scipy.
+        """
+        mmap_mode = 'r' if mmap else None
+
+        def load_array(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode=mmap_mode)
+
+        meta = read_meta(index_dir)
+        if meta.get('hash_features'):
+            feature_names = HashedFeatures(meta['hash_features'])
+        else:
+            with open(os.path.join(index_dir, 'vocabulary.json')) as f:
+                feature_names = json.load(f)
+        with open(os.path.join(index_dir, 'stop_words.json')) as f:
+            stop_words = json.load(f)
+
+        data, indices, indptr = load_array('data.npy'), load_array('indices.npy'), load_array('indptr.npy')
+        precision = meta.get('precision', 'float64')
+        if precision == 'uint8':
+            data = dequantize_rows(data, indptr, np.load(os.path.join(index_dir, 'row_scale.npy')))
+            indices = indices.astype(np.int32)
+        matrix = (data, indices, indptr, (meta['n_rows'], meta['n_features']))
+        texts_path = os.path.join(index_dir, 'texts.bin')
+        if mmap and os.path.getsize(texts_path) > 0:
+            buffer = np.memmap(texts_path, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(texts_path, dtype=np.uint8)
+        texts = TextStore(buffer, load_array('text_offsets.npy'))
+
+        idf = load_array('idf.npy')
+        doc_freq = np.load(os.path.join(index_dir, 'doc_freq.npy'))
+        deleted_path = os.path.join(index_dir, 'deleted.npy')
+        deleted = np.load(deleted_path) if os.path.exists(deleted_path) else None
+        if reweight and meta.get('updates'):
+            import scipy.sparse as sp
+
+            current_idf = smooth_idf(doc_freq, meta['n_docs'])
+            matrix = sp.csr_matrix(matrix[:3], shape=matrix[3], copy=False)
+            matrix = reweight_rows(matrix, current_idf / idf, deleted)
+            matrix.data = matrix.data.astype(MATRIX_DTYPES[precision], copy=False)
+            idf = current_idf
+
+        return cls(feature_names, idf, stop_words, matrix, texts, meta, doc_freq, deleted)
+
+
+def write_model_files(directory, feature_names, idf, stop_words, meta):
+    """Write the vocabulary, idf, stop words and meta.json of an index"""
+    np.save(os.path.join(directory, 'idf.npy'), idf)
+    hashed = isinstance(feature_names, HashedFeatures)
+    with open(os.path.join(directory, 'vocabulary.json'), 'w') as f:
+        json.dump([] if hashed else list(feature_names), f)
+    with open(os.path.join(directory, 'stop_words.json'), 'w') as f:
+        json.dump(sorted(stop_words), f)
+    meta = dict(meta, n_features=len(feature_names))
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def replace_index_dir(tmp_dir, index_dir):
+    """Swap a finished index in so readers never see half an index"""
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+
+def read_meta(index_dir):
+    """Return the meta.json of an index directory"""
+    with open(os.path.join(index_dir, META_FILE)) as f:
+        return json.load(f)
+
+
+def next_revision(index_dir):
+    """
+    Revision of the next index written to index_dir: one more than the
+    revision of the index there now (1 for a new directory)
+    """
+    try:
+        return read_meta(index_dir).get('revision', 0) + 1
+    except (OSError, ValueError):
+        return 1
+
+
+def write_meta(index_dir, meta):
+    """Replace the meta.json of an index directory atomically"""
+    path = os.path.join(index_dir, META_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def index_staleness(index_dir, csv_file, column_name, max_features, hash_features=None,
+                    char_ngrams=None):
+    """
+    Check whether an index directory still matches its source
+
+    Returns:
+        None if the index is up to date, otherwise a short reason string
+    """
+    try:
+        meta = read_meta(index_dir)
+    except (OSError, ValueError):
+        return "no index found"
+
+    if meta.get('format_version') != INDEX_FORMAT_VERSION:
+        return "index format changed"
+    if meta.get('column') != field_spec(column_name):
+        previous = format_fields(meta['column']) if meta.get('column') else None
+        return f"column changed ({previous} -> {format_fields(column_name)})"
+    if meta.get('hash_features') != hash_features:
+        return f"hash_features changed ({meta.get('hash_features')} -> {hash_features})"
+    if not hash_features and meta.get('max_features') != max_features:
+        return f"max_features changed ({meta.get('max_features')} -> {max_features})"
+    char_ngrams = list(char_ngrams) if char_ngrams else None
+    if meta.get('char_ngrams') != char_ngrams:
+        return f"char_ngrams changed ({meta.get('char_ngrams')} -> {char_ngrams})"
+
+    source = meta.get('source', {})
+    if source.get('path') != os.path.abspath(csv_file):
+        return "source file changed"
+    stat = os.stat(csv_file)
+    if source.get('size') == stat.st_size and source.get('mtime_ns') == stat.st_mtime_ns:
+        return None
+    # Size or mtime moved: only the content hash can tell if the data changed
+    if source.get('sha256') != file_sha256(csv_file):
+        return "CSV content changed"
+
+    # Same content under a new mtime: remember it so the next check is cheap
+    source.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    write_meta(index_dir, meta)
+    return None
+
+
+def build_index(csv_file, column_name, max_features=5000, index_dir=None, memory_budget_mb=None,
+                hash_features=None, n_jobs=1, precision='float64', char_ngrams=None):
+    """
+    Fit a TF-IDF index on one column, or several weighted columns, of a CSV file
+
+    Args:
+        csv_file: Path to CSV file
+        column_name: Name of the column to analyze, or a list of
+            (column, weight) pairs for a multi-column index
+        max_features: Max TF-IDF features (default: 5000, per column)
+        index_dir: If given, the index is also saved to this directory
+        memory_budget_mb: If given, stream the CSV in chunks so peak memory
+            stays near this budget (requires index_dir)
+        hash_features: If given, hash tokens into this many columns instead
+            of fitting a vocabulary
+        n_jobs: Processes fitting the vocabulary in memory (default: 1,
+            None for all cores)
+        precision: 'float64' (default), 'float32' or 'uint8' matrix values
+        char_ngrams: (min_n, max_n) to index character n-grams of words
+            instead of words, for typo-tolerant matching
+
+    Returns:
+        TfidfIndex
+    """
+    column_name = field_spec(column_name)
+    if not isinstance(column_name, str):
+        if memory_budget_mb or hash_features:
+            raise ValueError("Multi-column indexes support neither a memory budget nor hashing")
+        fields = column_fields(column_name)
+        index = TfidfIndex.from_fields(
+            fields,
+            read_text_columns(csv_file, [column for column, _ in fields]),
+            max_features=max_features,
+            meta={'source': file_fingerprint(csv_file), 'column': column_name},
+            n_jobs=n_jobs,
+            precision=precision,
+            char_ngrams=char_ngrams
+        )
+        if index_dir:
+            index.save(index_dir)
+        return index
+
+    if memory_budget_mb:
+        if not index_dir:
+            raise ValueError("A memory budget needs an index directory to stream into")
+        from ingest import build_index_streaming
+
+        build_index_streaming(csv_file, column_name, index_dir, max_features, memory_budget_mb,
+                              hash_features=hash_features, precision=precision,
+                              char_ngrams=char_ngrams)
+        return TfidfIndex.load(index_dir)
+
+    text_data = read_text_column(csv_file, column_name)
+    index = TfidfIndex.from_texts(
+        text_data,
+        max_features=max_features,
+        meta={'source': file_fingerprint(csv_file), 'column': column_name},
+        hash_features=hash_features,
+        n_jobs=n_jobs,
+        precision=precision,
+        char_ngrams=char_ngrams
+    )
+    if index_dir:
+        index.save(index_dir)
+    return index
+
+
+def load_or_build_index(index_dir, csv_file=None, column_name=None, max_features=None,
+                        hash_features=None, char_ngrams=None):
+    """
+    Load a saved index, rebuilding it first if it no longer matches its source
+
+    Any argument left as None is taken from the saved index, so an existing
+    index can be opened just by its directory. An index changed by update or
+    compact (see incremental.py) is never rebuilt: a rebuild from the CSV
+    would drop its appended rows and bring its deleted rows back, so a stale
+    one raises ValueError until it is rebuilt explicitly with build-index.
+
+    Returns:
+        (TfidfIndex, reason) where reason is None if the saved index was
+        reused and a string explaining why it was rebuilt otherwise
+    """
+    try:
+        meta = read_meta(index_dir)
+    except (OSError, ValueError):
+        meta = {}
+
+    if meta.get('shard'):
+        # One shard of a sharded index (see shards.py) is never rebuilt on its own
+        return TfidfIndex.load(index_dir), None
+
+    csv_file = csv_file or meta.get('source', {}).get('path')
+    column_name = column_name or meta.get('column')
+    max_features = max_features or meta.get('max_features', 5000)
+    hash_features = hash_features or meta.get('hash_features')
+    char_ngrams = char_ngrams or meta.get('char_ngrams')
+    if not csv_file or not column_name:
+        raise ValueError(f"No index in '{index_dir}' and no CSV file/column to build one")
+
+    if not os.path.exists(csv_file):
+        if not meta:
+            raise FileNotFoundError(csv_file)
+        # Source is gone; the saved index is the best data we have
+        return TfidfIndex.load(index_dir), None
+
+    reason = index_staleness(index_dir, csv_file, column_name, max_features, hash_features,
+                             char_ngrams)
+    if reason is None:
+        return TfidfIndex.load(index_dir), None
+    if meta.get('updates') or meta.get('compacted'):
+        raise ValueError(
+            f"Index '{index_dir}' is out of date ({reason}) but has incremental updates that "
+            f"rebuilding it from {csv_file} would drop. Run build-index to rebuild it from the "
+            f"CSV (discarding the updates); compact only folds the updates into the index")
+
+    # Rebuild the way the index was built before (streamed or in memory)
+    build_index(csv_file, column_name, max_features, index_dir, meta.get('memory_budget_mb'),
+                hash_features, precision=meta.get('precision', 'float64'),
+                char_ngrams=char_ngrams)
+    return TfidfIndex.load(index_dir), reason